@@ -7,6 +7,10 @@ from datetime import datetime, timedelta
 import smtplib
 from email.mime.text import MIMEText
 
+from db import get_connection
+from desnormalizacion import DATOS_DESNORMALIZADOS, dispositivos_posibles
+from topologia import topologia
+
 # /c:/Users/Alienware/Desktop/Proyectos software/api_sensores/alertas.py
 
 alertas_bp = Blueprint("alertas", __name__)
@@ -96,16 +100,6 @@ def listar_alertas():
 
 # Controladores de validación
 
-def _get_db_config():
-    """Obtiene la configuración de la base de datos desde variables de entorno"""
-    return {
-        "user": os.getenv("DB_USER"),
-        "password": os.getenv("DB_PASSWORD"),
-        "host": os.getenv("DB_HOST"),
-        "database": os.getenv("DB_NAME"),
-        "port": int(os.getenv("DB_PORT", 3306)),
-    }
-
 def _update_alert_last_validation(alert_id, validation_date):
     """Actualiza la fecha de última validación de una alerta específica"""
     alerts = _read_alerts()
@@ -125,6 +119,37 @@ def _update_alert_last_validation(alert_id, validation_date):
 
 
 # Funciones de Validaciones Parametros
+def _condicion_parametro(device_id, parameter, alias="d", cursor=None):
+    """
+    Condición SQL y parámetros para las filas de `datos` (alias `alias`) del
+    parámetro "modelo [descripcion (unidad)]" en el dispositivo, por id_sensor
+    e id_variable según la topología en memoria, en lugar de comparar
+    CONCAT(st.modelo, ...) fila por fila. Si el dispositivo no tiene el
+    parámetro la condición es FALSE. Con DATOS_DESNORMALIZADOS se agrega el
+    filtro por `alias`.id_dispositivo (o NULL, filas aún sin rellenar), que usa
+    el índice (id_dispositivo, fecha).
+    Si la topología debe recargarse se lee con `cursor` (la conexión de la validación).
+    """
+    sensores = topologia.sensores_parametro(device_id, parameter, cursor)
+    if not sensores:
+        return "FALSE", []
+    condiciones = []
+    params = []
+    for id_variable, ids_sensor in sorted(sensores.items()):
+        condiciones.append(f"({alias}.id_variable = %s AND {alias}.id_sensor IN ({','.join(['%s'] * len(ids_sensor))}))")
+        params.append(id_variable)
+        params.extend(ids_sensor)
+    condicion = "(" + " OR ".join(condiciones) + ")"
+    if DATOS_DESNORMALIZADOS:
+        dispositivos = dispositivos_posibles([device_id], cursor)
+        condicion = (
+            f"(({alias}.id_dispositivo IN ({','.join(['%s'] * len(dispositivos))}) "
+            f"OR {alias}.id_dispositivo IS NULL) AND {condicion})"
+        )
+        params = dispositivos + params
+    return condicion, params
+
+
 def _validate_missing_value_for_alert(alert):
     """
     Valida si hay valores nulos o vacíos para el parámetro especificado en la alerta
@@ -136,8 +161,7 @@ def _validate_missing_value_for_alert(alert):
         dict: Resultado de la validación
     """
     try:
-        config = _get_db_config()
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
         
         project_id = alert["projectId"]
@@ -187,40 +211,31 @@ def _validate_missing_value_for_alert(alert):
         devices_with_issues = []
         
         for device_id, codigo_interno in project_devices:
+            # Sensores y variables del parámetro en el dispositivo (por id, usa los índices de `datos`)
+            condicion, params_parametro = _condicion_parametro(device_id, parameter, cursor=cursor)
+
             # Buscar valores NULL, vacíos o que falten completamente
-            null_values_query = """
+            null_values_query = f"""
                 SELECT d.id_dato, d.fecha, d.valor
                 FROM sensores_dev.datos AS d
-                LEFT JOIN sensores_dev.variables AS v ON d.id_variable = v.id_variable
-                LEFT JOIN sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
-                LEFT JOIN sensores_dev.sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
-                LEFT JOIN sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
-                LEFT JOIN sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
-                WHERE disp.id_dispositivo = %s
-                AND CONCAT(st.modelo, ' [', v.descripcion, ' (', v.unidad, ')]') = %s
+                WHERE {condicion}
                 AND d.fecha >= %s AND d.fecha <= %s
                 AND (d.valor IS NULL OR d.valor = '' OR d.valor = 0)
                 ORDER BY d.fecha DESC
             """
             
-            cursor.execute(null_values_query, [device_id, parameter, start_time, end_time])
+            cursor.execute(null_values_query, [*params_parametro, start_time, end_time])
             null_results = cursor.fetchall()
             
             # También verificar si no hay datos en absoluto
-            total_count_query = """
+            total_count_query = f"""
                 SELECT COUNT(*) as total
                 FROM sensores_dev.datos AS d
-                LEFT JOIN sensores_dev.variables AS v ON d.id_variable = v.id_variable
-                LEFT JOIN sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
-                LEFT JOIN sensores_dev.sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
-                LEFT JOIN sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
-                LEFT JOIN sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
-                WHERE disp.id_dispositivo = %s
-                AND CONCAT(st.modelo, ' [', v.descripcion, ' (', v.unidad, ')]') = %s
+                WHERE {condicion}
                 AND d.fecha >= %s AND d.fecha <= %s
             """
             
-            cursor.execute(total_count_query, [device_id, parameter, start_time, end_time])
+            cursor.execute(total_count_query, [*params_parametro, start_time, end_time])
             total_count = cursor.fetchone()[0]
             
             if null_results or total_count == 0:
@@ -334,8 +349,7 @@ def _validate_range_threshold_for_alert(alert):
         dict: Resultado de la validación
     """
     try:
-        config = _get_db_config()
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
         
         project_id = alert["projectId"]
@@ -404,42 +418,33 @@ def _validate_range_threshold_for_alert(alert):
         devices_with_issues = []
         
         for device_id, codigo_interno in project_devices:
+            # Sensores y variables del parámetro en el dispositivo (por id, usa los índices de `datos`)
+            condicion, params_parametro = _condicion_parametro(device_id, parameter, cursor=cursor)
+
             # Consultar valores que exceden el umbral según el operador
             threshold_query = f"""
                 SELECT d.id_dato, d.fecha, d.valor
                 FROM sensores_dev.datos AS d
-                LEFT JOIN sensores_dev.variables AS v ON d.id_variable = v.id_variable
-                LEFT JOIN sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
-                LEFT JOIN sensores_dev.sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
-                LEFT JOIN sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
-                LEFT JOIN sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
-                WHERE disp.id_dispositivo = %s
-                AND CONCAT(st.modelo, ' [', v.descripcion, ' (', v.unidad, ')]') = %s
+                WHERE {condicion}
                 AND d.fecha >= %s AND d.fecha <= %s
                 AND d.valor IS NOT NULL
                 AND CAST(d.valor AS DECIMAL(10,2)) {operador} %s
                 ORDER BY d.fecha DESC
             """
             
-            cursor.execute(threshold_query, [device_id, parameter, start_time, end_time, limite])
+            cursor.execute(threshold_query, [*params_parametro, start_time, end_time, limite])
             threshold_results = cursor.fetchall()
             
             # Contar el total de mediciones válidas para contexto
-            total_count_query = """
+            total_count_query = f"""
                 SELECT COUNT(*) as total
                 FROM sensores_dev.datos AS d
-                LEFT JOIN sensores_dev.variables AS v ON d.id_variable = v.id_variable
-                LEFT JOIN sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
-                LEFT JOIN sensores_dev.sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
-                LEFT JOIN sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
-                LEFT JOIN sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
-                WHERE disp.id_dispositivo = %s
-                AND CONCAT(st.modelo, ' [', v.descripcion, ' (', v.unidad, ')]') = %s
+                WHERE {condicion}
                 AND d.fecha >= %s AND d.fecha <= %s
                 AND d.valor IS NOT NULL
             """
             
-            cursor.execute(total_count_query, [device_id, parameter, start_time, end_time])
+            cursor.execute(total_count_query, [*params_parametro, start_time, end_time])
             total_count = cursor.fetchone()[0]
             
             if threshold_results:
@@ -560,8 +565,7 @@ def _validate_between_range_for_alert(alert):
         dict: Resultado de la validación
     """
     try:
-        config = _get_db_config()
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
         
         project_id = alert["projectId"]
@@ -651,42 +655,33 @@ def _validate_between_range_for_alert(alert):
         devices_with_issues = []
         
         for device_id, codigo_interno in project_devices:
+            # Sensores y variables del parámetro en el dispositivo (por id, usa los índices de `datos`)
+            condicion, params_parametro = _condicion_parametro(device_id, parameter, cursor=cursor)
+
             # Consultar valores que cumplen la condición de rango
             range_query = f"""
                 SELECT d.id_dato, d.fecha, d.valor
                 FROM sensores_dev.datos AS d
-                LEFT JOIN sensores_dev.variables AS v ON d.id_variable = v.id_variable
-                LEFT JOIN sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
-                LEFT JOIN sensores_dev.sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
-                LEFT JOIN sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
-                LEFT JOIN sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
-                WHERE disp.id_dispositivo = %s
-                AND CONCAT(st.modelo, ' [', v.descripcion, ' (', v.unidad, ')]') = %s
+                WHERE {condicion}
                 AND d.fecha >= %s AND d.fecha <= %s
                 AND d.valor IS NOT NULL
                 {range_condition}
                 ORDER BY d.fecha DESC
             """
             
-            cursor.execute(range_query, [device_id, parameter, start_time, end_time, min_value, max_value])
+            cursor.execute(range_query, [*params_parametro, start_time, end_time, min_value, max_value])
             range_results = cursor.fetchall()
             
             # Contar el total de mediciones válidas para contexto
-            total_count_query = """
+            total_count_query = f"""
                 SELECT COUNT(*) as total
                 FROM sensores_dev.datos AS d
-                LEFT JOIN sensores_dev.variables AS v ON d.id_variable = v.id_variable
-                LEFT JOIN sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
-                LEFT JOIN sensores_dev.sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
-                LEFT JOIN sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
-                LEFT JOIN sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
-                WHERE disp.id_dispositivo = %s
-                AND CONCAT(st.modelo, ' [', v.descripcion, ' (', v.unidad, ')]') = %s
+                WHERE {condicion}
                 AND d.fecha >= %s AND d.fecha <= %s
                 AND d.valor IS NOT NULL
             """
             
-            cursor.execute(total_count_query, [device_id, parameter, start_time, end_time])
+            cursor.execute(total_count_query, [*params_parametro, start_time, end_time])
             total_count = cursor.fetchone()[0]
             
             if range_results:
@@ -813,8 +808,7 @@ def _validate_rate_of_change_for_alert(alert):
         dict: Resultado de la validación
     """
     try:
-        config = _get_db_config()
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
         
         project_id = alert["projectId"]
@@ -880,24 +874,21 @@ def _validate_rate_of_change_for_alert(alert):
         devices_with_issues = []
         
         for device_id, codigo_interno in project_devices:
+            # Sensores y variables del parámetro en el dispositivo (por id, usa los índices de `datos`)
+            condicion, params_parametro = _condicion_parametro(device_id, parameter, cursor=cursor)
+
             # Obtener todos los valores ordenados por fecha (más recientes primero)
-            values_query = """
+            values_query = f"""
                 SELECT d.id_dato, d.fecha, d.valor
                 FROM sensores_dev.datos AS d
-                LEFT JOIN sensores_dev.variables AS v ON d.id_variable = v.id_variable
-                LEFT JOIN sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
-                LEFT JOIN sensores_dev.sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
-                LEFT JOIN sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
-                LEFT JOIN sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
-                WHERE disp.id_dispositivo = %s
-                AND CONCAT(st.modelo, ' [', v.descripcion, ' (', v.unidad, ')]') = %s
+                WHERE {condicion}
                 AND d.fecha >= %s AND d.fecha <= %s
                 AND d.valor IS NOT NULL
                 AND CAST(d.valor AS DECIMAL(10,2)) > 0
                 ORDER BY d.fecha ASC
             """
             
-            cursor.execute(values_query, [device_id, parameter, start_time, end_time])
+            cursor.execute(values_query, [*params_parametro, start_time, end_time])
             values_results = cursor.fetchall()
             
             if len(values_results) < ventana_muestras + 1:
@@ -1052,8 +1043,7 @@ def _validate_stuck_value_for_alert(alert):
         dict: Resultado de la validación
     """
     try:
-        config = _get_db_config()
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
         
         project_id = alert["projectId"]
@@ -1119,23 +1109,20 @@ def _validate_stuck_value_for_alert(alert):
         devices_with_issues = []
         
         for device_id, codigo_interno in project_devices:
+            # Sensores y variables del parámetro en el dispositivo (por id, usa los índices de `datos`)
+            condicion, params_parametro = _condicion_parametro(device_id, parameter, cursor=cursor)
+
             # Obtener las últimas mediciones ordenadas por fecha para análisis de ventana deslizante
-            values_query = """
+            values_query = f"""
                 SELECT d.id_dato, d.fecha, d.valor
                 FROM sensores_dev.datos AS d
-                LEFT JOIN sensores_dev.variables AS v ON d.id_variable = v.id_variable
-                LEFT JOIN sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
-                LEFT JOIN sensores_dev.sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
-                LEFT JOIN sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
-                LEFT JOIN sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
-                WHERE disp.id_dispositivo = %s
-                AND CONCAT(st.modelo, ' [', v.descripcion, ' (', v.unidad, ')]') = %s
+                WHERE {condicion}
                 AND d.fecha >= %s AND d.fecha <= %s
                 AND d.valor IS NOT NULL
                 ORDER BY d.fecha ASC
             """
             
-            cursor.execute(values_query, [device_id, parameter, start_time, end_time])
+            cursor.execute(values_query, [*params_parametro, start_time, end_time])
             all_values = cursor.fetchall()
             
             if len(all_values) < ventana_muestras:
@@ -1334,8 +1321,7 @@ def _validate_cross_parameter_rule_for_alert(alert):
         dict: Resultado de la validación
     """
     try:
-        config = _get_db_config()
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
         
         project_id = alert["projectId"]
@@ -1415,8 +1401,12 @@ def _validate_cross_parameter_rule_for_alert(alert):
         devices_with_issues = []
         
         for device_id, codigo_interno in project_devices:
+            # Sensores y variables de cada parámetro en el dispositivo (por id, usa los índices de `datos`)
+            condicion_izq, params_izq = _condicion_parametro(device_id, parametro_izq, "d1", cursor)
+            condicion_der, params_der = _condicion_parametro(device_id, parametro_der, "d2", cursor)
+
             # Consulta para obtener pares de valores de ambos parámetros en la misma fecha/hora
-            cross_param_query = """
+            cross_param_query = f"""
                 SELECT 
                     d1.fecha,
                     d1.valor as valor_izq,
@@ -1425,20 +1415,8 @@ def _validate_cross_parameter_rule_for_alert(alert):
                     d2.id_dato as id_dato_der
                 FROM sensores_dev.datos AS d1
                 INNER JOIN sensores_dev.datos AS d2 ON d1.fecha = d2.fecha
-                LEFT JOIN sensores_dev.variables AS v1 ON d1.id_variable = v1.id_variable
-                LEFT JOIN sensores_dev.sensores AS sens1 ON d1.id_sensor = sens1.id_sensor
-                LEFT JOIN sensores_dev.sensores_tipo AS st1 ON sens1.id_sensor_tipo = st1.id_sensor_tipo
-                LEFT JOIN sensores_dev.sensores_en_dispositivo AS sed1 ON sens1.id_sensor = sed1.id_sensor
-                LEFT JOIN sensores_dev.dispositivos AS disp1 ON sed1.id_dispositivo = disp1.id_dispositivo
-                LEFT JOIN sensores_dev.variables AS v2 ON d2.id_variable = v2.id_variable
-                LEFT JOIN sensores_dev.sensores AS sens2 ON d2.id_sensor = sens2.id_sensor
-                LEFT JOIN sensores_dev.sensores_tipo AS st2 ON sens2.id_sensor_tipo = st2.id_sensor_tipo
-                LEFT JOIN sensores_dev.sensores_en_dispositivo AS sed2 ON sens2.id_sensor = sed2.id_sensor
-                LEFT JOIN sensores_dev.dispositivos AS disp2 ON sed2.id_dispositivo = disp2.id_dispositivo
-                WHERE disp1.id_dispositivo = %s
-                AND disp2.id_dispositivo = %s
-                AND CONCAT(st1.modelo, ' [', v1.descripcion, ' (', v1.unidad, ')]') = %s
-                AND CONCAT(st2.modelo, ' [', v2.descripcion, ' (', v2.unidad, ')]') = %s
+                WHERE {condicion_izq}
+                AND {condicion_der}
                 AND d1.fecha >= %s AND d1.fecha <= %s
                 AND d1.valor IS NOT NULL AND d2.valor IS NOT NULL
                 AND d1.valor != '' AND d2.valor != ''
@@ -1446,8 +1424,7 @@ def _validate_cross_parameter_rule_for_alert(alert):
             """
             
             cursor.execute(cross_param_query, [
-                device_id, device_id, 
-                parametro_izq, parametro_der,
+                *params_izq, *params_der,
                 start_time, end_time
             ])
             param_pairs = cursor.fetchall()
@@ -15,8 +15,23 @@ from openpyxl.worksheet.table import Table, TableStyleInfo
 from openpyxl.styles import PatternFill
 
 from insertarMedicionV2 import insertar_medicion_bp as insertar_medicion_v2_bp
+from insertarMediciones import insertar_mediciones_bp
+from insertarMedicionBinaria import insertar_medicion_binaria_bp
 from alertas import alertas_bp
 from files import files_bp
+from serieAgregada import serie_agregada_bp
+from db import config, get_connection, pool_metricas
+from mediciones import DERIVADOS_DATOS, actualizar_derivados, filas_afectadas, preparar_filas
+from ingesta import registrar_filas, metricas_ingesta, ColaLlenaError
+from spool import SPOOL_HABILITADO, get_spool
+from topologia import topologia, invalidar_topologia
+from idempotencia import idempotente, cache_idempotencia
+from pivot import pivotar, pivotar_sql, ordenar_descendente, normalizar
+from conteos import CONTEO_DIARIO, contar_mediciones
+from desnormalizacion import condicion_filtro
+from ultimas import ORIGEN_ULTIMAS, ULTIMAS_MEDICIONES
+from serializacion import ProveedorJSON, filas_cursor, stream_json, valor_json
+from paginacion import CursorInvalidoError, codificar_cursor, decodificar_cursor, condicion_cursor, orden_cursor, recortar_ultima_fecha
 # from flask_socketio import SocketIO, emit
 
 
@@ -24,6 +39,7 @@ from files import files_bp
 
 load_dotenv()
 app = Flask(__name__)
+app.json = ProveedorJSON(app)
 app.config['SECRET_KEY'] = 'your-secret-key-here'  # Reemplaza con una clave secreta segura
 app.config['SWAGGER'] = {
     'title': 'API Docs - Sensores',
@@ -72,7 +88,7 @@ CORS(app,
      resources={r"/*": {"origins": ["https://sensores.cmasccp.cl", "https://api-sensores.cmasccp.cl", "http://localhost:5173"]}},
      supports_credentials=True,
      allow_headers=["Content-Type", "Authorization"],
-     expose_headers=["Content-Type"],
+     expose_headers=["Content-Type", "X-Next-Cursor"],
      methods=["GET","POST","PUT","DELETE","OPTIONS"])
 swagger = Swagger(app)
 
@@ -129,19 +145,98 @@ FOREIGN_KEYS_PROP = {
     }
 
 ALLOWED_TABLES = [table['dataName'] for table in ALLOWED_TABLES_PROP]
-config = {
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD"),
-    "host": os.getenv("DB_HOST"),
-    "database": os.getenv("DB_NAME"),
-    "port": int(os.getenv("DB_PORT", 3306)),  # Valor por defecto: 3306
-}
 print(config)
 
 
 app.register_blueprint(insertar_medicion_v2_bp)
+app.register_blueprint(insertar_mediciones_bp)
+app.register_blueprint(insertar_medicion_binaria_bp)
 app.register_blueprint(alertas_bp)
 app.register_blueprint(files_bp)
+app.register_blueprint(serie_agregada_bp)
+
+
+@app.route('/metricasPool', methods=['GET'])
+def metricas_pool():
+    """
+    Devuelve las métricas del pool de conexiones MySQL del worker que atiende la petición.
+    ---
+    tags:
+      - Monitoreo
+    responses:
+      200:
+        description: Métricas del pool (por proceso/worker).
+        examples:
+          application/json: {
+            "status": "success",
+            "data": {
+              "size": 5, "open": 3, "idle": 2, "in_use": 1,
+              "checkouts": 1520, "exhausted": 0, "created": 3, "discarded": 0,
+              "wait_time_avg": 0.0004, "wait_time_max": 0.12, "wait_time_total": 0.61,
+              "pid": 4242
+            }
+          }
+    """
+    return jsonify({'status': 'success', 'data': pool_metricas()}), 200
+
+
+@app.route('/metricasIngesta', methods=['GET'])
+def metricas_ingesta_endpoint():
+    """
+    Devuelve el modo de ingesta, el estado de la cola de escritura (modo asíncrono) y del mapa de topología del worker.
+    ---
+    tags:
+      - Monitoreo
+    responses:
+      200:
+        description: Métricas de ingesta (por proceso/worker).
+        examples:
+          application/json: {
+            "status": "success",
+            "data": {
+              "modo": "asincrono",
+              "cola": {"pendientes": 120, "capacidad": 50000, "encoladas": 90210, "escritas": 90090,
+                       "rechazadas": 0, "commits": 311, "errores": 0, "descartadas": 0, "pid": 4242},
+              "topologia": {"dispositivos": 85, "sensores": 412, "cargas": 3, "aciertos": 90210,
+                            "fallos": 2, "edad_segundos": 41.7, "ttl": 300},
+              "idempotencia": {"claves": 3120, "capacidad": 10000, "ttl": 600, "aciertos": 57,
+                               "registradas": 3177, "en_curso": 0}
+            }
+          }
+    """
+    return jsonify({'status': 'success', 'data': {**metricas_ingesta(), 'topologia': topologia.metricas(), 'idempotencia': cache_idempotencia.metricas()}}), 200
+
+
+@app.route('/estadoSpool', methods=['GET'])
+def estado_spool():
+    """
+    Devuelve la profundidad y el retraso del spool local de ingesta (SPOOL_HABILITADO=1).
+    ---
+    tags:
+      - Monitoreo
+    responses:
+      200:
+        description: >
+          Estado del spool. bytes_pendientes y segmentos_pendientes son globales (directorio
+          compartido); los contadores (escritas, reproducidas, fsyncs...) son del worker que responde.
+          retraso_segundos es la antigüedad del segmento más antiguo sin reproducir.
+        examples:
+          application/json: {
+            "status": "success",
+            "data": {
+              "habilitado": true,
+              "segmentos_pendientes": 2, "segmentos_activos": 4, "bytes_pendientes": 183204,
+              "capacidad_bytes": 2147483648, "retraso_segundos": 1.52,
+              "escritas": 90210, "reproducidas": 89800, "fsyncs": 5120,
+              "segmentos_sellados": 41, "segmentos_reproducidos": 39,
+              "corruptos": 0, "corruptos_en_disco": 0, "rechazadas": 0, "rechazados_en_disco": 0,
+              "errores": 0, "pid": 4242
+            }
+          }
+    """
+    if not SPOOL_HABILITADO:
+        return jsonify({'status': 'success', 'data': {'habilitado': False}}), 200
+    return jsonify({'status': 'success', 'data': {'habilitado': True, **get_spool().estado()}}), 200
 
 
 @app.route('/endovenosaDummy', methods=['GET'])
@@ -247,10 +342,14 @@ def ultimo_valor():
         return jsonify({'status': 'fail', 'error': 'Debe proporcionar el nombre de la tabla y la columna'}), 400
 
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
 
-        query = f"SELECT {columna} FROM {tabla} ORDER BY {columna} DESC LIMIT 1"
+        if ULTIMAS_MEDICIONES and tabla == 'datos' and columna == 'fecha':
+            # La mayor fecha de `datos` es la mayor de las últimas mediciones de cada sensor y variable
+            query = "SELECT MAX(fecha) FROM ultimas_mediciones HAVING MAX(fecha) IS NOT NULL"
+        else:
+            query = f"SELECT {columna} FROM {tabla} ORDER BY {columna} DESC LIMIT 1"
         cursor.execute(query)
         resultado = cursor.fetchone()
 
@@ -368,7 +467,7 @@ def generar_sesion():
     ]
 
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
 
         sql_query = """
@@ -452,7 +551,7 @@ def columna_foranea():
     column = args.get('columna')
     try:
         print("Antes")
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         print("Despues")
         cursor = conn.cursor(dictionary=True)
 
@@ -495,6 +594,7 @@ def columna_foranea():
 
 
 @app.route('/insertarMedicion', methods=['GET'])
+@idempotente
 def insertar_medicion():
     """
     Inserta mediciones asociadas a sensores, variables y sesiones.
@@ -527,6 +627,11 @@ def insertar_medicion():
         type: string
         required: true
         description: Valores de las mediciones, separados por comas.
+      - name: idempotencyKey
+        in: query
+        type: string
+        required: false
+        description: Clave de idempotencia (también como header Idempotency-Key). Un reintento con la misma clave devuelve la respuesta original sin volver a insertar.
     responses:
       201:
         description: Mediciones insertadas correctamente.
@@ -539,6 +644,8 @@ def insertar_medicion():
             message:
               type: string
               example: Registro insertado correctamente
+      202:
+        description: Mediciones aceptadas en el spool o la cola de escritura (SPOOL_HABILITADO=1 o INGESTA_ASINCRONA=1).
       400:
         description: Las longitudes de los parámetros no coinciden.
         schema:
@@ -550,6 +657,10 @@ def insertar_medicion():
             error:
               type: string
               example: Las longitudes de los parámetros no coinciden
+      409:
+        description: Hay una petición en curso con la misma clave de idempotencia.
+      429:
+        description: La cola de escritura está llena; reintentar más tarde.
       500:
         description: Error en la base de datos o error interno.
         schema:
@@ -569,70 +680,13 @@ def insertar_medicion():
     variable_ids = request.args.get('idsVariables', '').split(',')
     values = request.args.get('valores', '').split(',')
 
-    # Si timestamps tiene un solo valor
-    # se entrega un UNIXTIME  
-    if len(timestamps) == 1 and timestamps[0]:  # Un solo valor
-        timestamps = [timestamps[0]] * len(sensor_ids)
-
-    # Si timestamps NO tiene valor
-    elif not timestamps[0]:  
-        current_timestamp = datetime.now().timestamp()
-        timestamps = [str(current_timestamp)] * len(sensor_ids)
-
-    # Si sesiones_ids tiene un solo valor
-    if len(sesiones_ids) == 1 and sesiones_ids[0]:  # Un solo valor
-        sesiones_ids = [sesiones_ids[0]] * len(sensor_ids)
-
-    # Si sesiones_ids NO tiene valor
-    elif not sesiones_ids[0]:  
-        sesiones_ids = [None] * len(sensor_ids)
-
-
-    if not (len(timestamps) == len(sensor_ids) == len(variable_ids) == len(values) == len(sesiones_ids)):
-        return jsonify({'status': 'fail', 'error': 'Las longitudes de los parametros no coinciden'}), 400
-    
-    measurements = []
-
-    # Fecha de inserción (servidor)  
-    server_timestamp = datetime.now().timestamp()
-    insertion_timestamps = [str(server_timestamp)] * len(sensor_ids)
-
-
-    for i in range(len(sensor_ids)):
-        timestamp_float = float(timestamps[i])
-        datetime_obj = datetime.fromtimestamp(timestamp_float)
-        formatted_datetime = datetime_obj.strftime('%Y-%m-%d %H:%M:%S')
-        # fechas insercion
-        insertion_timestamp_float = float(insertion_timestamps[i])
-        insertion_datetime_obj = datetime.fromtimestamp(insertion_timestamp_float)
-        formatted_insertion_datetime = insertion_datetime_obj.strftime('%Y-%m-%d %H:%M:%S')
-
-        # print("Formatted datetime:", formatted_datetime)
-        print("Formatted insertion datetime:", formatted_insertion_datetime)
-        # Convertir valores vacíos a None para insertarlos como NULL en la base de datos
-        valor = values[i] if values[i] and values[i].strip() else None
-
-        measurements.append({
-            "timestamp":formatted_datetime, #timestamps[i],
-            "sesionId": sesiones_ids[i],
-            "sensorId": sensor_ids[i],
-            "variableId": variable_ids[i],
-            "value": valor,
-            "insertionTimestamp": formatted_insertion_datetime
-        })
-
     try:
-        conn = mysql.connector.connect(**config)
-        cursor = conn.cursor()
-
-        for measurement in measurements:
-            valores = [measurement['sensorId'], measurement['value'], measurement['timestamp'], measurement['variableId'], measurement['sesionId'], measurement['insertionTimestamp']]
-            sql_query = f"INSERT INTO datos (id_sensor, valor, fecha, id_variable, id_sesion, fecha_insercion) VALUES (%s, %s, %s, %s, %s, %s)"
-            log_query = sql_query % tuple(valores)  # Para fines de depuración
-            print("Consulta SQL para depuración:", log_query)
-            cursor.execute(sql_query, valores)
+        filas = preparar_filas(timestamps, sesiones_ids, sensor_ids, variable_ids, values)
+    except ValueError as e:
+        return jsonify({'status': 'fail', 'error': str(e)}), 400
 
-        conn.commit()
+    try:
+        modo = registrar_filas(filas)
         # data_websocket = {"dispositivoId": "Desconocido", "fecha": formatted_datetime, "sesionesIds": sesiones_ids, "sensorIds": sensor_ids, "variableIds": variable_ids, "valores": values}
         # data_websocket = []
         # for i, measurement in enumerate(measurements):
@@ -649,8 +703,13 @@ def insertar_medicion():
         #     print(f"Error emitting WebSocket message: {ws_error}")
         #     # No fallar la operación si WebSocket falla
 
+        if modo == 'encolado':
+            return jsonify({'status': 'success', 'message': 'Registro encolado para inserción'}), 202, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
         return jsonify({'status': 'success', 'message': 'Registro insertado correctamente'}), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
 
+    except ColaLlenaError as e:
+        return jsonify({'status': 'fail', 'error': str(e)}), 429, {'Retry-After': '1'}
+
     except mysql.connector.Error as e:
         mensaje_error = f"Error al conectarse a la base de datos {e}"
         print(mensaje_error)
@@ -661,11 +720,6 @@ def insertar_medicion():
         print(mensaje_error)
         return jsonify({'status': 'fail', 'error': mensaje_error}), 500
 
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-
 
 @app.route('/listarTablas', methods=['GET'])
 def listar_tablas():
@@ -730,6 +784,16 @@ def listar_datos():
         type: string
         required: false
         description: Formato de salida 'json' o 'csv'. Predeterminado a 'json'.
+      - name: stream
+        in: query
+        type: boolean
+        required: false
+        description: Con formato json, envía las filas a medida que se leen de la base (fetchmany) en lugar de armar toda la respuesta en memoria. No se combina con cursor.
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: Paginación por cursor (solo tabla 'datos'). Vacío pide la primera página; luego se envía el nextCursor de la respuesta anterior. Ordena por (fecha, id_dato) según 'orden' e ignora offset.
       - name: filtros
         in: query
         type: string
@@ -755,6 +819,9 @@ def listar_datos():
                 tabla:
                   type: string
                   example: datos
+                nextCursor:
+                  type: string
+                  description: Solo con el parámetro cursor. Cursor de la página siguiente, null en la última.
       403:
         description: La tabla solicitada no está permitida.
         schema:
@@ -797,9 +864,11 @@ def listar_datos():
     formato = args.get('formato', 'json')
     orden = args.get('orden', 'desc')
     primarykey = args.get('primarykey', '')
+    cursor_pagina = args.get('cursor')
+    streaming = args.get('stream', '').lower() in ('1', 'true') and formato == 'json' and cursor_pagina is None
 
     args_dict = request.args.to_dict()
-    not_primary_keys = ['tabla', 'limite', 'offset', 'formato','orden', 'primarykey']
+    not_primary_keys = ['tabla', 'limite', 'offset', 'formato','orden', 'primarykey', 'cursor', 'stream']
 
     # Filtrar los argumentos relevantes
     filtered_args = {key: value.split(',') for key, value in args_dict.items() if key not in not_primary_keys}
@@ -813,19 +882,39 @@ def listar_datos():
         where_clauses.append(f"({or_conditions})")
         params.extend(values)  # Agregar los valores a los parámetros
 
+    # Paginación por cursor: continuar después de la última (fecha, id_dato) entregada
+    descendente = orden.lower() != 'asc'
+    if cursor_pagina is not None:
+        if tabla != 'datos':
+            return jsonify({'status': 'fail', 'error': "El parámetro 'cursor' solo se admite para la tabla datos"}), 400
+        try:
+            despues_de = decodificar_cursor(cursor_pagina)
+        except CursorInvalidoError as e:
+            return jsonify({'status': 'fail', 'error': str(e)}), 400
+        if despues_de is not None:
+            condicion, params_cursor = condicion_cursor(despues_de, descendente=descendente)
+            where_clauses.append(condicion)
+            params.extend(params_cursor)
+
     where_clause = ' AND '.join(where_clauses)
     where_clause = f"WHERE {where_clause}" if where_clause else ""
 
     if tabla not in ALLOWED_TABLES:
         return jsonify({'status': 'fail', 'error': 'Tabla no permitida'}), 403
 
+    conn = None
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
 
 
         sql_query = f"SELECT * FROM {tabla} {where_clause}"
-        if limit is not None:
+        if cursor_pagina is not None:
+            sql_query += " " + orden_cursor(descendente=descendente)
+            if limit is not None:
+                sql_query += " LIMIT %s"
+                params.append(int(limit))
+        elif limit is not None:
             sql_query += " LIMIT %s OFFSET %s"
             params.extend([int(limit), offset])
 
@@ -833,30 +922,48 @@ def listar_datos():
         print("Parámetros:", params)
         cursor.execute(sql_query, params)
 
+        if streaming:
+            # La conexión queda a cargo del generador, que la devuelve al pool al terminar
+            conn_stream, cursor_stream = conn, cursor
+            conn = None
+
+            def cerrar():
+                cursor_stream.close()
+                conn_stream.close()
+
+            return Response(
+                stream_with_context(stream_json(filas_cursor(cursor_stream), {'tabla': tabla}, al_terminar=cerrar)),
+                mimetype='application/json',
+                headers={'Access-Control-Allow-Origin': '*'}
+            )
+
         filas = cursor.fetchall()
 
-        respuesta = []
-        for fila in filas:
-            datos_dict = {key: value for key, value in zip(cursor.column_names, fila)}
-            for key, value in datos_dict.items():
-                if isinstance(value, decimal.Decimal):
-                    datos_dict[key] = float(value)
-                elif isinstance(value, (datetime, date)):
-                    datos_dict[key] = value.isoformat()
-            respuesta.append(datos_dict)
+        # Con la página llena puede haber más filas: el cursor sigue desde la última
+        siguiente_cursor = None
+        if cursor_pagina is not None and limit is not None and filas and len(filas) == int(limit):
+            ultima = dict(zip(cursor.column_names, filas[-1]))
+            siguiente_cursor = codificar_cursor(ultima['fecha'], ultima['id_dato'])
+
+        # Decimal y fechas los serializa el proveedor JSON de la app
+        respuesta = [dict(zip(cursor.column_names, fila)) for fila in filas]
 
         if formato == 'json':
+            data = {
+                'tableData': respuesta,
+                'tabla': tabla
+            }
+            if cursor_pagina is not None:
+                data['nextCursor'] = siguiente_cursor
             json_respuesta = jsonify({
                 'status': 'success',
-                'data': {
-                    'tableData': respuesta,
-                    'tabla': tabla
-                }
+                'data': data
             })
             return json_respuesta, 200, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
         elif formato == 'csv':
-            csv_respuesta = generar_csv(respuesta)
-            return Response(csv_respuesta, mimetype='text/csv')
+            csv_respuesta = generar_csv([{k: valor_json(v) for k, v in fila.items()} for fila in respuesta])
+            headers = {'X-Next-Cursor': siguiente_cursor} if siguiente_cursor else None
+            return Response(csv_respuesta, mimetype='text/csv', headers=headers)
         else:
             mensaje_error = f"Formato '{formato}' no soportado. Use 'json' o 'csv'."
             return jsonify({'status': 'fail', 'error': mensaje_error}), 400
@@ -872,14 +979,14 @@ def listar_datos():
         return jsonify({'status': 'fail', 'error': mensaje_error}), 500
 
     finally:
-        if conn.is_connected():
+        if conn is not None and conn.is_connected():
             cursor.close()
             conn.close()
 
 @app.route("/numeroVariablesProyecto", methods=['GET'])
 def numero_variables_por_proyecto():
   try:
-    conn = mysql.connector.connect(**config)
+    conn = get_connection()
     cursor = conn.cursor()
     args = request.args
     id_proyecto = int(args.get("id_proyecto", 1))
@@ -917,6 +1024,10 @@ def numero_variables_por_proyecto():
   except Exception as e:
     print(e)
     return None
+  finally:
+    if 'conn' in locals() and conn.is_connected():
+      cursor.close()
+      conn.close()
 
 @app.route('/listarDatosEstructuradosV2', methods=['GET'])
 def listar_datos_estructurados_v2():
@@ -963,6 +1074,21 @@ def listar_datos_estructurados_v2():
         type: string
         required: false
         description: Columna por la cual ordenar los resultados. Valores válidos 'fecha', 'id_dato', 'valor', 'codigo_interno', 'timestamp_lectura', 'id_sesion', 'nombre', 'id_proyecto', 'tag'. Predeterminado a 'fecha'.
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: Paginación por cursor en lugar de offset (solo con order_by=fecha). Vacío pide la primera página; luego se envía el nextCursor de la respuesta anterior.
+      - name: conteo
+        in: query
+        type: string
+        required: false
+        description: Cálculo de totalCount, 'exacto' (predeterminado) o 'estimado'. Con CONTEO_DIARIO=1 'estimado' suma los conteos por día sin recorrer la tabla datos (cuenta completos los días de fecha_inicio y fecha_fin).
+      - name: pivot
+        in: query
+        type: string
+        required: false
+        description: Dónde se pivota la tabla, 'python' (predeterminado) o 'sql'. Con 'sql' MySQL entrega las filas ya pivotadas y limite/offset cuentan filas de la tabla de salida.
     responses:
       200:
         description: Datos estructurados obtenidos con éxito.
@@ -1033,6 +1159,9 @@ def listar_datos_estructurados_v2():
     offset = int(args.get('offset', 0))
     formato = args.get('formato', 'json')
     order_by = args.get('order_by', 'fecha')  # Por defecto ordenar por fecha
+    modo_pivot = args.get('pivot', 'python')
+    cursor_pagina = args.get('cursor')
+    conteo_estimado = args.get('conteo', 'exacto') == 'estimado'
 
     print(offset)
 
@@ -1040,7 +1169,7 @@ def listar_datos_estructurados_v2():
     fecha_fin = args.get('fecha_fin')
 
     args_dict = request.args.to_dict()
-    not_primary_keys = ['tabla', 'limite', 'offset', 'formato', 'fecha_inicio', 'fecha_fin', 'order_by']
+    not_primary_keys = ['tabla', 'limite', 'offset', 'formato', 'fecha_inicio', 'fecha_fin', 'order_by', 'pivot', 'cursor', 'conteo']
 
     # Filtrar los argumentos relevantes
     filtered_args = {key: value.split(',') for key, value in args_dict.items() if key not in not_primary_keys}
@@ -1072,9 +1201,9 @@ def listar_datos_estructurados_v2():
         params.append(fecha_fin)
 
     for key, values in filtered_args.items():
-        or_conditions = " OR ".join([f"{key}=%s" for _ in values])
-        where_clauses.append(f"({or_conditions})")
-        params.extend(values)
+        condicion, params_filtro = condicion_filtro(key, values)
+        where_clauses.append(condicion)
+        params.extend(params_filtro)
 
     where_clause = ' AND '.join(where_clauses)
     if where_clause:
@@ -1085,15 +1214,41 @@ def listar_datos_estructurados_v2():
     if tabla not in ALLOWED_TABLES:
         return jsonify({'status': 'fail', 'error': 'Tabla no permitida'}), 403
 
+    # Paginación por cursor: la clave es (fecha, id_dato), por eso solo con order_by=fecha
+    despues_de = None
+    if cursor_pagina is not None:
+        if order_by.lower() != 'fecha':
+            return jsonify({'status': 'fail', 'error': "El parámetro 'cursor' solo se admite con order_by=fecha"}), 400
+        try:
+            despues_de = decodificar_cursor(cursor_pagina)
+        except CursorInvalidoError as e:
+            return jsonify({'status': 'fail', 'error': str(e)}), 400
+
     
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
 
+        if modo_pivot == 'sql':
+            # MySQL entrega las filas ya pivotadas: limite y offset son filas de la
+            # tabla de salida y totalCount es exacto
+            columnas_pivoteadas, tabla_pivoteada, total_count, siguiente = pivotar_sql(
+                cursor, filtered_args, where_clause, params, order_by=order_by,
+                limit=limit, offset=offset, contar=True, concatenar_ids=True,
+                keyset=cursor_pagina is not None, despues_de=despues_de
+            )
+            if len(tabla_pivoteada) == 0 and despues_de is None:
+                mensaje_error = f"No hay registros para los filtros solicitados"
+                return jsonify({'status': 'fail', 'error': mensaje_error}), 400
+            paginacion = None
+            if cursor_pagina is not None:
+                paginacion = {'nextCursor': codificar_cursor(*siguiente) if siguiente else None}
+            return responder_tabla_pivoteada(tabla_pivoteada, columnas_pivoteadas, tabla, formato, total_count, paginacion)
+
         # Adaptar el valor de limit y offset para la tabla estructurada
         id_proyecto = args.get("disp.id_proyecto")
         if id_proyecto is not None:
-            result_func = f_numero_variables_por_proyecto(id_proyecto)
+            result_func = f_numero_variables_por_proyecto(id_proyecto, conn=conn)
             if result_func is not None and isinstance(result_func, dict):
                 num_dispositivos = result_func.get("num_dispositivos", 0)
                 num_variables_proyecto = result_func.get("num_variables_proyecto", 0)
@@ -1113,6 +1268,13 @@ def listar_datos_estructurados_v2():
             num_variables_dispositivo = None
             limit_adaptado = limit if limit is not None else 0
             offset_adaptado = 0
+        # Con cursor se continúa después de la última (fecha, id_dato) entregada
+        where_datos, params_datos = where_clause, params
+        if despues_de is not None:
+            condicion, params_cursor = condicion_cursor(despues_de, "d.fecha", "d.id_dato")
+            where_datos = f"{where_clause} AND {condicion}" if where_clause else f"WHERE {condicion}"
+            params_datos = params + params_cursor
+
         sql_query = f"""
             SELECT
                 d.id_dato,
@@ -1141,7 +1303,7 @@ def listar_datos_estructurados_v2():
                 sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
             LEFT JOIN
                 sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
-            {where_clause}
+            {where_datos}
         """
 
         # Validar y agregar ORDER BY de forma segura
@@ -1158,53 +1320,44 @@ def listar_datos_estructurados_v2():
         safe_order_column = valid_order_columns.get(order_by.lower(), 'd.fecha')
         
         # Manejar valores NULL/vacíos para que aparezcan al final en DESC
-        if order_by.lower() == 'fecha_insercion':
+        if cursor_pagina is not None:
+            sql_query += " " + orden_cursor("d.fecha", "d.id_dato")
+        elif order_by.lower() == 'fecha_insercion':
             sql_query += f" ORDER BY {safe_order_column} IS NULL, {safe_order_column} DESC"
         else:
             sql_query += f" ORDER BY {safe_order_column} DESC"
 
-        params_sql = params.copy()
+        params_sql = params_datos.copy()
         if limit is not None:
           # Solo agrega LIMIT y OFFSET si se entregó el parámetro limite
-          sql_query += " LIMIT %s OFFSET %s"
-          params_sql.extend([limit_adaptado, offset_adaptado])
+          if cursor_pagina is not None:
+            sql_query += " LIMIT %s"
+            params_sql.append(limit_adaptado)
+          else:
+            sql_query += " LIMIT %s OFFSET %s"
+            params_sql.extend([limit_adaptado, offset_adaptado])
 
         cursor.execute(sql_query, params_sql)
         filas = cursor.fetchall()
         if len(filas) == 0:
+            if despues_de is not None:
+                # Última página de la paginación por cursor
+                return responder_tabla_pivoteada([], [], tabla, formato, 0, {'nextCursor': None})
             mensaje_error = f"No hay registros para los filtros solicitados"
             return jsonify({'status': 'fail', 'error': mensaje_error}), 400
+
+        # Con la página llena, la última fecha puede tener mediciones en la página
+        # siguiente: se deja completa para esa página y el cursor sigue desde aquí
+        paginacion = None
+        if cursor_pagina is not None:
+            siguiente_cursor = None
+            if limit is not None and limit_adaptado > 0 and len(filas) >= limit_adaptado:
+                i_fecha = cursor.column_names.index("fecha")
+                filas = recortar_ultima_fecha(filas, i_fecha)
+                siguiente_cursor = codificar_cursor(filas[-1][i_fecha], filas[-1][cursor.column_names.index("id_dato")])
+            paginacion = {'nextCursor': siguiente_cursor}
         
-        # Convertir resultados en DataFrame
-        respuesta = []
-        for fila in filas:
-          datos_dict = {key: value for key, value in zip(cursor.column_names, fila)}
-          for key, value in datos_dict.items():
-            # Convierte id_dato a string explícitamente
-            if key == "id_dato" and isinstance(value, int):
-              datos_dict[key] = str(value)
-            elif isinstance(value, decimal.Decimal):
-              datos_dict[key] = float(value)
-            elif isinstance(value, (datetime, date)):
-              datos_dict[key] = value.isoformat()
-          respuesta.append(datos_dict)
-
-        # Crear el DataFrame
-        df = pd.DataFrame(respuesta)
-
-        # Rellenar valores nulos (NaN)
-        df = df.fillna(value={"id_sesion": "Sin sesión", "fecha_insercion": "", "sesion_descripcion": "", "fecha_inicio": "", "ubicacion": "", "dispositivo_descripcion": ""})
-
-        # Crear la tabla pivotada
-        df_pivoted = df.pivot_table(
-            index=["fecha", "fecha_insercion", "id_sesion", "sesion_descripcion", "fecha_inicio", "ubicacion", "id_proyecto", "codigo_interno", "dispositivo_descripcion"],
-            columns="unidad_medida",
-            values="valor",
-            aggfunc=list
-        ).reset_index()
-
-        # Crear una columna vectorizada con los id_dato concatenados por la columna de ordenamiento
-        # Mapear order_by a columnas disponibles en el DataFrame
+        # Mapear order_by a la columna por la que se concatenan los id_dato
         valid_groupby_columns = {
             'fecha': 'fecha',
             'fecha_insercion': 'fecha_insercion', 
@@ -1214,94 +1367,42 @@ def listar_datos_estructurados_v2():
         }
         
         groupby_column = valid_groupby_columns.get(order_by.lower(), 'fecha')
-        
-        id_concat = (
-            df.groupby(groupby_column)["id_dato"]
-              .apply(lambda s: ', '.join(map(str, s)))
-              .reset_index()
-              .rename(columns={"id_dato": "id_dato_concatenado"})
-        )
-
-        # Unir la columna al DataFrame pivotado
-        df_pivoted = df_pivoted.merge(id_concat, on=groupby_column, how="left")
 
-        # Convertir las listas a cadenas separadas por comas
-        df_pivoted = df_pivoted.map(lambda x: ', '.join(map(str, x)) if isinstance(x, list) else str(x) if x is not None else "")
+        # Pivotar en una sola pasada sobre las filas del cursor, con los id_dato
+        # concatenados por la columna de ordenamiento y las listas unidas por comas
+        pivote = pivotar(
+            filas,
+            cursor.column_names,
+            indice=["fecha", "fecha_insercion", "id_sesion", "sesion_descripcion", "fecha_inicio", "ubicacion", "id_proyecto", "codigo_interno", "dispositivo_descripcion"],
+            rellenos={"id_sesion": "Sin sesión", "fecha_insercion": "", "sesion_descripcion": "", "fecha_inicio": "", "ubicacion": "", "dispositivo_descripcion": ""},
+            convertir=normalizar,
+            concatenar=(groupby_column, "id_dato")
+        )
+        tabla_pivoteada = pivote.filas_texto(concatenar_en=groupby_column)
+        columnas_pivoteadas = pivote.columnas + ["id_dato_concatenado"]
 
         # Calcular total_count antes de aplicar limit y offset (independendiente del limit)
         try:
             codigo_interno=args.get("disp.codigo_interno")
             if not codigo_interno:
-                codigos_internos = f_dispositivos_por_proyecto(id_proyecto=id_proyecto)
-                total_count = f_numero_mediciones_por_dispositivo(codigo_interno=codigos_internos,fecha_inicio=fecha_inicio, fecha_fin=fecha_fin)
+                codigos_internos = f_dispositivos_por_proyecto(id_proyecto=id_proyecto, conn=conn)
+                total_count = f_numero_mediciones_por_dispositivo(codigo_interno=codigos_internos,fecha_inicio=fecha_inicio, fecha_fin=fecha_fin, conn=conn, estimado=conteo_estimado)
             else:
-                total_count = f_numero_mediciones_por_dispositivo(codigo_interno=codigo_interno,fecha_inicio=fecha_inicio, fecha_fin=fecha_fin)
+                total_count = f_numero_mediciones_por_dispositivo(codigo_interno=codigo_interno,fecha_inicio=fecha_inicio, fecha_fin=fecha_fin, conn=conn, estimado=conteo_estimado)
             #TODO: Que pasa si hay mas sensores en un dispositivo?
             if num_variables_dispositivo and num_variables_dispositivo > 0:
                 total_count = int(total_count / num_variables_dispositivo)
             else:
-                total_count = len(df_pivoted)
+                total_count = len(tabla_pivoteada)
         except Exception as e:
             print(f"Error calculando total_count: {e}")
-            total_count = len(df_pivoted)
+            total_count = len(tabla_pivoteada)
 
-        # Aplicar limit y offset al DataFrame pivotado
-        # if limit > 0:
-        #     df_pivoted = df_pivoted.iloc[offset:offset + limit]
-        
-        # Mapear columnas válidas para el DataFrame pivotado
-        valid_pivot_columns = {
-            'fecha': 'fecha',
-            'fecha_insercion': 'fecha_insercion',
-            'id_sesion': 'id_sesion',
-            'codigo_interno': 'codigo_interno',
-            'id_proyecto': 'id_proyecto'
-        }
-        
-        # Aplicar ORDER BY al DataFrame pivotado
-        pivot_order_column = valid_pivot_columns.get(order_by.lower(), 'fecha')
-        if pivot_order_column in df_pivoted.columns:
-            # Manejar fecha_insercion especialmente para valores vacíos
-            if order_by.lower() == 'fecha_insercion':
-                # Convertir cadenas vacías a NaT para ordenamiento correcto
-                df_pivoted['fecha_insercion_sort'] = pd.to_datetime(df_pivoted['fecha_insercion'], errors='coerce')
-                df_pivoted = df_pivoted.sort_values(by='fecha_insercion_sort', ascending=False, na_position='last')
-                df_pivoted = df_pivoted.drop('fecha_insercion_sort', axis=1)
-            else:
-                df_pivoted = df_pivoted.sort_values(by=pivot_order_column, ascending=False)
-        else:
-            # Fallback a fecha si la columna no existe
-            df_pivoted = df_pivoted.sort_values(by="fecha", ascending=False)
+        # Aplicar ORDER BY a la tabla pivotada (fecha_insercion vacía al final)
+        tabla_pivoteada = ordenar_descendente(tabla_pivoteada, groupby_column, como_fecha=order_by.lower() == 'fecha_insercion')
 
         # Formato de respuesta
-        if formato == 'json':
-            json_response = df_pivoted.to_dict(orient="records")
-            json_respuesta = json.dumps({
-                'status': 'success',
-                'data': {
-                    'tableData': json_response,
-                    'tabla': tabla,
-                    'totalCount': total_count
-                }
-            }, ensure_ascii=False)
-            return json_respuesta, 200, {'Content-Type': 'application/json; charset=utf-8', 'Access-Control-Allow-Origin': '*'}
-
-        elif formato == 'csv':
-            return Response(
-                stream_with_context(build_csv(df_pivoted)),
-                mimetype="text/csv",
-                headers={"Content-Disposition": "attachment;filename=output.csv"}
-            )
-
-        elif formato == 'xlsx':
-            return Response(
-                stream_with_context(build_excel(df_pivoted)),
-                mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": "attachment;filename=output.xlsx"}
-            )
-        else:
-            mensaje_error = f"Formato '{formato}' no soportado. Use 'json' o 'csv'."
-            return jsonify({'status': 'fail', 'error': mensaje_error}), 400
+        return responder_tabla_pivoteada(tabla_pivoteada, columnas_pivoteadas, tabla, formato, total_count, paginacion)
 
 
     except mysql.connector.Error as e:
@@ -1446,9 +1547,9 @@ def listar_datos_estructurados():
         params.append(fecha_fin)
 
     for key, values in filtered_args.items():
-        or_conditions = " OR ".join([f"{key}=%s" for _ in values])
-        where_clauses.append(f"({or_conditions})")
-        params.extend(values)
+        condicion, params_filtro = condicion_filtro(key, values)
+        where_clauses.append(condicion)
+        params.extend(params_filtro)
 
     where_clause = ' AND '.join(where_clauses)
     where_clause = f"WHERE {where_clause}" if where_clause else ""
@@ -1457,7 +1558,7 @@ def listar_datos_estructurados():
         return jsonify({'status': 'fail', 'error': 'Tabla no permitida'}), 403
 
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
 
         sql_query = f"""
@@ -1495,70 +1596,24 @@ def listar_datos_estructurados():
         if len(filas) == 0:
             mensaje_error = f"No hay registros para los filtros solicitados"
             return jsonify({'status': 'fail', 'error': mensaje_error}), 400
-        # Convertir resultados en DataFrame
-        respuesta = []
-        for fila in filas:
-            datos_dict = {key: value for key, value in zip(cursor.column_names, fila)}
-            for key, value in datos_dict.items():
-                if isinstance(value, decimal.Decimal):
-                    datos_dict[key] = float(value)
-                elif isinstance(value, (datetime, date)):
-                    datos_dict[key] = value.isoformat()
-            respuesta.append(datos_dict)
-
-        print("respuesta", respuesta)
-        
-        df = pd.DataFrame(respuesta)
-        df = df.fillna(value={"id_sesion": "Sin sesión", "sesion_descripcion": "", "fecha_inicio": "", "ubicacion": "", "dispositivo_descripcion":""})
-
-        df_pivoted = df.pivot_table(
-            index=["fecha", "id_sesion", "sesion_descripcion", "fecha_inicio", "ubicacion", "id_proyecto", "codigo_interno", "dispositivo_descripcion"],
-            columns="unidad_medida",
-            values="valor",
-            aggfunc=list
-        ).reset_index()
-        
-
-        # Convertir las listas a cadenas separadas por comas
-        # df_pivoted = df_pivoted.applymap(lambda x: ', '.join(map(str, x)) if isinstance(x, list) else x)
-
-        df_pivoted = df_pivoted.applymap(lambda x: ', '.join(map(str, x)) if isinstance(x, list) else str(x) if x is not None else "")
-
+        # Pivotar en una sola pasada sobre las filas del cursor
+        pivote = pivotar(
+            filas,
+            cursor.column_names,
+            indice=["fecha", "id_sesion", "sesion_descripcion", "fecha_inicio", "ubicacion", "id_proyecto", "codigo_interno", "dispositivo_descripcion"],
+            rellenos={"id_sesion": "Sin sesión", "sesion_descripcion": "", "fecha_inicio": "", "ubicacion": "", "dispositivo_descripcion":""},
+            convertir=normalizar
+        )
+        tabla_pivoteada = pivote.filas_texto()
 
         # Calcular total_count antes de aplicar limit y offset
-        total_count = len(df_pivoted)
+        total_count = len(tabla_pivoteada)
 
-        # Aplicar limit y offset al DataFrame pivotado
+        # Aplicar limit y offset a la tabla pivotada
         if limit > 0:
-            df_pivoted = df_pivoted.iloc[offset:offset + limit]
+            tabla_pivoteada = tabla_pivoteada[offset:offset + limit]
 
-        if formato == 'json':
-            json_response = df_pivoted.to_dict(orient="records")
-            json_respuesta = json.dumps({
-                'status': 'success',
-                'data': {
-                    'tableData': json_response,
-                    'tabla': tabla,
-                    'totalCount': total_count
-                }
-            }, ensure_ascii=False)
-            return json_respuesta, 200, {'Content-Type': 'application/json; charset=utf-8', 'Access-Control-Allow-Origin': '*'}
-        elif formato == 'csv':
-            return Response(
-                stream_with_context(build_csv(df_pivoted)),
-                mimetype="text/csv",
-                headers={"Content-Disposition": "attachment;filename=output.csv"}
-            )
-        elif formato == 'xlsx':
-            return Response(
-                stream_with_context(build_excel(df_pivoted)),
-                mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": "attachment;filename=output.xlsx"}
-            )
-
-        else:
-            mensaje_error = f"Formato '{formato}' no soportado. Use 'json' o 'csv'."
-            return jsonify({'status': 'fail', 'error': mensaje_error}), 400
+        return responder_tabla_pivoteada(tabla_pivoteada, pivote.columnas, tabla, formato, total_count)
 
     except mysql.connector.Error as e:
         mensaje_error = f"Error al conectarse a la base de datos {e}"
@@ -1621,6 +1676,19 @@ def listar_ultimas_mediciones():
         type: string
         required: false
         description: Campo por el cual ordenar los resultados (fecha, fecha_insercion, id_sesion, codigo_interno, id_proyecto). Predeterminado a 'fecha'. También determina el campo usado para filtros fecha_inicio/fecha_fin.
+      - name: pivot
+        in: query
+        type: string
+        required: false
+        description: Dónde se pivota la tabla, 'python' (predeterminado) o 'sql'. Con 'sql' MySQL entrega las filas ya pivotadas y limite/offset cuentan filas de la tabla de salida.
+      - name: fuente
+        in: query
+        type: string
+        required: false
+        description: >
+          'datos' (predeterminado) lista todo el historial. 'ultimas' lee solo la última medición de cada sensor y
+          variable desde la tabla ultimas_mediciones (requiere ULTIMAS_MEDICIONES=1); el costo no depende del
+          largo del historial. Con 'ultimas' id_dato no está disponible.
     responses:
       200:
         description: Últimas mediciones obtenidas con éxito.
@@ -1682,12 +1750,14 @@ def listar_ultimas_mediciones():
     offset = int(args.get('offset', 0))
     formato = args.get('formato', 'json')
     order_by = args.get('order_by', 'fecha')
+    modo_pivot = args.get('pivot', 'python')
+    fuente = args.get('fuente', 'datos')
 
     fecha_inicio = args.get('fecha_inicio')
     fecha_fin = args.get('fecha_fin')
 
     args_dict = request.args.to_dict()
-    not_primary_keys = ['tabla', 'limite', 'offset', 'formato', 'fecha_inicio', 'fecha_fin', 'order_by']
+    not_primary_keys = ['tabla', 'limite', 'offset', 'formato', 'fecha_inicio', 'fecha_fin', 'order_by', 'pivot', 'fuente']
 
     # Filtrar los argumentos relevantes
     filtered_args = {key: value.split(',') for key, value in args_dict.items() if key not in not_primary_keys}
@@ -1719,9 +1789,10 @@ def listar_ultimas_mediciones():
         params.append(fecha_fin)
 
     for key, values in filtered_args.items():
-        or_conditions = " OR ".join([f"{key}=%s" for _ in values])
-        where_clauses.append(f"({or_conditions})")
-        params.extend(values)
+        # ultimas_mediciones no tiene las columnas desnormalizadas
+        condicion, params_filtro = condicion_filtro(key, values, desnormalizado=fuente != 'ultimas')
+        where_clauses.append(condicion)
+        params.extend(params_filtro)
 
     where_clause = ' AND '.join(where_clauses)
     where_clause = f"WHERE {where_clause}" if where_clause else ""
@@ -1729,10 +1800,30 @@ def listar_ultimas_mediciones():
     if tabla not in ALLOWED_TABLES:
         return jsonify({'status': 'fail', 'error': 'Tabla no permitida'}), 403
 
+    if fuente == 'ultimas':
+        if not ULTIMAS_MEDICIONES:
+            return jsonify({'status': 'fail', 'error': "La tabla de últimas mediciones no está activa (ULTIMAS_MEDICIONES=1)"}), 400
+        origen = ORIGEN_ULTIMAS
+    elif fuente == 'datos':
+        origen = "sensores_dev.datos"
+    else:
+        return jsonify({'status': 'fail', 'error': f"Fuente '{fuente}' no soportada. Use 'datos' o 'ultimas'."}), 400
+
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
 
+        if modo_pivot == 'sql':
+            # MySQL entrega las filas ya pivotadas y limite/offset se aplican en la consulta
+            columnas_pivoteadas, tabla_pivoteada, _, _ = pivotar_sql(
+                cursor, filtered_args, where_clause, params, order_by=order_by,
+                limit=limit, offset=offset, origen=origen
+            )
+            if len(tabla_pivoteada) == 0:
+                mensaje_error = f"No hay registros para los filtros solicitados"
+                return jsonify({'status': 'fail', 'error': mensaje_error}), 400
+            return responder_tabla_pivoteada(tabla_pivoteada, columnas_pivoteadas, tabla, formato)
+
         sql_query = f"""
             SELECT
                 d.id_dato,
@@ -1748,7 +1839,7 @@ def listar_ultimas_mediciones():
                 disp.codigo_interno,
                 disp.descripcion AS dispositivo_descripcion
             FROM
-                sensores_dev.datos AS d
+                {origen} AS d
             LEFT JOIN
                 sensores_dev.variables AS v ON d.id_variable = v.id_variable
             LEFT JOIN
@@ -1791,61 +1882,21 @@ def listar_ultimas_mediciones():
             mensaje_error = f"No hay registros para los filtros solicitados"
             return jsonify({'status': 'fail', 'error': mensaje_error}), 400
         
-        # Convertir resultados en DataFrame
-        respuesta = []
-        for fila in filas:
-            datos_dict = {key: value for key, value in zip(cursor.column_names, fila)}
-            for key, value in datos_dict.items():
-                if isinstance(value, decimal.Decimal):
-                    datos_dict[key] = float(value)
-                elif isinstance(value, (datetime, date)):
-                    datos_dict[key] = value.isoformat()
-            respuesta.append(datos_dict)
-
-        print("respuesta", respuesta)
-        
-        df = pd.DataFrame(respuesta)
-        df = df.fillna(value={"id_sesion": "Sin sesión", "sesion_descripcion": "", "fecha_inicio": "", "ubicacion": "", "dispositivo_descripcion":"", "fecha_insercion": ""})
-
-        df_pivoted = df.pivot_table(
-            index=["fecha", "fecha_insercion", "id_sesion", "sesion_descripcion", "fecha_inicio", "ubicacion", "id_proyecto", "codigo_interno", "dispositivo_descripcion"],
-            columns="unidad_medida",
-            values="valor",
-            aggfunc=list
-        ).reset_index()
-        
-        # Convertir las listas a cadenas separadas por comas
-        df_pivoted = df_pivoted.map(lambda x: ', '.join(map(str, x)) if isinstance(x, list) else str(x) if x is not None else "")
+        # Pivotar en una sola pasada sobre las filas del cursor
+        pivote = pivotar(
+            filas,
+            cursor.column_names,
+            indice=["fecha", "fecha_insercion", "id_sesion", "sesion_descripcion", "fecha_inicio", "ubicacion", "id_proyecto", "codigo_interno", "dispositivo_descripcion"],
+            rellenos={"id_sesion": "Sin sesión", "sesion_descripcion": "", "fecha_inicio": "", "ubicacion": "", "dispositivo_descripcion":"", "fecha_insercion": ""},
+            convertir=normalizar
+        )
+        tabla_pivoteada = pivote.filas_texto()
 
-        # Aplicar limit y offset al DataFrame pivotado
+        # Aplicar limit y offset a la tabla pivotada
         if limit > 0:
-            df_pivoted = df_pivoted.iloc[offset:offset + limit]
+            tabla_pivoteada = tabla_pivoteada[offset:offset + limit]
 
-        if formato == 'json':
-            json_response = df_pivoted.to_dict(orient="records")
-            json_respuesta = json.dumps({
-                'status': 'success',
-                'data': {
-                    'tableData': json_response,
-                    'tabla': tabla
-                }
-            }, ensure_ascii=False)
-            return json_respuesta, 200, {'Content-Type': 'application/json; charset=utf-8', 'Access-Control-Allow-Origin': '*'}
-        elif formato == 'csv':
-            return Response(
-                stream_with_context(build_csv(df_pivoted)),
-                mimetype="text/csv",
-                headers={"Content-Disposition": "attachment;filename=output.csv"}
-            )
-        elif formato == 'xlsx':
-            return Response(
-                stream_with_context(build_excel(df_pivoted)),
-                mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": "attachment;filename=output.xlsx"}
-            )
-        else:
-            mensaje_error = f"Formato '{formato}' no soportado. Use 'json' o 'csv'."
-            return jsonify({'status': 'fail', 'error': mensaje_error}), 400
+        return responder_tabla_pivoteada(tabla_pivoteada, pivote.columnas, tabla, formato)
 
     except mysql.connector.Error as e:
         mensaje_error = f"Error al conectarse a la base de datos {e}"
@@ -1871,7 +1922,7 @@ def listar_sensores():
     id_dispositivos_raw = args.get('id_dispositivo')  # Puede ser '1,2,3' o None
 
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
 
         sql_query = """
@@ -2007,7 +2058,7 @@ def get_table_schema():
     tabla = args.get('tabla')
 
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         if not conn:
             return jsonify({"error": "Error de conexión a la base de datos"}), 500
         
@@ -2087,6 +2138,17 @@ def modificar_datos():
             message:
               type: string
               example: "1 registro(s) actualizado(s) correctamente"
+      400:
+        description: Modificación de `datos` sin primaryKeys.
+        schema:
+          type: object
+          properties:
+            status:
+              type: string
+              example: fail
+            error:
+              type: string
+              example: "Indique primaryKeys (nombre de columna y valor) para modificar datos"
       403:
         description: La tabla especificada no está permitida.
         schema:
@@ -2133,9 +2195,13 @@ def modificar_datos():
 
     if table_name not in ALLOWED_TABLES:
         return jsonify({'status': 'fail', 'error': 'Tabla no permitida'}), 403
+
+    # Mediciones: solo por llave primaria, nunca la tabla completa
+    if table_name == 'datos' and (not primary_keys or not all(str(key).isidentifier() for key in primary_keys)):
+        return jsonify({'status': 'fail', 'error': 'Indique primaryKeys (nombre de columna y valor) para modificar datos'}), 400
     
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
 
         # Generar dinámicamente la consulta SQL para actualizar los campos
@@ -2148,14 +2214,27 @@ def modificar_datos():
         log_query = sql_query % tuple(valores)  # Sustituye los %s por los valores reales
         print("Consulta SQL para depuración:", log_query)
 
+        # Mediciones: conteos, resúmenes y últimas mediciones antes y después del cambio
+        antes = None
+        if table_name == 'datos' and DERIVADOS_DATOS:
+            antes = filas_afectadas(
+                cursor, ' AND '.join(f"{key} = %s" for key in primary_keys), list(primary_keys.values()), bloquear=True
+            )
+
         # Ejecutar la consulta
         cursor.execute(sql_query, valores)
+        filas_actualizadas = cursor.rowcount
+        if antes:
+            ids = [form_data['id_dato']] if 'id_dato' in form_data else [fila[4] for fila in antes]
+            despues = filas_afectadas(cursor, f"id_dato IN ({','.join(['%s'] * len(ids))})", ids)
+            actualizar_derivados(cursor, antes, despues)
         conn.commit()
+        invalidar_topologia(table_name)
 
-        if cursor.rowcount == 0:
+        if filas_actualizadas == 0:
             return jsonify({'status': 'fail', 'error': 'Registro no encontrado o sin cambios'}), 404
 
-        return jsonify({'status': 'success', 'message': f'{cursor.rowcount} registro(s) actualizado(s) correctamente'}), 200, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+        return jsonify({'status': 'success', 'message': f'{filas_actualizadas} registro(s) actualizado(s) correctamente'}), 200, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
 
     except mysql.connector.Error as e:
         mensaje_error = f"Error al conectarse a la base de datos {e}"
@@ -2259,7 +2338,7 @@ def eliminar_datos():
     
 
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
         # Permitir múltiples ids separados por comas
         id_list = [id.strip() for id in ids.split(",") if id.strip().isdigit()]
@@ -2267,14 +2346,24 @@ def eliminar_datos():
             return jsonify({'status': 'fail', 'error': 'IDs inválidos'}), 403
 
         placeholders = ','.join(['%s'] * len(id_list))
+
+        # Mediciones: conteos, resúmenes y últimas mediciones de las filas eliminadas
+        antes = None
+        if tabla == 'datos' and DERIVADOS_DATOS:
+            antes = filas_afectadas(cursor, f"{id_param} IN ({placeholders})", id_list, bloquear=True)
+
         sql_query = f"DELETE FROM {tabla} WHERE {id_param} IN ({placeholders})"
         cursor.execute(sql_query, id_list)
+        filas_eliminadas = cursor.rowcount
+        if antes:
+            actualizar_derivados(cursor, antes, [])
         conn.commit()
+        invalidar_topologia(tabla)
 
-        if cursor.rowcount == 0:
+        if filas_eliminadas == 0:
             return jsonify({'status': 'fail', 'error': 'Registro no encontrado o sin cambios'}), 404
 
-        return jsonify({'status': 'success', 'message': f'{cursor.rowcount} registro(s) eliminado(s) correctamente'}), 200
+        return jsonify({'status': 'success', 'message': f'{filas_eliminadas} registro(s) eliminado(s) correctamente'}), 200
 
     except mysql.connector.Error as e:
         mensaje_error = f"Error al conectarse a la base de datos {e}"
@@ -2361,7 +2450,7 @@ def agregar_datos():
         return jsonify({'status': 'fail', 'error': 'Tabla no permitida'}), 403
 
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
 
         # Generar dinámicamente la consulta SQL para insertar los campos
@@ -2382,7 +2471,12 @@ def agregar_datos():
         # Intentar obtener el ID de la última fila insertada
         last_inserted_id = cursor.lastrowid if cursor.lastrowid else None
 
+        # Mediciones: mismas tablas derivadas que la ingesta (insertar_datos)
+        if table_name == 'datos' and DERIVADOS_DATOS and last_inserted_id is not None:
+            actualizar_derivados(cursor, [], filas_afectadas(cursor, "id_dato = %s", [last_inserted_id]))
+
         conn.commit()
+        invalidar_topologia(table_name)
 
         return jsonify({'status': 'success', 'message': 'Registro insertado correctamente', "id": last_inserted_id}), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
 
@@ -2466,6 +2560,46 @@ def generar_csv(data):
         writer.writerow(row)
     return output.getvalue()
 
+def responder_tabla_pivoteada(filas, columnas, tabla, formato, total_count=None, paginacion=None):
+    """
+    Respuesta de los listados estructurados en json, csv o xlsx a partir de las
+    filas pivotadas (dicts de textos). Sin total_count se omite totalCount.
+    `paginacion` ({'nextCursor': ...}) se agrega a data en json y como cabecera
+    X-Next-Cursor en csv/xlsx.
+    """
+    siguiente_cursor = (paginacion or {}).get('nextCursor')
+    if formato == 'json':
+        data = {'tableData': filas, 'tabla': tabla}
+        if total_count is not None:
+            data['totalCount'] = total_count
+        if paginacion is not None:
+            data.update(paginacion)
+        # Sin ordenar las claves: las columnas de la tabla mantienen su orden
+        json_respuesta = app.json.dumps({'status': 'success', 'data': data}, sort_keys=False, ensure_ascii=False)
+        return json_respuesta, 200, {'Content-Type': 'application/json; charset=utf-8', 'Access-Control-Allow-Origin': '*'}
+    elif formato == 'csv':
+        headers = {"Content-Disposition": "attachment;filename=output.csv"}
+        if siguiente_cursor:
+            headers["X-Next-Cursor"] = siguiente_cursor
+        return Response(
+            stream_with_context(build_csv(pd.DataFrame(filas, columns=columnas))),
+            mimetype="text/csv",
+            headers=headers
+        )
+    elif formato == 'xlsx':
+        headers = {"Content-Disposition": "attachment;filename=output.xlsx"}
+        if siguiente_cursor:
+            headers["X-Next-Cursor"] = siguiente_cursor
+        return Response(
+            stream_with_context(build_excel(pd.DataFrame(filas, columns=columnas))),
+            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers=headers
+        )
+    else:
+        mensaje_error = f"Formato '{formato}' no soportado. Use 'json' o 'csv'."
+        return jsonify({'status': 'fail', 'error': mensaje_error}), 400
+
+
 def build_csv(df_pivoted):
     output = io.BytesIO()
     df_pivoted.to_csv(output, index=False, encoding="utf-8-sig")
@@ -2557,16 +2691,20 @@ def build_excel(df_pivoted):
 
 
 # FUNCIONES
-def f_numero_mediciones_por_dispositivo(codigo_interno, fecha_inicio=None, fecha_fin=None):
+def f_numero_mediciones_por_dispositivo(codigo_interno, fecha_inicio=None, fecha_fin=None, conn=None, estimado=False):
   """Devuelve el número total de mediciones aplicando los filtros.
 
   - `codigo_interno` puede ser None, string, comma-separated string o lista de strings.
   - La función siempre devuelve un entero con el total (suma sobre códigos si se pasan varios).
+  - `conn` permite reutilizar una conexión ya prestada por el pool (no se cierra aquí).
+  - Con CONTEO_DIARIO=1 suma los conteos por dispositivo y día en lugar de recorrer `datos`;
+    `estimado` cuenta completos los días de los extremos del rango (sin leer `datos`).
   """
-  conn = None
+  propia = conn is None
   cursor = None
   try:
-    conn = mysql.connector.connect(**config)
+    if propia:
+      conn = get_connection()
     cursor = conn.cursor()
 
     where_clauses = []
@@ -2587,6 +2725,12 @@ def f_numero_mediciones_por_dispositivo(codigo_interno, fecha_inicio=None, fecha
       where_clauses.append(f"(disp.codigo_interno IN ({placeholders}))")
       params.extend(codigo_list)
 
+    if CONTEO_DIARIO:
+      try:
+        return contar_mediciones(cursor, codigo_list, fecha_inicio, fecha_fin, estimado=estimado)
+      except (mysql.connector.Error, ValueError) as e:
+        print(f"No se pudo usar conteo_mediciones_dia, se cuenta en datos: {e}")
+
     if fecha_inicio:
       where_clauses.append("(d.fecha >= %s)")
       params.append(fecha_inicio)
@@ -2629,15 +2773,17 @@ def f_numero_mediciones_por_dispositivo(codigo_interno, fecha_inicio=None, fecha
     except Exception:
       pass
     try:
-      if conn is not None and conn.is_connected():
+      if propia and conn is not None and conn.is_connected():
         conn.close()
     except Exception:
       pass
 
 
-def f_dispositivos_por_proyecto(id_proyecto):
+def f_dispositivos_por_proyecto(id_proyecto, conn=None):
+  propia = conn is None
   try:
-    conn = mysql.connector.connect(**config)
+    if propia:
+      conn = get_connection()
     cursor = conn.cursor()
     sql_query = "SELECT DISTINCT codigo_interno FROM sensores_dev.dispositivos WHERE id_proyecto = %s"
     params = [id_proyecto]
@@ -2653,13 +2799,16 @@ def f_dispositivos_por_proyecto(id_proyecto):
     print(f"Error desconocido en f_numero_mediciones_por_proyecto: {e}")
     return []
   finally:
-    if 'conn' in locals() and conn.is_connected():
+    if 'cursor' in locals():
       cursor.close()
+    if propia and conn is not None and conn.is_connected():
       conn.close()
 
-def f_numero_variables_por_proyecto(id_proyecto):
+def f_numero_variables_por_proyecto(id_proyecto, conn=None):
+    propia = conn is None
     try:
-        conn = mysql.connector.connect(**config)
+        if propia:
+            conn = get_connection()
         cursor = conn.cursor()
 
         sql_query = """
@@ -2731,8 +2880,9 @@ def f_numero_variables_por_proyecto(id_proyecto):
         }
 
     finally:
-        if 'conn' in locals() and conn.is_connected():
+        if 'cursor' in locals():
             cursor.close()
+        if propia and conn is not None and conn.is_connected():
             conn.close()
 
 
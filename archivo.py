@@ -0,0 +1,174 @@
+"""
+Archivo en frío de `datos` en CSVS_FOLDER (python manage.py archivar).
+
+Las mediciones de cada día se escriben como CSV comprimido con gzip en la
+misma estructura que sirve files.py:
+
+    CSVS_FOLDER/<id_proyecto>/<codigo_interno>/<AAAA-MM-DD>/<codigo_interno>_<AAAA-MM-DD>_<primer id_dato>.csv.gz
+
+con las columnas de `datos` (una fila por medición, sin pivotar), así el
+archivo se puede volver a cargar tal cual. Las mediciones de sensores sin
+dispositivo van a sin_proyecto/sin_dispositivo. Un sensor en varios
+dispositivos queda en el archivo de cada uno, igual que en los listados.
+
+El nombre lleva el primer id_dato del archivo: repetir un día que no alcanzó a
+eliminarse reescribe el mismo archivo, y mediciones que lleguen después para
+un día ya archivado quedan en un archivo aparte.
+"""
+import csv
+import gzip
+import os
+
+from serializacion import STREAM_FILAS
+
+
+COLUMNAS_ARCHIVO = ("id_dato", "id_sensor", "id_variable", "fecha", "valor", "id_sesion", "fecha_insercion")
+
+SIN_PROYECTO = "sin_proyecto"
+SIN_DISPOSITIVO = "sin_dispositivo"
+
+# Mediciones de un día hasta un id_dato (las que existían al empezar), por
+# dispositivo. Se leen con un cursor sin buffer: la memoria no depende del día.
+_DESDE_ARCHIVO = """
+    FROM
+        sensores_dev.datos AS d
+    LEFT JOIN
+        sensores_dev.sensores_en_dispositivo AS sed ON d.id_sensor = sed.id_sensor
+    LEFT JOIN
+        sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
+    WHERE d.fecha >= %s AND d.fecha < %s AND d.id_dato <= %s
+"""
+
+ARCHIVO_SQL = (
+    "SELECT disp.id_proyecto, disp.codigo_interno, "
+    + ", ".join(f"d.{columna}" for columna in COLUMNAS_ARCHIVO)
+    + _DESDE_ARCHIVO
+    + "ORDER BY disp.id_proyecto, disp.codigo_interno, d.fecha, d.id_dato"
+)
+
+CONTAR_ARCHIVO_SQL = "SELECT COUNT(*)" + _DESDE_ARCHIVO
+
+# Se borran los id_dato leídos de los archivos ya verificados, no el rango: una
+# medición con id_dato <= hasta_id confirmada después de exportar el día no
+# está en el archivo y se queda en `datos`
+BORRAR_ARCHIVADOS_SQL = "DELETE FROM datos WHERE fecha >= %s AND fecha < %s AND id_dato IN ({ids})"
+
+
+def _carpeta(texto):
+    """Nombre de carpeta o archivo seguro a partir de un valor de la base."""
+    texto = str(texto).strip()
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in texto).strip(".") or "_"
+
+
+def ruta_archivo(carpeta_base, id_proyecto, codigo_interno, dia, primer_id):
+    proyecto = _carpeta(id_proyecto) if id_proyecto is not None else SIN_PROYECTO
+    dispositivo = _carpeta(codigo_interno) if codigo_interno is not None else SIN_DISPOSITIVO
+    return os.path.join(
+        carpeta_base, proyecto, dispositivo, f"{dia:%Y-%m-%d}",
+        f"{dispositivo}_{dia:%Y-%m-%d}_{primer_id}.csv.gz"
+    )
+
+
+def _texto(valor):
+    if valor is None:
+        return ""
+    if hasattr(valor, "isoformat"):
+        return valor.isoformat(sep=" ") if hasattr(valor, "hour") else valor.isoformat()
+    return str(valor)
+
+
+class _Escritor:
+    """CSV gzip que se escribe en <ruta>.parcial y se renombra al terminar."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.parcial = ruta + ".parcial"
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self._gzip = gzip.open(self.parcial, "wt", encoding="utf-8", newline="")
+        self._csv = csv.writer(self._gzip)
+        self._csv.writerow(COLUMNAS_ARCHIVO)
+        self.filas = 0
+
+    def escribir(self, fila):
+        self._csv.writerow([_texto(valor) for valor in fila])
+        self.filas += 1
+
+    def cerrar(self):
+        self._gzip.close()
+
+
+def contar_filas(ruta):
+    """Filas de datos (sin encabezado) de un CSV gzip ya escrito."""
+    with gzip.open(ruta, "rt", encoding="utf-8", newline="") as f:
+        return sum(1 for _ in csv.reader(f)) - 1
+
+
+def ids_archivados(rutas):
+    """id_dato (sin repetir, ordenados) de los CSV gzip ya escritos."""
+    ids = set()
+    for ruta in rutas:
+        with gzip.open(ruta, "rt", encoding="utf-8", newline="") as f:
+            lector = csv.reader(f)
+            next(lector, None)
+            ids.update(int(fila[0]) for fila in lector)
+    return sorted(ids)
+
+
+def exportar_dia(cursor, carpeta_base, dia, siguiente, hasta_id):
+    """
+    Escribe los archivos del día [dia, siguiente) con las mediciones de
+    id_dato <= `hasta_id`. Los archivos quedan como .parcial hasta que
+    confirmar_archivos() verifica los conteos.
+    Retorna (escritores, filas esperadas según la base).
+    """
+    cursor.execute(CONTAR_ARCHIVO_SQL, (dia, siguiente, hasta_id))
+    esperadas = int(cursor.fetchone()[0])
+    escritores = []
+    if esperadas == 0:
+        return escritores, 0
+
+    cursor.execute(ARCHIVO_SQL, (dia, siguiente, hasta_id))
+    actual = None
+    clave = None
+    try:
+        while True:
+            lote = cursor.fetchmany(STREAM_FILAS)
+            if not lote:
+                break
+            for fila in lote:
+                if (fila[0], fila[1]) != clave:
+                    if actual is not None:
+                        actual.cerrar()
+                    clave = (fila[0], fila[1])
+                    actual = _Escritor(ruta_archivo(carpeta_base, fila[0], fila[1], dia, fila[2]))
+                    escritores.append(actual)
+                actual.escribir(fila[2:])
+    except Exception:
+        if actual is not None:
+            actual.cerrar()
+        descartar_archivos(escritores)
+        raise
+    if actual is not None:
+        actual.cerrar()
+    return escritores, esperadas
+
+
+def confirmar_archivos(escritores, esperadas):
+    """
+    Verifica que los archivos escritos tengan las `esperadas` filas (leyéndolos
+    de nuevo) y los deja con su nombre final. Si no coinciden los elimina y
+    lanza ValueError: nada se borra de la base.
+    """
+    escritas = sum(contar_filas(e.parcial) for e in escritores)
+    if escritas != esperadas or escritas != sum(e.filas for e in escritores):
+        descartar_archivos(escritores)
+        raise ValueError(f"se escribieron {escritas} filas y se esperaban {esperadas}")
+    for e in escritores:
+        os.replace(e.parcial, e.ruta)
+    return escritas
+
+
+def descartar_archivos(escritores):
+    for e in escritores:
+        if os.path.exists(e.parcial):
+            os.remove(e.parcial)
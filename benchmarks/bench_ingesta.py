@@ -0,0 +1,411 @@
+"""
+Benchmark de ingesta: lecturas/s, latencia p50/p99 e idas y vueltas a la base por petición.
+
+Recorre los endpoints de ingesta con distintos tamaños de lote y niveles de
+concurrencia, ya sea en proceso (cliente de pruebas de Flask) o contra un
+gunicorn real, usando MySQL/MariaDB (variables DB_* del .env; use una base
+de pruebas, se insertan filas en `datos`) o una base falsa sobre SQLite.
+
+Ejemplos:
+    python benchmarks/bench_ingesta.py                                   # en proceso, base falsa
+    python benchmarks/bench_ingesta.py --lotes 1,10,100 --concurrencia 1,8
+    python benchmarks/bench_ingesta.py --modo gunicorn --workers 1,4
+    python benchmarks/bench_ingesta.py --db mysql --codigo MI-DISPOSITIVO
+    python benchmarks/bench_ingesta.py --comparar benchmarks/resultados/anterior.json
+
+Los resultados se guardan en benchmarks/resultados/ como JSON (con el commit
+actual) y con --comparar se muestran las diferencias contra una corrida anterior.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import db  # noqa: E402
+import mysql_falso  # noqa: E402
+
+ENDPOINTS = ["insertarMedicion", "insertarMedicionV2", "insertarMediciones", "insertarMedicionBinaria"]
+DIRECTORIO_RESULTADOS = os.path.join(RAIZ, "benchmarks", "resultados")
+
+
+# Generación de peticiones
+
+class Generador:
+    """Arma peticiones de `lote` lecturas con fechas únicas (no chocan con la deduplicación)."""
+
+    def __init__(self, codigo_interno, columnas):
+        self.codigo_interno = codigo_interno
+        self.columnas = columnas  # [(id_sensor, id_sensor_tipo, id_variable)]
+        self._lock = threading.Lock()
+        self._siguiente = int(time.time()) - 10 * 365 * 86400
+
+    def _timestamps(self, n):
+        with self._lock:
+            inicio = self._siguiente
+            self._siguiente += n
+        return list(range(inicio, inicio + n))
+
+    def peticion(self, endpoint, lote):
+        """Retorna (método, ruta, cuerpo, headers)."""
+        v = min(lote, len(self.columnas))
+        muestras = math.ceil(lote / v)
+        tiempos = self._timestamps(muestras)
+        lecturas = [(self.columnas[i % v], tiempos[i // v], round(random.uniform(0, 100), 2)) for i in range(lote)]
+
+        if endpoint == "insertarMedicion":
+            params = {
+                "idsSensores": ",".join(str(c[0]) for c, _, _ in lecturas),
+                "idsVariables": ",".join(str(c[2]) for c, _, _ in lecturas),
+                "valores": ",".join(str(valor) for _, _, valor in lecturas),
+                "times": ",".join(str(t) for _, t, _ in lecturas),
+            }
+            return "GET", "/insertarMedicion?" + urllib.parse.urlencode(params), None, {}
+
+        if endpoint == "insertarMedicionV2":
+            params = {
+                "codigoInterno": self.codigo_interno,
+                "idsSensorTipo": ",".join(str(c[1]) for c, _, _ in lecturas),
+                "idsVariables": ",".join(str(c[2]) for c, _, _ in lecturas),
+                "valores": ",".join(str(valor) for _, _, valor in lecturas),
+                "times": ",".join(str(t) for _, t, _ in lecturas),
+            }
+            return "GET", "/insertarMedicionV2?" + urllib.parse.urlencode(params), None, {}
+
+        if endpoint == "insertarMediciones":
+            cuerpo = json.dumps([
+                {"idSensor": c[0], "idVariable": c[2], "valor": valor, "time": t} for c, t, valor in lecturas
+            ]).encode()
+            return "POST", "/insertarMediciones", cuerpo, {"Content-Type": "application/json"}
+
+        if endpoint == "insertarMedicionBinaria":
+            from trama import codificar_trama
+            valores = [[float("nan")] * v for _ in range(muestras)]
+            for i, (_, _, valor) in enumerate(lecturas):
+                valores[i // v][i % v] = valor
+            cuerpo = codificar_trama(
+                self.codigo_interno, tiempos[0], [(c[1], c[2]) for c in self.columnas[:v]],
+                [t - tiempos[0] for t in tiempos], valores,
+            )
+            return "POST", "/insertarMedicionBinaria", cuerpo, {"Content-Type": "application/octet-stream"}
+
+        raise ValueError(f"Endpoint desconocido: {endpoint}")
+
+
+def columnas_de(codigo_interno):
+    """Sensores del dispositivo según el mapa de topología: [(id_sensor, id_sensor_tipo, id_variable)]."""
+    from topologia import topologia
+    topologia.dispositivos(codigo_interno)
+    columnas = []
+    for (id_dispositivo, id_sensor_tipo), id_sensor in sorted(topologia._sensores.items()):
+        if any(d == id_dispositivo for d, _ in topologia.dispositivos(codigo_interno)):
+            columnas.append((int(id_sensor), int(id_sensor_tipo)))
+    if not columnas:
+        raise SystemExit(f"El dispositivo '{codigo_interno}' no existe o no tiene sensores")
+    variables = sorted(int(v) for v in topologia._variables)
+    return [(s, t, variables[i % len(variables)]) for i, (s, t) in enumerate(columnas)]
+
+
+# Conteo de idas y vueltas contra MySQL real
+
+class _CursorContado:
+    def __init__(self, cursor, contador):
+        self._cursor = cursor
+        self._contador = contador
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, *args, **kwargs):
+        self._contador.sumar()
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._contador.sumar()
+        return self._cursor.executemany(*args, **kwargs)
+
+
+class _ConexionContada:
+    def __init__(self, conn, contador):
+        self._conn = conn
+        self._contador = contador
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return _CursorContado(self._conn.cursor(*args, **kwargs), self._contador)
+
+    def commit(self):
+        self._contador.sumar()
+        return self._conn.commit()
+
+    def rollback(self):
+        self._contador.sumar()
+        return self._conn.rollback()
+
+    def ping(self, *args, **kwargs):
+        self._contador.sumar()
+        return self._conn.ping(*args, **kwargs)
+
+
+def _preguntas_mysql():
+    """Contador global Questions del servidor (para medir idas y vueltas de gunicorn)."""
+    import mysql.connector
+    conn = mysql.connector.connect(**db.config)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+        return int(cursor.fetchone()[1])
+    finally:
+        conn.close()
+
+
+# Ejecución
+
+def _percentil(valores, p):
+    if not valores:
+        return None
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(math.ceil(p / 100.0 * len(valores))) - 1)]
+
+
+def _correr(enviar, generador, endpoint, lote, peticiones, concurrencia):
+    latencias = []
+    estados = {}
+    lock = threading.Lock()
+    restantes = [peticiones]
+
+    def trabajador():
+        sesion = enviar()
+        while True:
+            with lock:
+                if restantes[0] <= 0:
+                    return
+                restantes[0] -= 1
+            metodo, ruta, cuerpo, headers = generador.peticion(endpoint, lote)
+            inicio = time.perf_counter()
+            status = sesion(metodo, ruta, cuerpo, headers)
+            latencia = time.perf_counter() - inicio
+            with lock:
+                latencias.append(latencia)
+                estados[status] = estados.get(status, 0) + 1
+
+    hilos = [threading.Thread(target=trabajador) for _ in range(concurrencia)]
+    inicio = time.perf_counter()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return time.perf_counter() - inicio, latencias, estados
+
+
+def _cliente_flask():
+    from app import app
+
+    def enviar():
+        cliente = app.test_client()
+
+        def sesion(metodo, ruta, cuerpo, headers):
+            return cliente.open(ruta, method=metodo, data=cuerpo, headers=headers).status_code
+        return sesion
+    return enviar
+
+
+def _cliente_http(puerto):
+    def enviar():
+        conexion = [http.client.HTTPConnection("127.0.0.1", puerto, timeout=60)]
+
+        def sesion(metodo, ruta, cuerpo, headers):
+            for intento in range(2):
+                try:
+                    conexion[0].request(metodo, ruta, body=cuerpo, headers=headers)
+                    respuesta = conexion[0].getresponse()
+                    respuesta.read()
+                    return respuesta.status
+                except (http.client.HTTPException, OSError):
+                    conexion[0].close()
+                    conexion[0] = http.client.HTTPConnection("127.0.0.1", puerto, timeout=60)
+                    if intento:
+                        return 0
+        return sesion
+    return enviar
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _iniciar_gunicorn(workers, puerto, env):
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", os.path.join(RAIZ, "benchmarks", "gunicorn_conf.py"),
+         "--workers", str(workers), "--bind", f"127.0.0.1:{puerto}", "app:app"],
+        cwd=RAIZ, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        try:
+            with socket.create_connection(("127.0.0.1", puerto), timeout=1):
+                return proceso
+        except OSError:
+            if proceso.poll() is not None:
+                raise SystemExit("gunicorn terminó al iniciar")
+            time.sleep(0.2)
+    proceso.terminate()
+    raise SystemExit("gunicorn no respondió a tiempo")
+
+
+def _commit_actual():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(anterior, actual):
+    """Imprime la variación de lecturas/s y p99 contra una corrida anterior."""
+    clave = lambda r: (r["endpoint"], r["lote"], r["concurrencia"], r["workers"])
+    previos = {clave(r): r for r in anterior["resultados"]}
+    print(f"\nComparación contra {anterior.get('commit')} ({anterior.get('fecha')}):")
+    for r in actual["resultados"]:
+        p = previos.get(clave(r))
+        if not p or not p["lecturas_por_segundo"]:
+            continue
+        cambio = (r["lecturas_por_segundo"] - p["lecturas_por_segundo"]) / p["lecturas_por_segundo"] * 100
+        print(f"  {r['endpoint']:<24} lote={r['lote']:<5} c={r['concurrencia']:<3} w={r['workers']}: "
+              f"{p['lecturas_por_segundo']:>10.0f} -> {r['lecturas_por_segundo']:>10.0f} lect/s ({cambio:+.1f}%), "
+              f"p99 {p['latencia_p99_ms']:.1f} -> {r['latencia_p99_ms']:.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de ingesta de la API de sensores")
+    parser.add_argument("--modo", choices=["cliente", "gunicorn"], default="cliente",
+                        help="cliente: en proceso con el cliente de pruebas de Flask; gunicorn: HTTP contra gunicorn")
+    parser.add_argument("--db", choices=["falsa", "mysql"], default="falsa",
+                        help="falsa: SQLite temporal; mysql: la base del .env (use una base de pruebas)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--lotes", default="1,10,100", help="Lecturas por petición")
+    parser.add_argument("--concurrencia", default="1,4", help="Clientes simultáneos")
+    parser.add_argument("--workers", default="1,4", help="Workers de gunicorn (solo --modo gunicorn)")
+    parser.add_argument("--peticiones", type=int, default=200, help="Peticiones por combinación")
+    parser.add_argument("--codigo", default="BENCH-01", help="Código interno del dispositivo a usar")
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto benchmarks/resultados/)")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para mostrar diferencias")
+    args = parser.parse_args(argv)
+
+    endpoints = [e for e in args.endpoints.split(",") if e]
+    lotes = [int(x) for x in args.lotes.split(",")]
+    concurrencias = [int(x) for x in args.concurrencia.split(",")]
+    workers_lista = [int(x) for x in args.workers.split(",")] if args.modo == "gunicorn" else [1]
+
+    contador = mysql_falso.Contador()
+    env = dict(os.environ)
+    if args.db == "falsa":
+        ruta = os.path.join(tempfile.mkdtemp(prefix="bench_ingesta_"), "datos.sqlite")
+        mysql_falso.crear_base(ruta, args.codigo, dedup=os.getenv("DEDUP_DATOS", "0") in ("1", "true", "True"))
+        db.set_conector(mysql_falso.conector(ruta, contador))
+        env["BENCH_SQLITE"] = ruta
+    else:
+        import mysql.connector
+        db.set_conector(lambda **config: _ConexionContada(mysql.connector.connect(**config), contador))
+
+    generador = Generador(args.codigo, columnas_de(args.codigo))
+
+    resultados = []
+    for workers in workers_lista:
+        proceso = None
+        if args.modo == "gunicorn":
+            puerto = _puerto_libre()
+            proceso = _iniciar_gunicorn(workers, puerto, env)
+            enviar = _cliente_http(puerto)
+        else:
+            enviar = _cliente_flask()
+        try:
+            for endpoint in endpoints:
+                for lote in lotes:
+                    for concurrencia in concurrencias:
+                        # Calentamiento: carga el mapa de topología y abre las conexiones del pool
+                        _correr(enviar, generador, endpoint, lote, max(concurrencia, workers) * 2, concurrencia)
+
+                        rondas_antes = contador.valor
+                        preguntas_antes = _preguntas_mysql() if args.modo == "gunicorn" and args.db == "mysql" else None
+                        segundos, latencias, estados = _correr(enviar, generador, endpoint, lote, args.peticiones, concurrencia)
+
+                        if args.modo == "cliente":
+                            rondas = (contador.valor - rondas_antes) / args.peticiones
+                        elif preguntas_antes is not None:
+                            # Menos la consulta SHOW GLOBAL STATUS propia
+                            rondas = (_preguntas_mysql() - preguntas_antes - 1) / args.peticiones
+                        else:
+                            rondas = None  # La base falsa vive en los workers de gunicorn
+
+                        exitosas = sum(n for status, n in estados.items() if 200 <= status < 300)
+                        r = {
+                            "endpoint": endpoint,
+                            "lote": lote,
+                            "concurrencia": concurrencia,
+                            "workers": workers if args.modo == "gunicorn" else None,
+                            "peticiones": args.peticiones,
+                            "lecturas": exitosas * lote,
+                            "segundos": round(segundos, 4),
+                            "lecturas_por_segundo": round(exitosas * lote / segundos, 1) if segundos else None,
+                            "peticiones_por_segundo": round(args.peticiones / segundos, 1) if segundos else None,
+                            "latencia_p50_ms": round(_percentil(latencias, 50) * 1000, 3),
+                            "latencia_p99_ms": round(_percentil(latencias, 99) * 1000, 3),
+                            "rondas_por_peticion": round(rondas, 2) if rondas is not None else None,
+                            "status": {str(k): v for k, v in sorted(estados.items())},
+                        }
+                        resultados.append(r)
+                        print(f"{endpoint:<24} lote={lote:<5} c={concurrencia:<3} w={r['workers']}: "
+                              f"{r['lecturas_por_segundo']:>10} lect/s  p50={r['latencia_p50_ms']:.2f}ms  "
+                              f"p99={r['latencia_p99_ms']:.2f}ms  rondas/pet={r['rondas_por_peticion']}  {r['status']}")
+        finally:
+            if proceso is not None:
+                proceso.terminate()
+                proceso.wait()
+
+    salida = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit_actual(),
+        "python": platform.python_version(),
+        "modo": args.modo,
+        "db": args.db,
+        "entorno": {k: os.getenv(k) for k in ("INGESTA_ASINCRONA", "SPOOL_HABILITADO", "DEDUP_DATOS",
+                                              "DATOS_BATCH_SIZE", "DB_POOL_SIZE") if os.getenv(k) is not None},
+        "resultados": resultados,
+    }
+
+    ruta_salida = args.salida
+    if not ruta_salida:
+        os.makedirs(DIRECTORIO_RESULTADOS, exist_ok=True)
+        ruta_salida = os.path.join(
+            DIRECTORIO_RESULTADOS,
+            f"ingesta-{salida['commit'] or 'local'}-{args.modo}-{args.db}-{datetime.now():%Y%m%d-%H%M%S}.json",
+        )
+    with open(ruta_salida, "w") as f:
+        json.dump(salida, f, indent=2)
+    print(f"\nResultados guardados en {ruta_salida}")
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            comparar(json.load(f), salida)
+
+
+if __name__ == "__main__":
+    main()
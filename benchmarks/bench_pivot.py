@@ -0,0 +1,223 @@
+"""
+Benchmark del pivot de los listados estructurados: pivot.py contra pandas.
+
+Reconstruye las filas del cursor (una por medición) a partir de res.json,
+una respuesta real de /listarDatosEstructuradosV2, las multiplica con
+--escalas desplazando las fechas, y mide el pivot de pandas que usaban los
+listados (pivot_table(aggfunc=list) + map) contra pivot.py. Antes de medir
+verifica que ambas salidas sean idénticas.
+
+Ejemplos:
+    python benchmarks/bench_pivot.py
+    python benchmarks/bench_pivot.py --escalas 1,10,50 --repeticiones 5
+    python benchmarks/bench_pivot.py --comparar benchmarks/resultados/anterior.json
+"""
+import argparse
+import decimal
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from pivot import pivotar, ordenar_descendente, normalizar  # noqa: E402
+
+DIRECTORIO_RESULTADOS = os.path.join(RAIZ, "benchmarks", "resultados")
+
+COLUMNAS = [
+    "id_dato", "fecha", "id_sesion", "valor", "fecha_insercion", "unidad_medida", "sesion_descripcion",
+    "fecha_inicio", "ubicacion", "id_proyecto", "codigo_interno", "dispositivo_descripcion",
+]
+INDICE = ["fecha", "fecha_insercion", "id_sesion", "sesion_descripcion", "fecha_inicio", "ubicacion",
+          "id_proyecto", "codigo_interno", "dispositivo_descripcion"]
+RELLENOS = {"id_sesion": "Sin sesión", "fecha_insercion": "", "sesion_descripcion": "", "fecha_inicio": "",
+            "ubicacion": "", "dispositivo_descripcion": ""}
+
+
+# Datos
+
+def _fecha(texto):
+    return datetime.fromisoformat(texto) if texto else None
+
+
+def filas_desde_respuesta(ruta, escala):
+    """
+    Filas del cursor (tuplas en el orden de COLUMNAS, tipos de mysql.connector)
+    que producen la respuesta guardada en `ruta`, repetidas `escala` veces.
+    """
+    with open(ruta, encoding="utf-8") as f:
+        tabla = json.load(f)["data"]["tableData"]
+    medidas = [c for c in tabla[0] if c not in INDICE and c != "id_dato_concatenado"]
+    base = []
+    for fila in tabla:
+        ids = iter(int(x) for x in fila.get("id_dato_concatenado", "").split(", ") if x.isdigit())
+        for medida in medidas:
+            for valor in fila[medida].split(", "):
+                if valor == "nan":
+                    continue
+                base.append([
+                    next(ids, None),
+                    _fecha(fila["fecha"]),
+                    None if fila["id_sesion"] == "Sin sesión" else int(fila["id_sesion"]),
+                    decimal.Decimal(valor),
+                    _fecha(fila["fecha_insercion"]),
+                    medida,
+                    fila["sesion_descripcion"] or None,
+                    _fecha(fila["fecha_inicio"]),
+                    fila["ubicacion"] or None,
+                    int(fila["id_proyecto"]),
+                    fila["codigo_interno"],
+                    fila["dispositivo_descripcion"] or None,
+                ])
+
+    # Copias desplazadas en el tiempo, ordenadas por fecha descendente como la consulta
+    desplazamiento = max(f[1] for f in base) - min(f[1] for f in base) + timedelta(seconds=1)
+    filas = []
+    siguiente_id = 1
+    for copia in range(escala):
+        delta = desplazamiento * copia
+        for f in base:
+            fila = list(f)
+            fila[0] = siguiente_id
+            siguiente_id += 1
+            fila[1] = fila[1] + delta
+            fila[4] = fila[4] + delta if fila[4] else None
+            filas.append(tuple(fila))
+    filas.sort(key=lambda f: f[1], reverse=True)
+    return filas
+
+
+# Implementaciones
+
+def con_pandas(filas):
+    """Pivot de /listarDatosEstructuradosV2 antes de pivot.py (order_by=fecha)."""
+    respuesta = []
+    for fila in filas:
+        datos_dict = dict(zip(COLUMNAS, fila))
+        for key, value in datos_dict.items():
+            if key == "id_dato" and isinstance(value, int):
+                datos_dict[key] = str(value)
+            elif isinstance(value, decimal.Decimal):
+                datos_dict[key] = float(value)
+            elif isinstance(value, datetime):
+                datos_dict[key] = value.isoformat()
+        respuesta.append(datos_dict)
+    df = pd.DataFrame(respuesta)
+    df = df.fillna(value=RELLENOS)
+    df_pivoted = df.pivot_table(index=INDICE, columns="unidad_medida", values="valor", aggfunc=list).reset_index()
+    id_concat = (
+        df.groupby("fecha")["id_dato"]
+          .apply(lambda s: ', '.join(map(str, s)))
+          .reset_index()
+          .rename(columns={"id_dato": "id_dato_concatenado"})
+    )
+    df_pivoted = df_pivoted.merge(id_concat, on="fecha", how="left")
+    df_pivoted = df_pivoted.map(lambda x: ', '.join(map(str, x)) if isinstance(x, list) else str(x) if x is not None else "")
+    df_pivoted = df_pivoted.sort_values(by="fecha", ascending=False)
+    return df_pivoted.to_dict(orient="records")
+
+
+def con_pivot(filas):
+    """El mismo listado con pivot.py."""
+    pivote = pivotar(filas, COLUMNAS, indice=INDICE, rellenos=RELLENOS, convertir=normalizar,
+                     concatenar=("fecha", "id_dato"))
+    return ordenar_descendente(pivote.filas_texto(concatenar_en="fecha"), "fecha")
+
+
+def medir(funcion, filas, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(filas)
+        tiempos.append(time.perf_counter() - inicio)
+    tiempos.sort()
+    return tiempos[len(tiempos) // 2], tiempos[0]
+
+
+# Resultados
+
+def _commit_actual():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(anterior, actual):
+    """Imprime la variación del tiempo de pivot.py contra una corrida anterior."""
+    previos = {r["escala"]: r for r in anterior["resultados"]}
+    print(f"\nComparación contra {anterior.get('commit')} ({anterior.get('fecha')}):")
+    for r in actual["resultados"]:
+        p = previos.get(r["escala"])
+        if not p:
+            continue
+        cambio = (r["pivot_ms"] - p["pivot_ms"]) / p["pivot_ms"] * 100
+        print(f"  escala={r['escala']:<4}: {p['pivot_ms']:.1f} -> {r['pivot_ms']:.1f} ms ({cambio:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del pivot de los listados estructurados")
+    parser.add_argument("--respuesta", default=os.path.join(RAIZ, "res.json"),
+                        help="Respuesta de /listarDatosEstructuradosV2 de la que se reconstruyen las filas")
+    parser.add_argument("--escalas", default="1,10", help="Copias de la respuesta por corrida")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Mediciones por escala (se informa la mediana)")
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto benchmarks/resultados/)")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para mostrar diferencias")
+    args = parser.parse_args(argv)
+
+    resultados = []
+    for escala in [int(x) for x in args.escalas.split(",")]:
+        filas = filas_desde_respuesta(args.respuesta, escala)
+        esperado = con_pandas(filas)
+        if con_pivot(filas) != esperado:
+            raise SystemExit(f"escala={escala}: la salida de pivot.py difiere de la de pandas")
+
+        pandas_mediana, pandas_min = medir(con_pandas, filas, args.repeticiones)
+        pivot_mediana, pivot_min = medir(con_pivot, filas, args.repeticiones)
+        r = {
+            "escala": escala,
+            "filas_cursor": len(filas),
+            "filas_pivot": len(esperado),
+            "pandas_ms": round(pandas_mediana * 1000, 2),
+            "pandas_min_ms": round(pandas_min * 1000, 2),
+            "pivot_ms": round(pivot_mediana * 1000, 2),
+            "pivot_min_ms": round(pivot_min * 1000, 2),
+            "aceleracion": round(pandas_mediana / pivot_mediana, 2),
+        }
+        resultados.append(r)
+        print(f"escala={escala:<4} {r['filas_cursor']:>8} filas -> {r['filas_pivot']:>7}: "
+              f"pandas {r['pandas_ms']:>9.1f} ms  pivot.py {r['pivot_ms']:>9.1f} ms  x{r['aceleracion']}")
+
+    salida = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit_actual(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "resultados": resultados,
+    }
+
+    ruta_salida = args.salida
+    if not ruta_salida:
+        os.makedirs(DIRECTORIO_RESULTADOS, exist_ok=True)
+        ruta_salida = os.path.join(
+            DIRECTORIO_RESULTADOS,
+            f"pivot-{salida['commit'] or 'local'}-{datetime.now():%Y%m%d-%H%M%S}.json",
+        )
+    with open(ruta_salida, "w") as f:
+        json.dump(salida, f, indent=2)
+    print(f"\nResultados guardados en {ruta_salida}")
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            comparar(json.load(f), salida)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+"""
+Configuración de gunicorn para `benchmarks/bench_ingesta.py --modo gunicorn`.
+Con BENCH_SQLITE definido, cada worker usa la base falsa en vez de MySQL.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+timeout = 60
+
+
+def post_fork(server, worker):
+    ruta = os.getenv("BENCH_SQLITE")
+    if ruta:
+        import db
+        import mysql_falso
+        db.set_conector(mysql_falso.conector(ruta, mysql_falso.Contador()))
@@ -0,0 +1,163 @@
+"""
+Base de datos falsa en proceso para los benchmarks de ingesta.
+
+Implementa sobre SQLite el subconjunto de mysql.connector y de SQL que usa
+la ruta de ingesta (INSERT multi-fila en `datos`, mapa de topología,
+ON DUPLICATE KEY UPDATE), para medir la API sin un servidor MySQL.
+No reemplaza una prueba contra MySQL/MariaDB: los tiempos de la base
+son los de SQLite.
+"""
+import re
+import sqlite3
+import threading
+
+import mysql.connector
+
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS proyectos (id_proyecto INTEGER PRIMARY KEY, nombre TEXT);
+CREATE TABLE IF NOT EXISTS dispositivos (
+    id_dispositivo INTEGER PRIMARY KEY, codigo_interno TEXT, id_proyecto INTEGER, descripcion TEXT
+);
+CREATE TABLE IF NOT EXISTS sensores_tipo (id_sensor_tipo INTEGER PRIMARY KEY, marca TEXT, modelo TEXT);
+CREATE TABLE IF NOT EXISTS sensores (id_sensor INTEGER PRIMARY KEY, id_sensor_tipo INTEGER);
+CREATE TABLE IF NOT EXISTS sensores_en_dispositivo (id_sensor INTEGER, id_dispositivo INTEGER);
+CREATE TABLE IF NOT EXISTS variables (id_variable INTEGER PRIMARY KEY, descripcion TEXT, unidad TEXT);
+CREATE TABLE IF NOT EXISTS sesiones (id_sesion INTEGER PRIMARY KEY, descripcion TEXT, fecha_inicio TEXT, ubicacion TEXT);
+CREATE TABLE IF NOT EXISTS datos (
+    id_dato INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_sensor INTEGER, valor REAL, fecha TEXT, id_variable INTEGER, id_sesion INTEGER, fecha_insercion TEXT
+);
+"""
+
+INDICE_DEDUP = "CREATE UNIQUE INDEX IF NOT EXISTS ux_datos_sensor_variable_fecha ON datos (id_sensor, id_variable, fecha)"
+
+_RE_DUPLICADO = re.compile(r"ON DUPLICATE KEY UPDATE .*$", re.IGNORECASE | re.DOTALL)
+
+
+def traducir(sql):
+    """Convierte una sentencia MySQL del subconjunto usado a SQLite."""
+    if sql.lstrip().upper().startswith("SET SESSION"):
+        return "SELECT 1"  # Variables de sesión de MySQL: sin equivalente
+    sql = sql.replace("sensores_dev.", "").replace("%s", "?")
+    return _RE_DUPLICADO.sub("ON CONFLICT DO NOTHING", sql)
+
+
+class Contador:
+    """Idas y vueltas a la base (execute, executemany, commit, rollback, ping)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.valor = 0
+
+    def sumar(self, n=1):
+        with self._lock:
+            self.valor += n
+
+
+class CursorFalso:
+    def __init__(self, conexion):
+        self._conexion = conexion
+        self._cursor = conexion._sqlite.cursor()
+        self.rowcount = -1
+        self.lastrowid = None
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, sql, params=None):
+        self._conexion.contador.sumar()
+        try:
+            with self._conexion._lock:
+                self._cursor.execute(traducir(sql), tuple(params or ()))
+        except sqlite3.Error as e:
+            raise mysql.connector.Error(msg=str(e))
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+        self._conexion.in_transaction = self._conexion._sqlite.in_transaction
+
+    def executemany(self, sql, filas):
+        # mysql.connector envía un INSERT multi-fila: una sola ida y vuelta
+        self._conexion.contador.sumar()
+        try:
+            with self._conexion._lock:
+                self._cursor.executemany(traducir(sql), [tuple(f) for f in filas])
+        except sqlite3.Error as e:
+            raise mysql.connector.Error(msg=str(e))
+        self.rowcount = self._cursor.rowcount
+        self._conexion.in_transaction = self._conexion._sqlite.in_transaction
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    def close(self):
+        self._cursor.close()
+
+
+class ConexionFalsa:
+    def __init__(self, ruta, contador):
+        self._sqlite = sqlite3.connect(ruta, timeout=30, check_same_thread=False, isolation_level="DEFERRED")
+        self._lock = threading.Lock()
+        self._abierta = True
+        self.contador = contador
+        self.in_transaction = False
+
+    def cursor(self, *args, **kwargs):
+        return CursorFalso(self)
+
+    def commit(self):
+        self.contador.sumar()
+        self._sqlite.commit()
+        self.in_transaction = False
+
+    def rollback(self):
+        self.contador.sumar()
+        self._sqlite.rollback()
+        self.in_transaction = False
+
+    def ping(self, reconnect=False):
+        self.contador.sumar()
+
+    def is_connected(self):
+        return self._abierta
+
+    def close(self):
+        self._abierta = False
+        self._sqlite.close()
+
+
+def crear_base(ruta, codigo_interno="BENCH-01", n_sensores=16, dedup=False):
+    """
+    Crea el esquema en `ruta` y un dispositivo `codigo_interno` con `n_sensores`
+    sensores: tipo i, sensor i y variable i para i = 1..n_sensores.
+    Con `dedup` crea el índice único que requiere DEDUP_DATOS=1.
+    """
+    conn = sqlite3.connect(ruta)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(ESQUEMA)
+    if dedup:
+        conn.execute(INDICE_DEDUP)
+    conn.execute("INSERT OR IGNORE INTO proyectos VALUES (1, 'Benchmark')")
+    conn.execute("INSERT OR IGNORE INTO dispositivos VALUES (1, ?, 1, 'Dispositivo de benchmark')", (codigo_interno,))
+    for i in range(1, n_sensores + 1):
+        conn.execute("INSERT OR IGNORE INTO sensores_tipo VALUES (?, 'Bench', ?)", (i, f"S{i}"))
+        conn.execute("INSERT OR IGNORE INTO sensores VALUES (?, ?)", (i, i))
+        conn.execute("INSERT OR IGNORE INTO variables VALUES (?, ?, 'u')", (i, f"Variable {i}"))
+        if not conn.execute("SELECT 1 FROM sensores_en_dispositivo WHERE id_sensor = ?", (i,)).fetchone():
+            conn.execute("INSERT INTO sensores_en_dispositivo VALUES (?, 1)", (i,))
+    conn.commit()
+    conn.close()
+
+
+def conector(ruta, contador):
+    """Función compatible con db.set_conector que abre conexiones a la base falsa."""
+    def conectar(**_config):
+        return ConexionFalsa(ruta, contador)
+    return conectar
@@ -0,0 +1,210 @@
+from dotenv import load_dotenv
+
+import collections
+import os
+from datetime import datetime, time, timedelta
+
+from topologia import topologia
+
+
+load_dotenv()
+
+# Mantener y usar la tabla conteo_mediciones_dia (crearla antes con python manage.py conteos)
+CONTEO_DIARIO = os.getenv("CONTEO_DIARIO", "0") in ("1", "true", "True")
+
+CONTEO_TABLA_SQL = """
+    CREATE TABLE IF NOT EXISTS conteo_mediciones_dia (
+        id_dispositivo INT NOT NULL,
+        dia DATE NOT NULL,
+        mediciones BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (id_dispositivo, dia)
+    )
+"""
+
+SUMAR_CONTEO_SQL = (
+    "INSERT INTO conteo_mediciones_dia (id_dispositivo, dia, mediciones) VALUES (%s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE mediciones = mediciones + VALUES(mediciones)"
+)
+
+# Recuento de un día de un dispositivo desde `datos` (mismos joins que el COUNT de los listados)
+RECONTAR_SQL = """
+    INSERT INTO conteo_mediciones_dia (id_dispositivo, dia, mediciones)
+    SELECT sed.id_dispositivo, DATE(d.fecha), COUNT(*)
+    FROM datos AS d
+    JOIN sensores AS sens ON d.id_sensor = sens.id_sensor
+    JOIN sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
+    WHERE {where_clause}
+    GROUP BY sed.id_dispositivo, DATE(d.fecha)
+    ON DUPLICATE KEY UPDATE mediciones = VALUES(mediciones)
+"""
+
+CONTEO_DATOS_SQL = """
+    SELECT COUNT(*)
+    FROM
+      sensores_dev.datos AS d
+    LEFT JOIN
+      sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
+    LEFT JOIN
+      sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
+    LEFT JOIN
+      sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
+    {where_clause}
+"""
+
+CONTEO_DIAS_SQL = """
+    SELECT SUM(c.mediciones)
+    FROM
+      sensores_dev.conteo_mediciones_dia AS c
+    JOIN
+      sensores_dev.dispositivos AS disp ON c.id_dispositivo = disp.id_dispositivo
+    {where_clause}
+"""
+
+
+def _celdas(filas, cursor=None):
+    """Mediciones por (id_dispositivo, día) de las filas de `datos` (id_sensor, valor, fecha, ...)."""
+    celdas = collections.Counter()
+    dispositivos = {}
+    for fila in filas:
+        id_sensor = fila[0]
+        ids = dispositivos.get(id_sensor)
+        if ids is None:
+            ids = dispositivos[id_sensor] = topologia.dispositivos_de_sensor(id_sensor, cursor)
+        dia = str(fila[2])[:10]
+        for id_dispositivo in ids:
+            celdas[(int(id_dispositivo), dia)] += 1
+    return celdas
+
+
+def sumar_conteos(cursor, filas, insertadas=None):
+    """
+    Suma las filas recién insertadas en `datos` a conteo_mediciones_dia, en la
+    misma transacción que el INSERT (si se deshace, el conteo también).
+
+    Si `insertadas` < len(filas) (DEDUP_DATOS descartó mediciones repetidas y no
+    se sabe cuáles) las celdas afectadas se recuentan desde `datos`.
+    No hace nada si CONTEO_DIARIO no está activo.
+    """
+    if not CONTEO_DIARIO or not filas:
+        return
+    celdas = _celdas(filas, cursor)
+    if not celdas:
+        return
+    # Siempre en el mismo orden para que dos inserciones concurrentes no se bloqueen mutuamente
+    orden = sorted(celdas.items())
+    if insertadas is None or insertadas >= len(filas):
+        cursor.executemany(SUMAR_CONTEO_SQL, [(id_dispositivo, dia, n) for (id_dispositivo, dia), n in orden])
+        return
+    for (id_dispositivo, dia), _ in orden:
+        desde = datetime.strptime(dia, "%Y-%m-%d")
+        cursor.execute(
+            RECONTAR_SQL.format(where_clause="sed.id_dispositivo = %s AND d.fecha >= %s AND d.fecha < %s"),
+            (id_dispositivo, desde, desde + timedelta(days=1))
+        )
+
+
+def recontar_conteos(cursor, filas):
+    """
+    Recuenta desde `datos` las celdas (dispositivo, día) de las filas
+    (id_sensor, valor, fecha, ...) después de modificarlas o eliminarlas
+    fuera de la ingesta. Las celdas que quedan sin mediciones se eliminan.
+    No hace nada si CONTEO_DIARIO no está activo.
+    """
+    if not CONTEO_DIARIO or not filas:
+        return
+    for (id_dispositivo, dia), _ in sorted(_celdas(filas, cursor).items()):
+        desde = datetime.strptime(dia, "%Y-%m-%d")
+        cursor.execute("DELETE FROM conteo_mediciones_dia WHERE id_dispositivo = %s AND dia = %s", (id_dispositivo, desde.date()))
+        cursor.execute(
+            RECONTAR_SQL.format(where_clause="sed.id_dispositivo = %s AND d.fecha >= %s AND d.fecha < %s"),
+            (id_dispositivo, desde, desde + timedelta(days=1))
+        )
+
+
+def _fecha(valor):
+    if valor is None or valor == '':
+        return None
+    if isinstance(valor, datetime):
+        return valor
+    return datetime.fromisoformat(str(valor).strip())
+
+
+def _partir_rango(inicio, fin, estimado):
+    """
+    Divide [inicio, fin] en días completos, que se leen de conteo_mediciones_dia,
+    y tramos de días incompletos, que se cuentan en `datos`.
+    Retorna (dias, tramos): dias es (dia_desde, dia_hasta), con None si no hay
+    cota, o None si no hay ningún día completo.
+    """
+    if estimado:
+        return ((inicio.date() if inicio else None), (fin.date() if fin else None)), []
+
+    inicio_completo = inicio is None or inicio.time() == time.min
+    fin_completo = fin is None or fin.time() >= time(23, 59, 59)
+
+    if inicio is not None and fin is not None and inicio.date() == fin.date():
+        if inicio_completo and fin_completo:
+            return (inicio.date(), fin.date()), []
+        return None, [(inicio, fin)]
+
+    tramos = []
+    dia_desde = dia_hasta = None
+    if inicio is not None:
+        dia_desde = inicio.date()
+        if not inicio_completo:
+            dia_desde += timedelta(days=1)
+            tramos.append((inicio, datetime.combine(inicio.date(), time.max)))
+    if fin is not None:
+        dia_hasta = fin.date()
+        if not fin_completo:
+            dia_hasta -= timedelta(days=1)
+            tramos.append((datetime.combine(fin.date(), time.min), fin))
+    if dia_desde is not None and dia_hasta is not None and dia_desde > dia_hasta:
+        return None, tramos
+    return (dia_desde, dia_hasta), tramos
+
+
+def contar_mediciones(cursor, codigos=None, fecha_inicio=None, fecha_fin=None, estimado=False):
+    """
+    Número de mediciones de los dispositivos `codigos` (todos si es None) con
+    fecha_inicio <= fecha <= fecha_fin, sumando las celdas por día de
+    conteo_mediciones_dia en lugar de recorrer `datos`.
+
+    Los días que el rango cubre solo en parte se cuentan en `datos` (a lo más
+    dos, acotados por fecha). Con `estimado` se suman los días completos de
+    los extremos y no se toca `datos`.
+    """
+    inicio = _fecha(fecha_inicio)
+    fin = _fecha(fecha_fin)
+    if inicio is not None and fin is not None and inicio > fin:
+        return 0
+
+    filtro_codigos = []
+    params_codigos = []
+    if codigos:
+        filtro_codigos.append(f"(disp.codigo_interno IN ({','.join(['%s'] * len(codigos))}))")
+        params_codigos.extend(codigos)
+
+    total = 0
+    dias, tramos = _partir_rango(inicio, fin, estimado)
+    if dias is not None:
+        dia_desde, dia_hasta = dias
+        where_clauses = list(filtro_codigos)
+        params = list(params_codigos)
+        if dia_desde is not None:
+            where_clauses.append("(c.dia >= %s)")
+            params.append(dia_desde)
+        if dia_hasta is not None:
+            where_clauses.append("(c.dia <= %s)")
+            params.append(dia_hasta)
+        where_clause = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+        cursor.execute(CONTEO_DIAS_SQL.format(where_clause=where_clause), params)
+        fila = cursor.fetchone()
+        total += int(fila[0]) if fila and fila[0] is not None else 0
+
+    for desde, hasta in tramos:
+        where_clause = "WHERE " + " AND ".join(filtro_codigos + ["(d.fecha >= %s)", "(d.fecha <= %s)"])
+        cursor.execute(CONTEO_DATOS_SQL.format(where_clause=where_clause), params_codigos + [desde, hasta])
+        fila = cursor.fetchone()
+        total += int(fila[0]) if fila and fila[0] is not None else 0
+    return total
@@ -0,0 +1,256 @@
+from dotenv import load_dotenv
+
+import mysql.connector
+import os
+import queue
+import threading
+import time
+
+
+load_dotenv()
+config = {
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "host": os.getenv("DB_HOST"),
+    "database": os.getenv("DB_NAME"),
+    "port": int(os.getenv("DB_PORT", 3306)),  # Valor por defecto: 3306
+}
+
+# Configuración del pool (por proceso / worker de gunicorn)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))                      # Máximo de conexiones abiertas por worker
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))             # Segundos de espera por una conexión libre
+POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", 300))  # Segundos antes de descartar una conexión ociosa
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") not in ("0", "false", "False")
+
+
+# Función que abre las conexiones del pool (los benchmarks la reemplazan con set_conector)
+_conector = mysql.connector.connect
+
+
+class PoolAgotadoError(mysql.connector.errors.PoolError):
+    """No se obtuvo una conexión libre dentro de DB_POOL_TIMEOUT."""
+
+
+# Bloqueos que MySQL deshace por su cuenta: lock wait timeout y deadlock
+ERRORES_BLOQUEO = (1205, 1213)
+
+
+def error_transitorio(e):
+    """
+    True si `e` no depende de las filas enviadas y tiene sentido reintentar:
+    conexión caída o rechazada, pool agotado o bloqueo entre transacciones.
+    Los demás errores (IntegrityError, DataError, ProgrammingError...) se
+    repiten igual en cada reintento.
+    """
+    if isinstance(e, (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError, PoolAgotadoError)):
+        return True
+    return isinstance(e, mysql.connector.errors.DatabaseError) and getattr(e, "errno", None) in ERRORES_BLOQUEO
+
+
+class ConexionPool:
+    """
+    Envoltorio de una conexión de mysql.connector prestada por el pool.
+
+    Se comporta como la conexión original, pero `close()` la devuelve al pool
+    en vez de cerrarla. Así los handlers existentes (`conn.close()` en el
+    `finally`) siguen funcionando sin cambios.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._devuelta = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def is_connected(self):
+        # Prestada se reporta conectada aunque el socket se haya caído: los
+        # handlers llaman `close()` solo si `is_connected()`, y sin ese
+        # `close()` el cupo del pool no se libera nunca (`_devolver` descarta
+        # la conexión muerta). Ya devuelta se reporta cerrada para que un
+        # segundo `close()` no la devuelva dos veces.
+        return not self._devuelta
+
+    def close(self):
+        if self._devuelta:
+            return
+        self._devuelta = True
+        self._pool._devolver(self._raw)
+
+    def __del__(self):
+        # Último recurso si un handler no llegó a `close()` (p. ej. falló
+        # `cursor.close()` en el finally): devolver el cupo igual
+        if "_devuelta" not in self.__dict__:
+            return
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class PoolConexiones:
+    """
+    Pool acotado de conexiones MySQL con verificación de salud.
+
+    - Nunca abre más de `size` conexiones simultáneas.
+    - Si no hay conexiones libres espera hasta `timeout` segundos y luego
+      lanza PoolAgotadoError (se cuenta en `exhausted`).
+    - Las conexiones ociosas por más de `idle_timeout` se descartan.
+    - Con `pre_ping` cada conexión se verifica antes de prestarse.
+    """
+
+    def __init__(self, db_config, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 idle_timeout=POOL_IDLE_TIMEOUT, pre_ping=POOL_PRE_PING):
+        self.db_config = dict(db_config)
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.pre_ping = pre_ping
+        self.pid = os.getpid()
+
+        self._libres = queue.LifoQueue()  # (conexion, ultimo_uso)
+        self._cupos = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._abiertas = 0
+        self._metricas = {
+            "checkouts": 0,
+            "exhausted": 0,
+            "created": 0,
+            "discarded": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+
+    def _crear(self):
+        conn = _conector(**self.db_config)
+        with self._lock:
+            self._abiertas += 1
+            self._metricas["created"] += 1
+        return conn
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._abiertas -= 1
+            self._metricas["discarded"] += 1
+
+    def _sana(self, conn, ultimo_uso):
+        if self.idle_timeout and time.monotonic() - ultimo_uso > self.idle_timeout:
+            return False
+        if not self.pre_ping:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def get_connection(self):
+        inicio = time.monotonic()
+        if not self._cupos.acquire(timeout=self.timeout):
+            with self._lock:
+                self._metricas["exhausted"] += 1
+            raise PoolAgotadoError(
+                f"Pool de conexiones agotado ({self.size} en uso, espera de {self.timeout}s)"
+            )
+
+        try:
+            conn = None
+            while conn is None:
+                try:
+                    candidata, ultimo_uso = self._libres.get_nowait()
+                except queue.Empty:
+                    conn = self._crear()
+                    break
+                if self._sana(candidata, ultimo_uso):
+                    conn = candidata
+                else:
+                    self._descartar(candidata)
+        except Exception:
+            self._cupos.release()
+            raise
+
+        espera = time.monotonic() - inicio
+        with self._lock:
+            self._metricas["checkouts"] += 1
+            self._metricas["wait_time_total"] += espera
+            self._metricas["wait_time_max"] = max(self._metricas["wait_time_max"], espera)
+        return ConexionPool(self, conn)
+
+    def _devolver(self, conn):
+        try:
+            try:
+                # No dejar transacciones abiertas para el siguiente handler
+                if conn.is_connected() and conn.in_transaction:
+                    conn.rollback()
+                reutilizable = conn.is_connected()
+            except Exception:
+                reutilizable = False
+
+            if reutilizable:
+                self._libres.put((conn, time.monotonic()))
+            else:
+                self._descartar(conn)
+        finally:
+            self._cupos.release()
+
+    def metricas(self):
+        with self._lock:
+            m = dict(self._metricas)
+            m["open"] = self._abiertas
+        m["idle"] = self._libres.qsize()
+        m["in_use"] = m["open"] - m["idle"]
+        m["size"] = self.size
+        m["pid"] = self.pid
+        m["wait_time_avg"] = (m["wait_time_total"] / m["checkouts"]) if m["checkouts"] else 0.0
+        return m
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Devuelve el pool del proceso actual.
+
+    Bajo gunicorn cada worker es un proceso distinto (fork): si el PID cambió
+    se crea un pool nuevo en vez de compartir sockets heredados del master.
+    """
+    global _pool
+    pid = os.getpid()
+    if _pool is None or _pool.pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool.pid != pid:
+                _pool = PoolConexiones(config)
+    return _pool
+
+
+def get_connection():
+    """Presta una conexión del pool. Usar `conn.close()` para devolverla."""
+    return get_pool().get_connection()
+
+
+def pool_metricas():
+    return get_pool().metricas()
+
+
+def set_conector(conector):
+    """
+    Reemplaza la función que abre conexiones nuevas y descarta el pool actual.
+    La usan los benchmarks para medir contra una base falsa o contar idas y vueltas.
+    """
+    global _conector, _pool
+    with _pool_lock:
+        _conector = conector
+        _pool = None
@@ -0,0 +1,120 @@
+"""
+Columnas id_dispositivo e id_proyecto copiadas en cada fila de `datos`.
+
+Con DATOS_DESNORMALIZADOS=1 (después de python manage.py desnormalizar) la
+ingesta escribe en cada medición el dispositivo y el proyecto de su sensor,
+resueltos con la topología en memoria (también /agregarDatos y
+/modificarDatos), y los listados agregan a sus filtros por disp.id_proyecto /
+disp.codigo_interno una condición previa sobre esas columnas. Así MySQL puede
+recorrer los índices (id_proyecto, fecha) e (id_dispositivo, fecha) de
+`datos` y hacer los joins solo con las filas del resultado. Las filas con la
+columna en NULL (aún sin rellenar) pasan la condición previa y las decide el
+join.
+
+Las columnas guardan el dispositivo del sensor al momento de la medición: si
+un sensor se cambia a un dispositivo que no comparte sensores con el anterior,
+sus mediciones previas dejan de aparecer en los filtros del dispositivo nuevo
+hasta que manage.py desnormalizar --todo las recalcula.
+"""
+from dotenv import load_dotenv
+
+import os
+
+from topologia import topologia
+
+
+load_dotenv()
+
+DATOS_DESNORMALIZADOS = os.getenv("DATOS_DESNORMALIZADOS", "0") in ("1", "true", "True")
+
+# Columnas e índices que agrega manage.py desnormalizar
+COLUMNAS_DESNORMALIZADAS = {
+    "id_dispositivo": "INT NULL",
+    "id_proyecto": "INT NULL",
+}
+INDICES_DESNORMALIZADOS = {
+    "ix_datos_proyecto_fecha": "(id_proyecto, fecha)",
+    "ix_datos_dispositivo_fecha": "(id_dispositivo, fecha)",
+}
+
+# Relleno de un rango de id_dato desde la topología actual
+RELLENAR_SQL = """
+    UPDATE datos AS d
+    JOIN sensores_en_dispositivo AS sed ON d.id_sensor = sed.id_sensor
+    JOIN dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
+    SET d.id_dispositivo = disp.id_dispositivo, d.id_proyecto = disp.id_proyecto
+    WHERE d.id_dato >= %s AND d.id_dato < %s {condicion}
+"""
+
+
+def dispositivo_de_sensor(id_sensor, cursor=None):
+    """
+    (id_dispositivo, id_proyecto) del sensor según la topología, o (None, None)
+    si no está asociado a un dispositivo. Si está en varios se usa el primero.
+    """
+    ids = topologia.dispositivos_de_sensor(id_sensor, cursor)
+    if not ids:
+        return None, None
+    info = topologia.info_dispositivo(ids[0], cursor) or {}
+    return ids[0], info.get("id_proyecto")
+
+
+def desnormalizar_filas(filas, cursor=None):
+    """
+    Agrega (id_dispositivo, id_proyecto) a cada fila de `datos` (id_sensor, ...).
+    Si la topología debe recargarse se lee con `cursor` (la conexión de la ingesta).
+    """
+    dispositivos = {}
+    resultado = []
+    for fila in filas:
+        id_sensor = fila[0]
+        extra = dispositivos.get(id_sensor)
+        if extra is None:
+            extra = dispositivos[id_sensor] = dispositivo_de_sensor(id_sensor, cursor)
+        resultado.append(tuple(fila) + extra)
+    return resultado
+
+
+def dispositivos_posibles(ids_dispositivo, cursor=None):
+    """
+    id_dispositivo que pueden tener guardados las mediciones de los sensores
+    de esos dispositivos: si un sensor está en varios, la medición lleva solo
+    uno de ellos.
+    """
+    return topologia.dispositivos_relacionados(ids_dispositivo, cursor)
+
+
+def condicion_filtro(key, values, desnormalizado=True):
+    """
+    Condición y parámetros del filtro `key`=valor1,valor2 de los listados
+    estructurados ("(key=%s OR key=%s)"). Con DATOS_DESNORMALIZADOS, para
+    disp.id_proyecto y disp.codigo_interno se antepone una condición sobre
+    d.id_proyecto / d.id_dispositivo (o NULL) que usa los índices de `datos`;
+    la original se mantiene y decide las filas que pasan esa condición.
+    Con `desnormalizado` en False (la tabla leída no tiene esas columnas)
+    retorna solo la condición original.
+    """
+    condicion = "(" + " OR ".join([f"{key}=%s" for _ in values]) + ")"
+    params = list(values)
+    if not DATOS_DESNORMALIZADOS or not desnormalizado:
+        return condicion, params
+
+    if key == "disp.id_proyecto":
+        dispositivos = [i for id_proyecto in values for i in topologia.dispositivos_proyecto(id_proyecto)]
+    elif key == "disp.codigo_interno":
+        dispositivos = [i for codigo in values for i, _ in topologia.dispositivos(codigo)]
+    else:
+        return condicion, params
+    if not dispositivos:
+        # Fuera de la topología: solo los joins
+        return condicion, params
+
+    dispositivos = dispositivos_posibles(dispositivos)
+    if key == "disp.id_proyecto":
+        proyectos = {(topologia.info_dispositivo(i) or {}).get("id_proyecto") for i in dispositivos}
+        ids = sorted(str(p) for p in proyectos if p is not None)
+        columna = "d.id_proyecto"
+    else:
+        ids = dispositivos
+        columna = "d.id_dispositivo"
+    return f"(({columna} IN ({','.join(['%s'] * len(ids))}) OR {columna} IS NULL) AND {condicion})", ids + params
@@ -37,6 +37,16 @@ module.exports = {
       args: "app.py",
       interpreter: "none",
       cwd: "./"
+    },
+    {
+      // Particiones de los próximos meses y retención de `datos` (python manage.py particiones)
+      name: "api_sensores_particiones",
+      script: "venv/Scripts/python.exe",
+      args: "manage.py particiones",
+      interpreter: "none",
+      cwd: "./",
+      cron_restart: "30 3 * * *",
+      autorestart: false
     }
   ]
 }
\ No newline at end of file
@@ -4,6 +4,9 @@ import os
 
 files_bp = Blueprint("files", __name__)
 
+# CSV y CSV comprimidos (los que escribe python manage.py archivar)
+EXTENSIONES_CSV = ('.csv', '.csv.gz')
+
 
 
 @files_bp.route('/listarProyectos', methods=['GET'])
@@ -37,7 +40,7 @@ def listar_proyectos():
 @files_bp.route('/listarArchivosCSV', methods=['GET'])
 def listar_archivos_csv():
     """
-    Lista los archivos CSV por proyecto con estructura jerárquica.
+    Lista los archivos CSV (.csv y .csv.gz) por proyecto con estructura jerárquica.
     ---
     tags:
       - Archivos
@@ -89,7 +92,7 @@ def listar_archivos_csv():
             archivos_csv = []
             for root, dirs, files in os.walk(ruta_dispositivo):
               for archivo in files:
-                if archivo.lower().endswith('.csv'):
+                if archivo.lower().endswith(EXTENSIONES_CSV):
                   ruta_archivo = os.path.join(root, archivo)
                   tamaño = os.path.getsize(ruta_archivo)
                   # ruta relativa respecto a la carpeta del dispositivo (incluye la carpeta de fecha)
@@ -106,7 +109,7 @@ def listar_archivos_csv():
           archivos_en_raiz = []
           for f in os.listdir(ruta_proyecto):
             ruta_f = os.path.join(ruta_proyecto, f)
-            if os.path.isfile(ruta_f) and f.lower().endswith('.csv'):
+            if os.path.isfile(ruta_f) and f.lower().endswith(EXTENSIONES_CSV):
               tamaño = os.path.getsize(ruta_f)
               archivos_en_raiz.append({
                 "nombre": f,
@@ -145,7 +148,7 @@ def listar_archivos_csv():
                 archivos_csv = []
                 for root, dirs, files in os.walk(ruta_dispositivo):
                   for archivo in files:
-                    if archivo.lower().endswith('.csv'):
+                    if archivo.lower().endswith(EXTENSIONES_CSV):
                       ruta_archivo = os.path.join(root, archivo)
                       tamaño = os.path.getsize(ruta_archivo)
                       ruta_relativa = os.path.relpath(ruta_archivo, ruta_dispositivo)
@@ -161,7 +164,7 @@ def listar_archivos_csv():
               archivos_en_raiz = []
               for f in os.listdir(ruta_proyecto):
                 ruta_f = os.path.join(ruta_proyecto, f)
-                if os.path.isfile(ruta_f) and f.lower().endswith('.csv'):
+                if os.path.isfile(ruta_f) and f.lower().endswith(EXTENSIONES_CSV):
                   tamaño = os.path.getsize(ruta_f)
                   archivos_en_raiz.append({
                     "nombre": f,
@@ -227,7 +230,9 @@ def descargar_por_nombre():
           if not ruta_real.startswith(directorio_real):
             continue
 
-          tipo_mime, _ = mimetypes.guess_type(ruta_archivo)
+          tipo_mime, codificacion = mimetypes.guess_type(ruta_archivo)
+          if codificacion == 'gzip':
+            tipo_mime = 'application/gzip'
           if not tipo_mime:
             tipo_mime = 'application/octet-stream'
 
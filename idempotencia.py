@@ -0,0 +1,117 @@
+from dotenv import load_dotenv
+
+from flask import request, jsonify, current_app
+import collections
+import functools
+import os
+import threading
+import time
+
+
+load_dotenv()
+
+# Claves de idempotencia recordadas por proceso y por cuánto tiempo
+IDEMPOTENCIA_MAX = int(os.getenv("IDEMPOTENCIA_MAX", 10000))
+IDEMPOTENCIA_TTL = float(os.getenv("IDEMPOTENCIA_TTL", 600))
+
+IDEMPOTENCIA_HEADER = 'Idempotency-Key'
+IDEMPOTENCIA_PARAM = 'idempotencyKey'
+
+
+class CacheIdempotencia:
+    """
+    Cache acotado (LRU + TTL) de respuestas exitosas por clave de idempotencia.
+
+    Mientras una petición con una clave está en curso, la clave queda marcada
+    y los reintentos simultáneos reciben 409 en vez de insertar en paralelo.
+    """
+
+    def __init__(self, max_claves=IDEMPOTENCIA_MAX, ttl=IDEMPOTENCIA_TTL):
+        self.max_claves = max_claves
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._respuestas = collections.OrderedDict()  # clave -> (expira, cuerpo, status, mimetype)
+        self._en_curso = set()
+        self._metricas = {"aciertos": 0, "registradas": 0, "en_curso": 0}
+
+    def tomar(self, clave):
+        """
+        Retorna la respuesta guardada para la clave, 'en_curso' si otra petición
+        la está procesando, o None si la petición debe procesarse (y la marca).
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            guardada = self._respuestas.get(clave)
+            if guardada is not None:
+                if guardada[0] > ahora:
+                    self._respuestas.move_to_end(clave)
+                    self._metricas["aciertos"] += 1
+                    return guardada
+                del self._respuestas[clave]
+            if clave in self._en_curso:
+                self._metricas["en_curso"] += 1
+                return 'en_curso'
+            self._en_curso.add(clave)
+            return None
+
+    def guardar(self, clave, cuerpo, status, mimetype):
+        with self._lock:
+            self._en_curso.discard(clave)
+            self._respuestas[clave] = (time.monotonic() + self.ttl, cuerpo, status, mimetype)
+            self._respuestas.move_to_end(clave)
+            self._metricas["registradas"] += 1
+            while len(self._respuestas) > self.max_claves:
+                self._respuestas.popitem(last=False)
+
+    def liberar(self, clave):
+        with self._lock:
+            self._en_curso.discard(clave)
+
+    def metricas(self):
+        with self._lock:
+            m = dict(self._metricas)
+            m["claves"] = len(self._respuestas)
+        m["capacidad"] = self.max_claves
+        m["ttl"] = self.ttl
+        return m
+
+
+cache_idempotencia = CacheIdempotencia()
+
+
+def idempotente(vista):
+    """
+    Decorador para endpoints de ingesta: si la petición trae una clave de
+    idempotencia (header Idempotency-Key o parámetro idempotencyKey) y ya se
+    respondió con éxito a esa clave, se devuelve la misma respuesta sin volver
+    a insertar. Solo se recuerdan respuestas 2xx; los errores se pueden reintentar.
+    """
+    @functools.wraps(vista)
+    def envoltura(*args, **kwargs):
+        clave = request.headers.get(IDEMPOTENCIA_HEADER) or request.args.get(IDEMPOTENCIA_PARAM)
+        if not clave:
+            return vista(*args, **kwargs)
+
+        clave = f"{request.path}:{clave}"
+        guardada = cache_idempotencia.tomar(clave)
+        if guardada == 'en_curso':
+            return jsonify({'status': 'fail', 'error': 'Ya hay una petición en curso con la misma clave de idempotencia'}), 409, {'Retry-After': '1'}
+        if guardada is not None:
+            _, cuerpo, status, mimetype = guardada
+            respuesta = current_app.response_class(cuerpo, status=status, mimetype=mimetype)
+            respuesta.headers['Idempotent-Replayed'] = 'true'
+            return respuesta
+
+        try:
+            respuesta = current_app.make_response(vista(*args, **kwargs))
+        except Exception:
+            cache_idempotencia.liberar(clave)
+            raise
+
+        if 200 <= respuesta.status_code < 300:
+            cache_idempotencia.guardar(clave, respuesta.get_data(), respuesta.status_code, respuesta.mimetype)
+        else:
+            cache_idempotencia.liberar(clave)
+        return respuesta
+
+    return envoltura
@@ -0,0 +1,243 @@
+"""
+Índices para las consultas frecuentes sobre `datos` (python manage.py indices).
+
+El repositorio no trae el esquema: los índices se revisan contra la base en
+uso (information_schema) y se comparan los planes (EXPLAIN) y tiempos de las
+consultas que emite la API antes y después de crearlos.
+"""
+import time
+from datetime import timedelta
+
+from resumenes import VALOR_NUMERICO_RAPIDO_SQL
+
+
+# Índices que usan las consultas de la API: nombre -> (tabla, columnas, para qué).
+# Un índice existente con las mismas primeras columnas (en el mismo orden) ya sirve.
+INDICES_RECOMENDADOS = {
+    "ix_datos_sensor_fecha": (
+        "datos", ("id_sensor", "fecha"),
+        "listados y conteos por dispositivo en un rango de fechas",
+    ),
+    "ix_datos_sensor_variable_fecha": (
+        "datos", ("id_sensor", "id_variable", "fecha"),
+        "alertas por parámetro (sensor y variable) en un rango de fechas",
+    ),
+    "ix_datos_fecha": (
+        "datos", ("fecha",),
+        "listados sin filtro de dispositivo y /ultimoValor",
+    ),
+    "ix_datos_proyecto_fecha": (
+        "datos", ("id_proyecto", "fecha"),
+        "filtro disp.id_proyecto con DATOS_DESNORMALIZADOS=1 (manage.py desnormalizar)",
+    ),
+    "ix_datos_dispositivo_fecha": (
+        "datos", ("id_dispositivo", "fecha"),
+        "filtro disp.codigo_interno y alertas con DATOS_DESNORMALIZADOS=1",
+    ),
+    "ix_sed_dispositivo_sensor": (
+        "sensores_en_dispositivo", ("id_dispositivo", "id_sensor"),
+        "sensores de los dispositivos filtrados",
+    ),
+    "ix_sed_sensor_dispositivo": (
+        "sensores_en_dispositivo", ("id_sensor", "id_dispositivo"),
+        "dispositivo de cada medición en los joins",
+    ),
+    "ix_dispositivos_codigo": (
+        "dispositivos", ("codigo_interno",),
+        "filtro disp.codigo_interno",
+    ),
+    "ix_dispositivos_proyecto_codigo": (
+        "dispositivos", ("id_proyecto", "codigo_interno"),
+        "filtro disp.id_proyecto y dispositivos de las alertas",
+    ),
+}
+
+_JOINS_DISPOSITIVO = """
+    FROM
+        sensores_dev.datos AS d
+    LEFT JOIN
+        sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
+    LEFT JOIN
+        sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
+    LEFT JOIN
+        sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
+"""
+
+# Formas de las consultas de la API, con los parámetros de parametros_muestra():
+# nombre -> (origen, SQL, nombres de los parámetros)
+CONSULTAS = {
+    "listado_dispositivo": (
+        "/listarDatosEstructuradosV2?disp.codigo_interno=...&fecha_inicio=...&fecha_fin=...",
+        "SELECT d.id_dato, d.fecha, d.valor" + _JOINS_DISPOSITIVO +
+        "WHERE (d.fecha >= %s) AND (d.fecha <= %s) AND (disp.codigo_interno=%s) ORDER BY d.fecha DESC LIMIT 1000",
+        ("desde", "hasta", "codigo_interno"),
+    ),
+    "listado_proyecto": (
+        "/listarDatosEstructurados?disp.id_proyecto=...&fecha_inicio=...&fecha_fin=...",
+        "SELECT d.id_dato, d.fecha, d.valor" + _JOINS_DISPOSITIVO +
+        "WHERE (d.fecha >= %s) AND (d.fecha <= %s) AND (disp.id_proyecto=%s) ORDER BY d.fecha DESC LIMIT 1000",
+        ("desde", "hasta", "id_proyecto"),
+    ),
+    "conteo_dispositivo": (
+        "f_numero_mediciones_por_dispositivo",
+        "SELECT COUNT(*)" + _JOINS_DISPOSITIVO +
+        "WHERE (disp.codigo_interno IN (%s)) AND (d.fecha >= %s) AND (d.fecha <= %s)",
+        ("codigo_interno", "desde", "hasta"),
+    ),
+    "serie_dispositivo": (
+        "/serieAgregada?disp.codigo_interno=...&intervalo=1h (sin RESUMENES)",
+        "SELECT FLOOR(TIMESTAMPDIFF(SECOND, '1970-01-01', d.fecha) / 3600) AS cubeta, "
+        "SUM(d.valor + 0e0), COUNT(d.valor)" + _JOINS_DISPOSITIVO +
+        "WHERE (d.fecha >= %s) AND (d.fecha <= %s) AND (disp.codigo_interno IN (%s)) AND "
+        + VALOR_NUMERICO_RAPIDO_SQL + " GROUP BY cubeta",
+        ("desde", "hasta", "codigo_interno"),
+    ),
+    "alerta_dispositivos": (
+        "alertas: dispositivos del proyecto",
+        "SELECT id_dispositivo, codigo_interno FROM sensores_dev.dispositivos "
+        "WHERE id_proyecto = %s AND codigo_interno IN (%s)",
+        ("id_proyecto", "codigo_interno"),
+    ),
+    "alerta_parametro": (
+        "alertas: _validate_*",
+        "SELECT d.id_dato, d.fecha, d.valor FROM sensores_dev.datos AS d "
+        "WHERE ((d.id_variable = %s AND d.id_sensor IN (%s))) AND d.fecha >= %s AND d.fecha <= %s "
+        "ORDER BY d.fecha DESC",
+        ("id_variable", "id_sensor", "desde", "hasta"),
+    ),
+    "ultimo_valor": (
+        "/ultimoValor?tabla=datos&columna=fecha",
+        "SELECT MAX(fecha) FROM sensores_dev.datos",
+        (),
+    ),
+}
+
+# Última medición (por la llave primaria) y su dispositivo, para armar los parámetros de muestra
+MUESTRA_SQL = """
+    SELECT d.id_sensor, d.id_variable, d.fecha, disp.codigo_interno, disp.id_proyecto
+    FROM (SELECT id_sensor, id_variable, fecha FROM datos ORDER BY id_dato DESC LIMIT 1) AS d
+    JOIN sensores_en_dispositivo AS sed ON d.id_sensor = sed.id_sensor
+    JOIN dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
+    LIMIT 1
+"""
+
+# Lo mismo para un dispositivo
+MUESTRA_DISPOSITIVO_SQL = """
+    SELECT d.id_sensor, d.id_variable, d.fecha, disp.codigo_interno, disp.id_proyecto
+    FROM dispositivos AS disp
+    JOIN sensores_en_dispositivo AS sed ON disp.id_dispositivo = sed.id_dispositivo
+    JOIN datos AS d ON d.id_sensor = sed.id_sensor
+    WHERE disp.codigo_interno = %s
+    ORDER BY d.id_dato DESC
+    LIMIT 1
+"""
+
+
+def indices_existentes(cursor, tablas):
+    """{tabla: {índice: (columnas...)}} de la base actual."""
+    cursor.execute(
+        f"""
+        SELECT table_name, index_name, column_name
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name IN ({','.join(['%s'] * len(tablas))})
+        ORDER BY table_name, index_name, seq_in_index
+        """,
+        list(tablas)
+    )
+    indices = {tabla: {} for tabla in tablas}
+    for tabla, indice, columna in cursor.fetchall():
+        indices.setdefault(tabla, {}).setdefault(indice, ())
+        indices[tabla][indice] += (columna,)
+    return indices
+
+
+def columnas_existentes(cursor, tablas):
+    """{tabla: {columnas}} de la base actual (las tablas que no existen quedan vacías)."""
+    cursor.execute(
+        f"""
+        SELECT table_name, column_name
+        FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name IN ({','.join(['%s'] * len(tablas))})
+        """,
+        list(tablas)
+    )
+    columnas = {tabla: set() for tabla in tablas}
+    for tabla, columna in cursor.fetchall():
+        columnas.setdefault(tabla, set()).add(columna)
+    return columnas
+
+
+def revisar_indices(cursor):
+    """
+    Estado de cada índice recomendado: lista de (nombre, tabla, columnas, para qué, estado)
+    donde estado es "falta", "sin columnas" (la tabla no tiene alguna columna) o
+    el nombre del índice existente que ya lo cubre.
+    """
+    tablas = sorted({tabla for tabla, _, _ in INDICES_RECOMENDADOS.values()})
+    existentes = indices_existentes(cursor, tablas)
+    columnas = columnas_existentes(cursor, tablas)
+    resultado = []
+    for nombre, (tabla, cols, motivo) in INDICES_RECOMENDADOS.items():
+        if not set(cols) <= columnas[tabla]:
+            estado = "sin columnas"
+        else:
+            estado = next(
+                (indice for indice, actuales in existentes[tabla].items() if actuales[:len(cols)] == cols),
+                "falta"
+            )
+        resultado.append((nombre, tabla, cols, motivo, estado))
+    return resultado
+
+
+def crear_indice(cursor, nombre):
+    tabla, cols, _ = INDICES_RECOMENDADOS[nombre]
+    cursor.execute(f"ALTER TABLE {tabla} ADD INDEX {nombre} ({', '.join(cols)})")
+
+
+def parametros_muestra(cursor, codigo_interno=None, dias=1):
+    """
+    Parámetros para CONSULTAS tomados de la última medición (del dispositivo
+    `codigo_interno` si se indica): su sensor, variable, dispositivo y proyecto,
+    y los `dias` anteriores a su fecha. None si no hay mediciones.
+    """
+    if codigo_interno:
+        cursor.execute(MUESTRA_DISPOSITIVO_SQL, (codigo_interno,))
+    else:
+        cursor.execute(MUESTRA_SQL)
+    fila = cursor.fetchone()
+    if fila is None:
+        return None
+    id_sensor, id_variable, fecha, codigo, id_proyecto = fila
+    return {
+        "id_sensor": id_sensor,
+        "id_variable": id_variable,
+        "codigo_interno": codigo,
+        "id_proyecto": id_proyecto,
+        "desde": fecha - timedelta(days=dias),
+        "hasta": fecha,
+    }
+
+
+def parametros_consulta(nombre, muestra):
+    """SQL y parámetros de la consulta `nombre` de CONSULTAS con los valores de `muestra`."""
+    _, sql, nombres = CONSULTAS[nombre]
+    return sql, [muestra[n] for n in nombres]
+
+
+def explicar(cursor, sql, params):
+    """Filas del EXPLAIN como dicts (table, type, key, rows, Extra, ...)."""
+    cursor.execute("EXPLAIN " + sql, params)
+    nombres = cursor.column_names
+    return [dict(zip(nombres, fila)) for fila in cursor.fetchall()]
+
+
+def medir(cursor, sql, params, repeticiones=3):
+    """Menor tiempo (segundos) de `repeticiones` ejecuciones leyendo todas las filas."""
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.monotonic()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        duracion = time.monotonic() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor
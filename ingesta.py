@@ -0,0 +1,274 @@
+from dotenv import load_dotenv
+
+import atexit
+import collections
+import json
+import os
+import threading
+import time
+
+from db import error_transitorio, get_connection
+from mediciones import insertar_aislando, insertar_datos
+from spool import SPOOL_HABILITADO, SpoolLlenoError, get_spool
+
+
+load_dotenv()
+
+# Modo write-behind: las mediciones validadas se encolan y un hilo las escribe en grupo
+INGESTA_ASINCRONA = os.getenv("INGESTA_ASINCRONA", "0") in ("1", "true", "True")
+COLA_MAX_FILAS = int(os.getenv("COLA_MAX_FILAS", 50000))     # Capacidad de la cola (filas)
+COLA_FLUSH_FILAS = int(os.getenv("COLA_FLUSH_FILAS", 500))   # Escribir al juntar estas filas...
+COLA_FLUSH_MS = int(os.getenv("COLA_FLUSH_MS", 200))         # ...o al pasar estos milisegundos
+COLA_DRAIN_TIMEOUT = float(os.getenv("COLA_DRAIN_TIMEOUT", 30))
+# Filas que la base rechaza por sus datos (una por línea, JSON con el error)
+COLA_RECHAZADAS = os.getenv(
+    "COLA_RECHAZADAS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cola_rechazadas.jsonl")
+)
+
+
+class ColaLlenaError(Exception):
+    """La cola de escritura no tiene capacidad para las filas recibidas."""
+
+
+class ColaEscritura:
+    """
+    Cola acotada en memoria con un hilo escritor que hace commits agrupados.
+
+    El hilo junta filas hasta `flush_filas` o hasta que pasen `flush_ms`
+    desde la primera fila pendiente, y las inserta en una sola transacción.
+    Si la base de datos no está disponible (error_transitorio), las filas
+    vuelven al inicio de la cola y se reintenta con espera exponencial;
+    mientras tanto la cola se llena y las peticiones nuevas reciben 429.
+    Si la base rechaza el lote por sus datos, se separan las filas inválidas
+    (insertar_aislando), se anotan en COLA_RECHAZADAS y el resto se escribe.
+    """
+
+    def __init__(self, max_filas=COLA_MAX_FILAS, flush_filas=COLA_FLUSH_FILAS, flush_ms=COLA_FLUSH_MS):
+        self.max_filas = max_filas
+        self.flush_filas = flush_filas
+        self.flush_s = flush_ms / 1000.0
+        self.pid = os.getpid()
+
+        self._filas = collections.deque()
+        self._cond = threading.Condition()
+        self._detener = False
+        self._escribiendo = 0
+        self._hilo = threading.Thread(target=self._loop, name="cola-escritura", daemon=True)
+        self._metricas = {
+            "encoladas": 0,
+            "escritas": 0,
+            "rechazadas": 0,
+            "commits": 0,
+            "errores": 0,
+            "descartadas": 0,
+        }
+        self._hilo.start()
+
+    def encolar(self, filas):
+        """Encola todas las filas o ninguna. Lanza ColaLlenaError si no caben."""
+        with self._cond:
+            if self._detener:
+                raise ColaLlenaError("La cola de escritura se está cerrando")
+            if len(self._filas) + len(filas) > self.max_filas:
+                self._metricas["rechazadas"] += len(filas)
+                raise ColaLlenaError(f"Cola de escritura llena ({len(self._filas)}/{self.max_filas} filas)")
+            self._filas.extend(filas)
+            self._metricas["encoladas"] += len(filas)
+            self._cond.notify()
+
+    def _tomar_lote(self):
+        with self._cond:
+            while not self._filas and not self._detener:
+                self._cond.wait()
+            if not self._filas:
+                return None
+
+            # Esperar a completar el lote o a que venza el plazo
+            limite = time.monotonic() + self.flush_s
+            while len(self._filas) < self.flush_filas and not self._detener:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                self._cond.wait(restante)
+
+            n = min(len(self._filas), self.flush_filas)
+            lote = [self._filas.popleft() for _ in range(n)]
+            self._escribiendo = len(lote)
+            return lote
+
+    def _escribir(self, lote, aislar=False):
+        """Escribe el lote en una transacción. Retorna las filas rechazadas [(fila, error), ...]."""
+        conn = None
+        cursor = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor()
+            rechazadas = []
+            if aislar:
+                _, rechazadas = insertar_aislando(cursor, lote)
+            else:
+                insertar_datos(cursor, lote)
+            conn.commit()
+            return rechazadas
+        finally:
+            if conn is not None and conn.is_connected():
+                cursor.close()
+                conn.close()
+
+    def _descartar(self, rechazadas):
+        """Anota en el log y en COLA_RECHAZADAS las filas que la base no aceptó."""
+        if not rechazadas:
+            return
+        ahora = time.strftime('%Y-%m-%d %H:%M:%S')
+        for fila, error in rechazadas:
+            print(f"{ahora}: Fila descartada de la cola de escritura: {fila!r}: {error}")
+        try:
+            with open(COLA_RECHAZADAS, "a", encoding="utf-8") as f:
+                for fila, error in rechazadas:
+                    f.write(json.dumps({"fecha": ahora, "error": str(error), "fila": list(fila)}, default=str) + "\n")
+        except OSError as e:
+            print(f"{ahora}: No se pudieron guardar las filas descartadas en {COLA_RECHAZADAS}: {e}")
+        with self._cond:
+            self._metricas["descartadas"] += len(rechazadas)
+
+    def _loop(self):
+        espera = 0.5
+        while True:
+            lote = self._tomar_lote()
+            if lote is None:
+                return
+            try:
+                try:
+                    rechazadas = self._escribir(lote)
+                except Exception as e:
+                    if error_transitorio(e):
+                        raise
+                    # Reintentar el lote completo daría el mismo error
+                    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: Lote de {len(lote)} filas rechazado, se separan las filas inválidas: {e}")
+                    with self._cond:
+                        self._metricas["errores"] += 1
+                    rechazadas = self._escribir(lote, aislar=True)
+                self._descartar(rechazadas)
+                espera = 0.5
+                with self._cond:
+                    self._metricas["escritas"] += len(lote) - len(rechazadas)
+                    self._metricas["commits"] += 1
+                    self._escribiendo = 0
+                    self._cond.notify_all()
+            except Exception as e:
+                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: Error escribiendo lote de {len(lote)} filas: {e}")
+                if not error_transitorio(e):
+                    # Ni separando filas se pudo escribir: no bloquear la cola con este lote
+                    self._descartar([(fila, e) for fila in lote])
+                    with self._cond:
+                        self._metricas["errores"] += 1
+                        self._escribiendo = 0
+                        self._cond.notify_all()
+                    continue
+                with self._cond:
+                    self._metricas["errores"] += 1
+                    # Devolver el lote al inicio de la cola para no perder el orden
+                    self._filas.extendleft(reversed(lote))
+                    self._escribiendo = 0
+                    detener = self._detener
+                if detener:
+                    # Cerrando y sin base de datos: no reintentar indefinidamente
+                    return
+                time.sleep(espera)
+                espera = min(espera * 2, 30)
+
+    def detener(self, timeout=COLA_DRAIN_TIMEOUT):
+        """Deja de aceptar filas y espera a que el hilo vacíe la cola."""
+        with self._cond:
+            self._detener = True
+            self._cond.notify_all()
+        self._hilo.join(timeout)
+        pendientes = len(self._filas)
+        if pendientes:
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: Cola de escritura cerrada con {pendientes} filas sin escribir")
+        return pendientes
+
+    def metricas(self):
+        with self._cond:
+            m = dict(self._metricas)
+            m["pendientes"] = len(self._filas) + self._escribiendo
+        m["capacidad"] = self.max_filas
+        m["pid"] = self.pid
+        return m
+
+
+_cola = None
+_cola_lock = threading.Lock()
+
+
+def get_cola():
+    """Cola del proceso actual (una por worker de gunicorn, igual que el pool)."""
+    global _cola
+    pid = os.getpid()
+    if _cola is None or _cola.pid != pid:
+        with _cola_lock:
+            if _cola is None or _cola.pid != pid:
+                _cola = ColaEscritura()
+                atexit.register(_cola.detener)
+    return _cola
+
+
+def registrar_filas(filas, rechazadas=None):
+    """
+    Registra filas ya validadas de `datos` según el modo de ingesta configurado.
+
+    Retorna 'insertado' si quedaron confirmadas en la base de datos, o
+    'encolado' si se aceptaron en el spool en disco (SPOOL_HABILITADO=1, tiene
+    prioridad) o en la cola de escritura (INGESTA_ASINCRONA=1).
+    Lanza ColaLlenaError si el spool o la cola no tienen capacidad y deja pasar
+    los errores de mysql.connector del modo síncrono.
+
+    Si se entrega la lista `rechazadas`, en el modo síncrono las filas que la
+    base rechaza por sus datos (sensor inexistente, valor inválido...) se
+    separan con insertar_aislando y se agregan a ella como (fila, error); las
+    demás se insertan igual. Los errores transitorios se siguen propagando.
+    """
+    if SPOOL_HABILITADO:
+        try:
+            get_spool().escribir(filas)
+            return 'encolado'
+        except SpoolLlenoError as e:
+            raise ColaLlenaError(str(e))
+        except OSError as e:
+            # Sin disco disponible se intenta la inserción directa
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: Error escribiendo en el spool, se inserta directo: {e}")
+
+    elif INGESTA_ASINCRONA:
+        get_cola().encolar(filas)
+        return 'encolado'
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            insertar_datos(cursor, filas)
+        except Exception as e:
+            if rechazadas is None or error_transitorio(e):
+                raise
+            conn.rollback()
+            _, separadas = insertar_aislando(cursor, filas)
+            rechazadas.extend(separadas)
+        conn.commit()
+        return 'insertado'
+    finally:
+        if conn is not None and conn.is_connected():
+            cursor.close()
+            conn.close()
+
+
+def metricas_ingesta():
+    if SPOOL_HABILITADO:
+        modo = "spool"
+    else:
+        modo = "asincrono" if INGESTA_ASINCRONA else "sincrono"
+    return {
+        "modo": modo,
+        "cola": get_cola().metricas() if modo == "asincrono" else None,
+    }
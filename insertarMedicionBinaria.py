@@ -0,0 +1,132 @@
+from flask import Blueprint, request, jsonify
+import mysql.connector
+from datetime import datetime
+import os
+
+import numpy as np
+
+from trama import decodificar_trama, TramaInvalidaError
+from ingesta import registrar_filas, ColaLlenaError
+from topologia import topologia
+from idempotencia import idempotente
+
+
+insertar_medicion_binaria_bp = Blueprint('insertar_medicion_binaria', __name__)
+
+# Tamaño máximo aceptado de una trama (bytes)
+TRAMA_MAX_BYTES = int(os.getenv("TRAMA_MAX_BYTES", 1024 * 1024))
+
+
+def _filas_desde_trama(trama, fecha_insercion):
+    """
+    Convierte una trama en filas de `datos`, resolviendo codigo_interno e
+    id_sensor_tipo con el mapa de topología. Lanza LookupError si el
+    dispositivo o algún tipo de sensor no existe.
+    """
+    dispositivos = topologia.dispositivos(trama.codigo_interno)
+    if not dispositivos:
+        raise LookupError(f"Dispositivo '{trama.codigo_interno}' no encontrado")
+
+    # Igual que /insertarMedicionV2: el sensor del tipo en los dispositivos con ese código
+    sensores = []
+    for id_sensor_tipo, _ in trama.columnas:
+        id_sensor = next((s for s in (topologia.sensor(d, id_sensor_tipo) for d, _ in dispositivos) if s), None)
+        if id_sensor is None:
+            raise LookupError(f"El dispositivo '{trama.codigo_interno}' no tiene un sensor de tipo {id_sensor_tipo}")
+        sensores.append(id_sensor)
+    variables = [str(id_variable) for _, id_variable in trama.columnas]
+
+    # Valores con la representación más corta de float32 ("21.3", no "21.299999237060547");
+    # NaN e ±inf -> NULL (MySQL no los acepta como número y quedarían como texto 'inf')
+    valores = trama.valores.astype(str)
+    valores[~np.isfinite(trama.valores)] = ''
+    fechas = [
+        datetime.fromtimestamp(trama.timestamp_base + int(delta)).strftime('%Y-%m-%d %H:%M:%S')
+        for delta in trama.deltas
+    ]
+
+    return [
+        (sensores[j], valor or None, fechas[i], variables[j], None, fecha_insercion)
+        for i, fila in enumerate(valores.tolist())
+        for j, valor in enumerate(fila)
+    ]
+
+
+@insertar_medicion_binaria_bp.route('/insertarMedicionBinaria', methods=['POST'])
+@idempotente
+def insertar_medicion_binaria():
+    """
+    Inserta mediciones enviadas en una trama binaria compacta (formato documentado en trama.py).
+    ---
+    tags:
+      - Datos
+    consumes:
+      - application/octet-stream
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: >
+          Trama little-endian: "CM", versión (1), largo y código interno, timestamp base (uint32),
+          número de variables (uint16) y pares (id_sensor_tipo, id_variable) uint16, número de
+          muestras (uint16) y sus desfases en segundos (uint16), y la matriz de valores float32
+          (muestra por muestra; NaN o infinito = sin valor).
+        schema:
+          type: string
+          format: binary
+    responses:
+      201:
+        description: Mediciones insertadas.
+        schema:
+          type: object
+          properties:
+            status:
+              type: string
+              example: success
+            insertadas:
+              type: integer
+              example: 30
+      202:
+        description: Mediciones aceptadas en el spool o la cola de escritura.
+      400:
+        description: Trama mal formada.
+      404:
+        description: Dispositivo o tipo de sensor no encontrado.
+      413:
+        description: La trama supera TRAMA_MAX_BYTES.
+      429:
+        description: La cola de escritura está llena; reintentar más tarde.
+      500:
+        description: Error en la base de datos.
+    """
+    if request.content_length is not None and request.content_length > TRAMA_MAX_BYTES:
+        return jsonify({'status': 'fail', 'error': f'La trama supera {TRAMA_MAX_BYTES} bytes'}), 413
+
+    try:
+        trama = decodificar_trama(request.get_data(cache=False))
+    except TramaInvalidaError as e:
+        return jsonify({'status': 'fail', 'error': str(e)}), 400
+
+    try:
+        filas = _filas_desde_trama(trama, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    except LookupError as e:
+        return jsonify({'status': 'fail', 'error': str(e)}), 404
+    except mysql.connector.Error as e:
+        mensaje_error = f"Error al conectarse a la base de datos {e}"
+        print(mensaje_error)
+        return jsonify({'status': 'fail', 'error': mensaje_error}), 500
+
+    try:
+        modo = registrar_filas(filas)
+
+    except ColaLlenaError as e:
+        return jsonify({'status': 'fail', 'error': str(e)}), 429, {'Retry-After': '1'}
+
+    except mysql.connector.Error as e:
+        mensaje_error = f"Error al conectarse a la base de datos {e}"
+        print(mensaje_error)
+        return jsonify({'status': 'fail', 'error': mensaje_error}), 500
+
+    if modo == 'encolado':
+        return jsonify({'status': 'success', 'encoladas': len(filas)}), 202
+    return jsonify({'status': 'success', 'insertadas': len(filas)}), 201
@@ -1,19 +1,14 @@
-from dotenv import load_dotenv
 from flask import Blueprint,request, jsonify, current_app
 import mysql.connector
 from datetime import datetime
-import os
 
+from db import get_connection
+from mediciones import preparar_filas
+from ingesta import registrar_filas, ColaLlenaError
+from topologia import topologia
+from idempotencia import idempotente
 
 
-load_dotenv()
-config = {
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD"),
-    "host": os.getenv("DB_HOST"),
-    "database": os.getenv("DB_NAME"),
-    "port": int(os.getenv("DB_PORT", 3306)),  # Valor por defecto: 3306
-}
 insertar_medicion_bp = Blueprint('insertar_medicion', __name__)
 
 @insertar_medicion_bp.route('/generarLink', methods=['GET'])
@@ -26,7 +21,7 @@ def generar_link():
     # Si no hay id_dispositivo, buscarlo por codigo_interno
     if not id_dispositivos_raw and codigo_interno:
         try:
-            conn = mysql.connector.connect(**config)
+            conn = get_connection()
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT id_dispositivo FROM dispositivos WHERE codigo_interno = %s",
@@ -40,7 +35,7 @@ def generar_link():
                 conn.close()
 
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
 
         sql_query = """
@@ -127,7 +122,7 @@ def generar_link_v2():
     id_dispositivos_raw = request.args.get('id_dispositivo')  # Puede ser '1,2,3' o None
 
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
 
         sql_query = """
@@ -205,144 +200,137 @@ def generar_link_v2():
             cursor.close()
             conn.close()
 
+def _respuesta_eco(filas, dispositivo_de_sensor):
+    """
+    Arma la respuesta de listar_datos_estructurados_v2 a partir de las filas
+    recién recibidas y del mapa de topología en memoria, sin consultar la base
+    de datos ni usar pandas.
+
+    Mismo formato que el listado estructurado: una fila por (fecha, sesión,
+    dispositivo) con una columna "modelo [variable (unidad)]" por medición.
+    Los datos de la sesión (descripción, fecha de inicio, ubicación) no se
+    conocen sin leer la base de datos y quedan vacíos.
+    """
+    grupos = {}
+    for id_sensor, valor, fecha, id_variable, id_sesion, fecha_insercion in filas:
+        id_dispositivo = dispositivo_de_sensor.get(id_sensor)
+        clave = (fecha, fecha_insercion, id_sesion or "", id_dispositivo)
+        grupo = grupos.get(clave)
+        if grupo is None:
+            info = topologia.info_dispositivo(id_dispositivo) or {}
+            grupo = grupos[clave] = {
+                "fecha": fecha,
+                "fecha_insercion": fecha_insercion,
+                "id_sesion": id_sesion or "",
+                "sesion_descripcion": "",
+                "fecha_inicio": "",
+                "ubicacion": "",
+                "id_proyecto": info.get("id_proyecto"),
+                "codigo_interno": info.get("codigo_interno"),
+                "dispositivo_descripcion": info.get("descripcion"),
+                "_medidas": {},
+            }
+        etiqueta = topologia.unidad_medida(id_sensor, id_variable) or ""
+        grupo["_medidas"].setdefault(etiqueta, []).append("" if valor is None else str(valor))
+
+    # Columnas de medidas ordenadas como en el pivot; las que faltan en una fila quedan "nan"
+    etiquetas = sorted({etiqueta for grupo in grupos.values() for etiqueta in grupo["_medidas"]})
+    table_data = []
+    for clave in sorted(grupos, key=lambda c: c[0], reverse=True):
+        grupo = grupos[clave]
+        medidas = grupo.pop("_medidas")
+        fila = {k: "" if v is None else str(v) for k, v in grupo.items()}
+        for etiqueta in etiquetas:
+            valores = medidas.get(etiqueta, ["nan"])
+            fila[etiqueta] = valores[0] if len(valores) == 1 else valores
+        table_data.append(fila)
+
+    return {
+        'status': 'success',
+        'data': {
+            'tableData': table_data,
+            'tabla': 'datos',
+            'totalCount': len(table_data)
+        }
+    }
+
+
 @insertar_medicion_bp.route('/insertarMedicionV2', methods=['GET'])
+@idempotente
 def insertar_medicion_v2():
-    conn = None
-
     dispositivo_id_raw = request.args.get('idDispositivo', '')
     codigo_interno = request.args.get('codigoInterno', '')
     sensorTipo_ids = request.args.get('idsSensorTipo', '').split(',')
 
-    # Si no hay idDispositivo, buscarlo por codigoInterno
-    if not dispositivo_id_raw:
-        dispositivo_id = []
-        proyecto_id = []
-        if codigo_interno:
-            try:
-                conn = mysql.connector.connect(**config)
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT id_dispositivo, id_proyecto FROM dispositivos WHERE codigo_interno = %s",
-                    (codigo_interno,)
-                )
-                results = cursor.fetchall()
-                dispositivo_id = [str(row[0]) for row in results]
-                proyecto_id = [str(row[1]) for row in results]
-            finally:
-                if conn and conn.is_connected():
-                    cursor.close()
-                    conn.close()
-    else:
-        dispositivo_id = dispositivo_id_raw.split(',')
-
     timestamps = request.args.get('times', '').split(',')
     sesiones_ids = request.args.get('idsSesiones', '').split(',')
     variable_ids = request.args.get('idsVariables', '').split(',')
     values = request.args.get('valores', '').split(',')
 
-    # Determinar sensor_ids a partir de dispositivo_id y sensorTipo_ids
-    sensor_ids = []
     try:
-        conn = mysql.connector.connect(**config)
-        cursor = conn.cursor()
+        # Si no hay idDispositivo, buscarlo por codigoInterno (mapa en memoria)
+        if not dispositivo_id_raw:
+            dispositivo_id = []
+            proyecto_id = []
+            if codigo_interno:
+                for id_dispositivo, id_proyecto in topologia.dispositivos(codigo_interno):
+                    dispositivo_id.append(id_dispositivo)
+                    proyecto_id.append(id_proyecto)
+        else:
+            dispositivo_id = dispositivo_id_raw.split(',')
+            proyecto_id = []
+
+        # Determinar sensor_ids a partir de dispositivo_id y sensorTipo_ids
+        sensor_ids = []
+        dispositivo_de_sensor = {}
         for dispositivo in dispositivo_id:
             for sensor_tipo in sensorTipo_ids:
                 if dispositivo and sensor_tipo:
-                    cursor.execute(
-                        """
-                        SELECT sensores.id_sensor
-                        FROM sensores
-                        JOIN sensores_en_dispositivo ON sensores.id_sensor = sensores_en_dispositivo.id_sensor
-                        WHERE sensores_en_dispositivo.id_dispositivo = %s AND sensores.id_sensor_tipo = %s
-                        """,
-                        (dispositivo, sensor_tipo)
-                    )
-                    result = cursor.fetchone()
-                    if result:
-                        sensor_ids.append(str(result[0]))
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
-    
-    # Si timestamps tiene un solo valor
-    # se entrega un UNIXTIME  
-    if len(timestamps) == 1 and timestamps[0]:  # Un solo valor
-        timestamps = [timestamps[0]] * len(sensor_ids)
-
-    # Si timestamps NO tiene valor
-    elif not timestamps[0]:  
-        current_timestamp = datetime.now().timestamp()
-        timestamps = [str(current_timestamp)] * len(sensor_ids)
-
-    # Si sesiones_ids tiene un solo valor
-    if len(sesiones_ids) == 1 and sesiones_ids[0]:  # Un solo valor
-        sesiones_ids = [sesiones_ids[0]] * len(sensor_ids)
-
-    # Si sesiones_ids NO tiene valor
-    elif not sesiones_ids[0]:  
-        sesiones_ids = [None] * len(sensor_ids)
-
-
-    if not (len(timestamps) == len(sensor_ids) == len(variable_ids) == len(values) == len(sesiones_ids)):
-        return jsonify({'status': 'fail', 'error': 'Las longitudes de los parametros no coinciden'}), 400
-    
-    measurements = []
-
-    
-    # Fecha de inserción (servidor)  
-    server_timestamp = datetime.now().timestamp()
-    insertion_timestamps = [str(server_timestamp)] * len(sensor_ids)
-
-
-    for i in range(len(sensor_ids)):
-        timestamp_float = float(timestamps[i])
-        datetime_obj = datetime.fromtimestamp(timestamp_float)
-        formatted_datetime = datetime_obj.strftime('%Y-%m-%d %H:%M:%S')
-
-        # fechas insercion
-        insertion_timestamp_float = float(insertion_timestamps[i])
-        insertion_datetime_obj = datetime.fromtimestamp(insertion_timestamp_float)
-        formatted_insertion_datetime = insertion_datetime_obj.strftime('%Y-%m-%d %H:%M:%S')
-
-        # Convertir valores vacíos a None para insertarlos como NULL en la base de datos
-        valor = values[i] if values[i] and values[i].strip() else None
-
-        measurements.append({
-            "timestamp":formatted_datetime, #timestamps[i],
-            "sesionId": sesiones_ids[i],
-            "sensorId": sensor_ids[i],
-            "variableId": variable_ids[i],
-            "value": valor,
-            "insertionTimestamp": formatted_insertion_datetime
-
-        })
+                    id_sensor = topologia.sensor(dispositivo, sensor_tipo)
+                    if id_sensor:
+                        sensor_ids.append(id_sensor)
+                        dispositivo_de_sensor[id_sensor] = dispositivo.strip()
+    except mysql.connector.Error as e:
+        mensaje_error = f"Error al conectarse a la base de datos {e}"
+        print(mensaje_error)
+        return jsonify({'status': 'fail', 'error': mensaje_error}), 500
 
     try:
-        conn = mysql.connector.connect(**config)
-        cursor = conn.cursor()
+        filas = preparar_filas(timestamps, sesiones_ids, sensor_ids, variable_ids, values)
+    except ValueError as e:
+        return jsonify({'status': 'fail', 'error': str(e)}), 400
 
-        for measurement in measurements:
-            valores = [measurement['sensorId'], measurement['value'], measurement['timestamp'], measurement['variableId'], measurement['sesionId'], measurement['insertionTimestamp']]
-            sql_query = f"INSERT INTO datos (id_sensor, valor, fecha, id_variable, id_sesion, fecha_insercion) VALUES (%s, %s, %s, %s, %s, %s)"
-            log_query = sql_query % tuple(valores)  # Para fines de depuración
-            print("Consulta SQL para depuración:", log_query)
-            cursor.execute(sql_query, valores)
-
-        conn.commit()
-
-        # Listar Datos Estructurados
-        arguments = {
-            "tabla": "datos",
-            "disp.id_proyecto": proyecto_id[0],
-            "disp.codigo_interno": codigo_interno,
-            "limite": 1,
-            "offset": 0
-        }
+    # respuesta=eco (predeterminado): fila estructurada armada con lo recién recibido, sin leer la base de datos.
+    # respuesta=estructurada: se relee con listar_datos_estructurados_v2 (join + pivot), como antes.
+    respuesta = request.args.get('respuesta', 'eco')
 
-        from listarDatosEstructuradosV2 import listar_datos_estructurados_v2
-        res = listar_datos_estructurados_v2(arguments)
-        print("Respuesta de listar_datos_estructurados_v2:", res, arguments)
+    try:
+        modo = registrar_filas(filas)
+        if modo == 'encolado':
+            # Aún no está en la base de datos: solo se puede devolver el eco
+            data = _respuesta_eco(filas, dispositivo_de_sensor) if respuesta == 'eco' else None
+            return jsonify({'status': 'success', 'message': 'Registro encolado para inserción', "data": data}), 202, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+        if respuesta == 'estructurada':
+            if not proyecto_id:
+                info = topologia.info_dispositivo(dispositivo_id[0]) or {}
+                proyecto_id = [info.get("id_proyecto")]
+                codigo_interno = info.get("codigo_interno")
+
+            # Listar Datos Estructurados
+            arguments = {
+                "tabla": "datos",
+                "disp.id_proyecto": proyecto_id[0],
+                "disp.codigo_interno": codigo_interno,
+                "limite": 1,
+                "offset": 0
+            }
+
+            from listarDatosEstructuradosV2 import listar_datos_estructurados_v2
+            res = listar_datos_estructurados_v2(arguments)
+            print("Respuesta de listar_datos_estructurados_v2:", res, arguments)
+        else:
+            res = _respuesta_eco(filas, dispositivo_de_sensor)
 
         data_websocket = res
         
@@ -355,6 +343,9 @@ def insertar_medicion_v2():
         # return jsonify({'status': 'success', 'message': 'Registro insertado correctamente'}), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
         return jsonify({'status': 'success', 'message': 'Registro insertado correctamente', "data": res}), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
 
+    except ColaLlenaError as e:
+        return jsonify({'status': 'fail', 'error': str(e)}), 429, {'Retry-After': '1'}
+
     except mysql.connector.Error as e:
         mensaje_error = f"Error al conectarse a la base de datos {e}"
         print(mensaje_error)
@@ -365,11 +356,6 @@ def insertar_medicion_v2():
         print(mensaje_error)
         return jsonify({'status': 'fail', 'error': mensaje_error}), 500
 
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-
     # return jsonify({
     #     'status': 'success',
     #     'message': measurements
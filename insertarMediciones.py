@@ -0,0 +1,183 @@
+from flask import Blueprint, request, jsonify
+import mysql.connector
+from datetime import datetime
+import json
+import os
+
+from mediciones import fila_desde_item
+from ingesta import registrar_filas, ColaLlenaError
+from idempotencia import idempotente
+
+
+insertar_mediciones_bp = Blueprint('insertar_mediciones', __name__)
+
+# Máximo de mediciones aceptadas en una sola petición
+INGESTA_MAX_ITEMS = int(os.getenv("INGESTA_MAX_ITEMS", 50000))
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/x-jsonlines')
+
+
+def _leer_items():
+    """
+    Lee las mediciones del cuerpo de la petición.
+
+    Acepta JSON (una lista o un objeto {"mediciones": [...]}) o NDJSON
+    (una medición por línea). Lanza ValueError si el cuerpo no es válido.
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        items = []
+        for numero, linea in enumerate(request.get_data(as_text=True).splitlines(), 1):
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                items.append(json.loads(linea))
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Línea {numero} no es JSON válido: {e}")
+        return items
+
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('mediciones')
+    if not isinstance(payload, list):
+        raise ValueError("Se requiere una lista de mediciones (JSON) o NDJSON en el cuerpo")
+    return payload
+
+
+@insertar_mediciones_bp.route('/insertarMediciones', methods=['POST'])
+@idempotente
+def insertar_mediciones():
+    """
+    Inserta en bloque mediciones de muchos sensores, dispositivos y fechas en una sola petición.
+    ---
+    tags:
+      - Datos
+    consumes:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: >
+          Lista de mediciones, u objeto {"mediciones": [...]}. Con Content-Type
+          application/x-ndjson se envía una medición por línea.
+          Cada medición lleva idSensor, idVariable, valor y opcionalmente
+          time (UNIXTIME) o fecha ("YYYY-MM-DD HH:MM:SS") e idSesion.
+        schema:
+          type: object
+          properties:
+            mediciones:
+              type: array
+              items:
+                type: object
+                example: { "idSensor": 173, "idVariable": 10, "valor": 21.5, "time": 1733139141 }
+      - name: Idempotency-Key
+        in: header
+        type: string
+        required: false
+        description: Clave de idempotencia. Un reintento con la misma clave devuelve la respuesta original sin volver a insertar.
+    responses:
+      201:
+        description: Todas las mediciones fueron insertadas.
+        schema:
+          type: object
+          properties:
+            status:
+              type: string
+              example: success
+            insertadas:
+              type: integer
+              example: 2
+            rechazadas:
+              type: integer
+              example: 0
+            resultados:
+              type: array
+              items:
+                type: object
+                example: { "indice": 0, "status": "success" }
+      202:
+        description: Mediciones válidas aceptadas en el spool o la cola de escritura (SPOOL_HABILITADO=1 o INGESTA_ASINCRONA=1).
+      207:
+        description: >
+          Se insertaron las mediciones válidas; algunas fueron rechazadas (ver resultados), por
+          validación o por la base de datos (p. ej. un idSensor inexistente).
+      400:
+        description: Cuerpo inválido o ninguna medición válida.
+      409:
+        description: Hay una petición en curso con la misma clave de idempotencia.
+      413:
+        description: Se superó el máximo de mediciones por petición.
+      429:
+        description: La cola de escritura está llena; reintentar más tarde.
+      500:
+        description: Error de conexión o bloqueo en la base de datos; ninguna medición fue insertada.
+    """
+    try:
+        items = _leer_items()
+    except ValueError as e:
+        return jsonify({'status': 'fail', 'error': str(e)}), 400
+
+    if len(items) > INGESTA_MAX_ITEMS:
+        return jsonify({'status': 'fail', 'error': f'Se permiten a lo más {INGESTA_MAX_ITEMS} mediciones por petición'}), 413
+
+    # Validación en una sola pasada
+    fecha_insercion = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    filas = []
+    resultados = []
+    indices = {}  # id(fila) -> posición en resultados, para las filas que rechace la base
+    for indice, item in enumerate(items):
+        try:
+            fila = fila_desde_item(item, fecha_insercion)
+            filas.append(fila)
+            indices[id(fila)] = len(resultados)
+            resultados.append({'indice': indice, 'status': 'success'})
+        except ValueError as e:
+            resultados.append({'indice': indice, 'status': 'fail', 'error': str(e)})
+
+    rechazadas = len(items) - len(filas)
+    if not filas:
+        return jsonify({'status': 'fail', 'error': 'Ninguna medición válida', 'insertadas': 0,
+                        'rechazadas': rechazadas, 'resultados': resultados}), 400
+
+    rechazadas_base = []
+    try:
+        # Todas las mediciones válidas en una sola transacción (o un solo encolado);
+        # las que la base rechace por sus datos se separan y el resto se inserta
+        modo = registrar_filas(filas, rechazadas_base)
+
+    except ColaLlenaError as e:
+        return jsonify({'status': 'fail', 'error': str(e), 'insertadas': 0,
+                        'rechazadas': len(items)}), 429, {'Retry-After': '1'}
+
+    except mysql.connector.Error as e:
+        mensaje_error = f"Error al conectarse a la base de datos {e}"
+        print(mensaje_error)
+        for resultado in resultados:
+            if resultado['status'] == 'success':
+                resultado.update({'status': 'fail', 'error': mensaje_error})
+        return jsonify({'status': 'fail', 'error': mensaje_error, 'insertadas': 0,
+                        'rechazadas': len(items), 'resultados': resultados}), 500
+
+    if modo == 'encolado':
+        return jsonify({
+            'status': 'success',
+            'encoladas': len(filas),
+            'rechazadas': rechazadas,
+            'resultados': resultados
+        }), 202
+
+    for fila, error in rechazadas_base:
+        resultados[indices[id(fila)]].update({'status': 'fail', 'error': f"Rechazada por la base de datos: {error}"})
+    rechazadas += len(rechazadas_base)
+    if len(rechazadas_base) == len(filas):
+        return jsonify({'status': 'fail', 'error': 'Ninguna medición válida', 'insertadas': 0,
+                        'rechazadas': rechazadas, 'resultados': resultados}), 400
+
+    return jsonify({
+        'status': 'success',
+        'insertadas': len(filas) - len(rechazadas_base),
+        'rechazadas': rechazadas,
+        'resultados': resultados
+    }), 201 if rechazadas == 0 else 207
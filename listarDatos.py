@@ -1,13 +1,14 @@
 import mysql.connector
-import decimal
-from datetime import datetime, date
+
+from db import get_connection
+from serializacion import valor_json
 
 def listar_datos(params: dict, db_config: dict, ALLOWED_TABLES, generar_csv=None):
     """
     Función pura para obtener datos de la tabla solicitada.
 
     params: dict con los filtros y opciones (tabla, limite, offset, formato, orden, primarykey, y filtros)
-    db_config: dict para mysql.connector.connect(**db_config)
+    db_config: se mantiene por compatibilidad; la conexión se toma del pool compartido (db.py)
     ALLOWED_TABLES: lista o set con tablas permitidas
     generar_csv: función opcional que recibe la lista de dicts y devuelve texto CSV
 
@@ -67,7 +68,7 @@ def listar_datos(params: dict, db_config: dict, ALLOWED_TABLES, generar_csv=None
     conn = None
     cursor = None
     try:
-        conn = mysql.connector.connect(**db_config)
+        conn = get_connection()
         cursor = conn.cursor()
 
         sql_query = f"SELECT * FROM {tabla} {where_clause}"
@@ -78,16 +79,9 @@ def listar_datos(params: dict, db_config: dict, ALLOWED_TABLES, generar_csv=None
         cursor.execute(sql_query, sql_params)
         filas = cursor.fetchall()
 
-        respuesta = []
+        # Decimal y fechas los serializa el proveedor JSON de la app (serializacion.ProveedorJSON)
         colnames = cursor.column_names
-        for fila in filas:
-            datos_dict = {key: value for key, value in zip(colnames, fila)}
-            for key, value in list(datos_dict.items()):
-                if isinstance(value, decimal.Decimal):
-                    datos_dict[key] = float(value)
-                elif isinstance(value, (datetime, date)):
-                    datos_dict[key] = value.isoformat()
-            respuesta.append(datos_dict)
+        respuesta = [dict(zip(colnames, fila)) for fila in filas]
 
         total_count = len(respuesta)
 
@@ -95,7 +89,7 @@ def listar_datos(params: dict, db_config: dict, ALLOWED_TABLES, generar_csv=None
             return {'status': 'success', 'data': {'tableData': respuesta, 'tabla': tabla, 'totalCount': total_count}}
         elif formato == 'csv':
             if callable(generar_csv):
-                csv_text = generar_csv(respuesta)
+                csv_text = generar_csv([{k: valor_json(v) for k, v in fila.items()} for fila in respuesta])
                 return {'status': 'success', 'csv': csv_text, 'tabla': tabla, 'totalCount': total_count}
             else:
                 return {'status': 'fail', 'error': "Formato 'csv' solicitado pero no se dio 'generar_csv'"}
@@ -17,17 +17,12 @@ from openpyxl.styles import PatternFill
 from insertarMedicionV2 import insertar_medicion_bp as insertar_medicion_v2_bp
 from flask_socketio import SocketIO, emit
 from app import f_numero_variables_por_proyecto, f_numero_mediciones_por_dispositivo, build_csv, build_excel
+from db import get_connection
+from desnormalizacion import condicion_filtro
+from pivot import pivotar
 
 load_dotenv()
 
-config = {
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD"),
-    "host": os.getenv("DB_HOST"),
-    "database": os.getenv("DB_NAME"),
-    "port": int(os.getenv("DB_PORT", 3306)),  # Valor por defecto: 3306
-}
-
 def listar_datos_estructurados_v2(args):
 
     tabla = "datos"  # args.get('tabla')  # Nombre de la tabla como parámetro
@@ -64,26 +59,22 @@ def listar_datos_estructurados_v2(args):
 
     # Mejor manejo de argumentos: acepta listas y valores únicos
     for key, value in filtered_args.items():
-        if isinstance(value, list):
-            or_conditions = " OR ".join([f"{key}=%s" for _ in value])
-            where_clauses.append(f"({or_conditions})")
-            params.extend(value)
-        else:
-            where_clauses.append(f"({key}=%s)")
-            params.append(value)
+        condicion, params_filtro = condicion_filtro(key, value if isinstance(value, list) else [value])
+        where_clauses.append(condicion)
+        params.extend(params_filtro)
 
     where_clause = ' AND '.join(where_clauses)
     where_clause = f"WHERE {where_clause}" if where_clause else ""
 
     
     try:
-        conn = mysql.connector.connect(**config)
+        conn = get_connection()
         cursor = conn.cursor()
 
         # Adaptar el valor de limit y offset para la tabla estructurada
         id_proyecto = args.get("disp.id_proyecto")
         if id_proyecto is not None:
-            result_func = f_numero_variables_por_proyecto(id_proyecto)
+            result_func = f_numero_variables_por_proyecto(id_proyecto, conn=conn)
             if result_func is not None and isinstance(result_func, dict):
                 num_dispositivos = result_func.get("num_dispositivos", 0)
                 num_variables_proyecto = result_func.get("num_variables_proyecto", 0)
@@ -148,54 +139,26 @@ def listar_datos_estructurados_v2(args):
 
         filas = cursor.fetchall()
         # Manejo robusto de resultados y pivot
-        import pandas as pd
-        respuesta = []
         colnames = [desc[0] for desc in cursor.description]
-        for fila in filas:
-            datos_dict = {key: value for key, value in zip(colnames, fila)}
-            respuesta.append(datos_dict)
         try:
-            df = pd.DataFrame(respuesta)
-            if not df.empty:
-                df = df.fillna("")
-                df_pivoted = df.pivot_table(
-                    index=["fecha","fecha_insercion", "id_sesion", "sesion_descripcion", "fecha_inicio", "ubicacion", "id_proyecto", "codigo_interno", "dispositivo_descripcion"],
-                    columns="unidad_medida",
-                    values="valor",
-                    aggfunc=list
-                ).reset_index()
-            else:
-                df_pivoted = pd.DataFrame()
+            pivote = pivotar(
+                filas,
+                colnames,
+                indice=["fecha","fecha_insercion", "id_sesion", "sesion_descripcion", "fecha_inicio", "ubicacion", "id_proyecto", "codigo_interno", "dispositivo_descripcion"],
+                relleno=""
+            )
+            table_data = pivote.filas_listas()
+            columnas = pivote.columnas
+            total_count = len(pivote)
         except Exception as e:
+            # Sin pivot se entregan las filas tal como vienen de la base
             print(f"Error en pivot: {e}")
-            df_pivoted = pd.DataFrame()
-
-        # Fallback para total_count
-        try:
-            total_count = len(df_pivoted)
-        except Exception:
-            total_count = len(respuesta)
-
-        # Formato de respuesta
-        def clean_for_json(obj):
-            if obj is None:
-                return ""
-            if isinstance(obj, (pd.Timestamp, datetime, date, decimal.Decimal)):
-                return str(obj)
-            if isinstance(obj, dict):
-                return {k: clean_for_json(v) for k, v in obj.items()}
-            if isinstance(obj, list):
-                return [clean_for_json(v) for v in obj]
-            return str(obj)
-
-        def flatten_single_list_values(row):
-            for k, v in row.items():
-                if isinstance(v, list) and len(v) == 1:
-                    row[k] = v[0]
-            return row
-
-        table_data = df_pivoted.to_dict(orient="records") if not df_pivoted.empty else respuesta
-        table_data = [flatten_single_list_values(clean_for_json(row)) for row in table_data]
+            table_data = [
+                {k: "" if v is None else str(v) for k, v in zip(colnames, fila)}
+                for fila in filas
+            ]
+            columnas = colnames
+            total_count = 0
 
         res = {
             'status': 'success',
@@ -209,9 +172,9 @@ def listar_datos_estructurados_v2(args):
         if formato == 'json':
             return res
         elif formato == 'csv':
-            return build_csv(df_pivoted)
+            return build_csv(pd.DataFrame(table_data, columns=columnas))
         elif formato == 'xlsx':
-            return build_excel(df_pivoted)
+            return build_excel(pd.DataFrame(table_data, columns=columnas))
         else:
             return {'status': 'fail', 'error': f"Formato '{formato}' no soportado. Use 'json', 'csv' o 'xlsx'."}
 
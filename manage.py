@@ -0,0 +1,717 @@
+"""
+Tareas de mantenimiento de la base de datos.
+
+Uso:
+    python manage.py dedup              # informa mediciones duplicadas en `datos`
+    python manage.py dedup --aplicar    # las elimina y crea el índice único de deduplicación
+    python manage.py conteos            # crea y reconstruye conteo_mediciones_dia desde `datos`
+    python manage.py conteos --desde 2024-05-01   # reconstruye solo desde esa fecha
+    python manage.py resumenes          # crea y reconstruye resumen_hora y resumen_dia desde `datos`
+    python manage.py resumenes --desde 2024-05-01 # reconstruye solo desde esa fecha
+    python manage.py ultimas            # crea y reconstruye ultimas_mediciones desde `datos`
+    python manage.py desnormalizar      # agrega id_dispositivo/id_proyecto a `datos`, los rellena y crea sus índices
+    python manage.py desnormalizar --todo         # recalcula también las filas ya rellenadas
+    python manage.py indices            # revisa índices, planes (EXPLAIN) y tiempos de las consultas frecuentes
+    python manage.py indices --aplicar  # crea los índices que faltan y compara antes/después
+    python manage.py particionar        # muestra cómo quedaría `datos` particionada por mes
+    python manage.py particionar --aplicar        # la particiona (copia la tabla una vez)
+    python manage.py particiones        # crea los meses futuros y aplica DATOS_RETENCION_MESES (tarea programada)
+    python manage.py archivar --hasta 2024-01-01  # informa las mediciones anteriores a esa fecha
+    python manage.py archivar --hasta 2024-01-01 --aplicar  # las pasa a CSV gzip en CSVS_FOLDER y las elimina de `datos`
+"""
+from dotenv import load_dotenv
+
+import argparse
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from archivo import BORRAR_ARCHIVADOS_SQL, confirmar_archivos, exportar_dia, ids_archivados
+from conteos import CONTEO_TABLA_SQL, RECONTAR_SQL
+from db import get_connection
+from desnormalizacion import COLUMNAS_DESNORMALIZADAS, INDICES_DESNORMALIZADOS, RELLENAR_SQL
+from indices import CONSULTAS, crear_indice, explicar, medir, parametros_consulta, parametros_muestra, revisar_indices
+from particiones import (
+    DATOS_RETENCION_MESES, LLAVES_FORANEAS_SQL, PARTICIONES_FUTURAS, agregar_particiones_sql, archivar_sql,
+    mes_particion, mes_siguiente, meses_faltantes, nombre_particion, particionar_sql, particiones_actuales, particiones_vencidas, tabla_archivo
+)
+from resumenes import RECALCULAR_DIA_SQL, RECALCULAR_HORA_SQL, RESUMEN_TABLA_SQL, TABLAS_RESUMEN
+from ultimas import RECALCULAR_ULTIMAS_SQL, ULTIMAS_LLAVE_SQL, ULTIMAS_TABLA_SQL
+
+
+load_dotenv()
+
+DEDUP_INDICE = "ux_datos_sensor_variable_fecha"
+
+
+def _indice_existe(cursor, tabla, indice):
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """,
+        (tabla, indice)
+    )
+    return cursor.fetchone()[0] > 0
+
+
+def dedup(args):
+    """
+    Elimina las mediciones repetidas (mismo id_sensor, id_variable y fecha),
+    conservando la de menor id_dato, y crea el índice único que permite
+    insertar con ON DUPLICATE KEY UPDATE (DEDUP_DATOS=1).
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        if _indice_existe(cursor, "datos", DEDUP_INDICE):
+            print(f"El índice {DEDUP_INDICE} ya existe; no puede haber duplicados.")
+            return 0
+
+        cursor.execute(
+            """
+            SELECT id_sensor, COUNT(*), SUM(repetidas) FROM (
+                SELECT id_sensor, COUNT(*) - 1 AS repetidas
+                FROM datos
+                GROUP BY id_sensor, id_variable, fecha
+                HAVING COUNT(*) > 1
+            ) AS duplicados
+            GROUP BY id_sensor
+            ORDER BY id_sensor
+            """
+        )
+        sensores = cursor.fetchall()
+        total = sum(int(repetidas) for _, _, repetidas in sensores)
+        print(f"{total} mediciones duplicadas en {len(sensores)} sensores.")
+        for id_sensor, grupos, repetidas in sensores:
+            print(f"  sensor {id_sensor}: {grupos} mediciones repetidas, {repetidas} filas sobrantes")
+
+        if not args.aplicar:
+            print("Use --aplicar para eliminarlas y crear el índice único.")
+            return 0
+
+        # Un sensor por transacción para no bloquear toda la tabla
+        for id_sensor, _, repetidas in sensores:
+            inicio = time.monotonic()
+            cursor.execute(
+                """
+                DELETE d1 FROM datos AS d1
+                JOIN datos AS d2
+                    ON d1.id_sensor = d2.id_sensor
+                    AND d1.id_variable = d2.id_variable
+                    AND d1.fecha = d2.fecha
+                    AND d1.id_dato > d2.id_dato
+                WHERE d1.id_sensor = %s
+                """,
+                (id_sensor,)
+            )
+            conn.commit()
+            print(f"  sensor {id_sensor}: {cursor.rowcount} filas eliminadas ({time.monotonic() - inicio:.1f}s)")
+
+        print(f"Creando índice único {DEDUP_INDICE} (id_sensor, id_variable, fecha)...")
+        inicio = time.monotonic()
+        try:
+            cursor.execute(f"ALTER TABLE datos ADD UNIQUE INDEX {DEDUP_INDICE} (id_sensor, id_variable, fecha)")
+        except Exception as e:
+            # Pudieron llegar duplicados nuevos mientras se eliminaban los anteriores
+            print(f"No se pudo crear el índice: {e}\nVuelva a ejecutar el comando.")
+            return 1
+        print(f"Índice creado ({time.monotonic() - inicio:.1f}s). Ya se puede usar DEDUP_DATOS=1.")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _meses(desde, hasta):
+    """Primeros días de mes entre `desde` y `hasta` (inclusive), y el mes siguiente al último."""
+    mes = date(desde.year, desde.month, 1)
+    while mes <= hasta:
+        siguiente = date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+        yield mes, siguiente
+        mes = siguiente
+
+
+def _rango_datos(cursor, desde):
+    """
+    (desde, hasta) como fechas para reconstruir: desde `desde` (YYYY-MM-DD) o la
+    primera medición hasta la última. Lanza ValueError si `desde` no es válida;
+    retorna (None, None) si no hay mediciones.
+    """
+    if desde:
+        desde = datetime.strptime(desde, "%Y-%m-%d").date()
+        cursor.execute("SELECT MAX(fecha) FROM datos")
+        hasta = cursor.fetchone()[0]
+    else:
+        cursor.execute("SELECT MIN(fecha), MAX(fecha) FROM datos")
+        desde, hasta = cursor.fetchone()
+    if desde is None or hasta is None:
+        return None, None
+    desde = desde.date() if isinstance(desde, datetime) else desde
+    hasta = hasta.date() if isinstance(hasta, datetime) else hasta
+    return desde, hasta
+
+
+def conteos(args):
+    """
+    Crea conteo_mediciones_dia y la reconstruye desde `datos`, un mes por
+    transacción. Se puede ejecutar con la ingesta activa (CONTEO_DIARIO=1):
+    cada mes se recalcula y reemplaza de una vez.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CONTEO_TABLA_SQL)
+
+        try:
+            desde, hasta = _rango_datos(cursor, args.desde)
+        except ValueError:
+            print(f"Fecha inválida: {args.desde} (use YYYY-MM-DD)")
+            return 1
+        if desde is None:
+            print("No hay mediciones en `datos`.")
+            return 0
+
+        total = 0
+        for inicio_mes, fin_mes in _meses(desde, hasta):
+            inicio = max(inicio_mes, desde)
+            reloj = time.monotonic()
+            cursor.execute("DELETE FROM conteo_mediciones_dia WHERE dia >= %s AND dia < %s", (inicio, fin_mes))
+            cursor.execute(
+                RECONTAR_SQL.format(where_clause="d.fecha >= %s AND d.fecha < %s"),
+                (inicio, fin_mes)
+            )
+            conn.commit()
+            cursor.execute(
+                "SELECT COALESCE(SUM(mediciones), 0) FROM conteo_mediciones_dia WHERE dia >= %s AND dia < %s",
+                (inicio, fin_mes)
+            )
+            mediciones = int(cursor.fetchone()[0])
+            total += mediciones
+            print(f"  {inicio_mes:%Y-%m}: {mediciones} mediciones ({time.monotonic() - reloj:.1f}s)")
+
+        print(f"{total} mediciones contadas desde {desde}. Ya se puede usar CONTEO_DIARIO=1.")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def resumenes(args):
+    """
+    Crea resumen_hora y resumen_dia y los reconstruye desde `datos`, un día por
+    transacción (resumen_dia se arma desde las horas recién calculadas). Se
+    puede ejecutar con la ingesta activa (RESUMENES=1): cada día se recalcula y
+    reemplaza de una vez.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        for tabla, (tipo, _) in TABLAS_RESUMEN.items():
+            cursor.execute(RESUMEN_TABLA_SQL.format(tabla=tabla, tipo=tipo))
+
+        try:
+            desde, hasta = _rango_datos(cursor, args.desde)
+        except ValueError:
+            print(f"Fecha inválida: {args.desde} (use YYYY-MM-DD)")
+            return 1
+        if desde is None:
+            print("No hay mediciones en `datos`.")
+            return 0
+
+        total = 0
+        for inicio_mes, fin_mes in _meses(desde, hasta):
+            reloj = time.monotonic()
+            dia = max(inicio_mes, desde)
+            while dia < fin_mes and dia <= hasta:
+                siguiente = dia + timedelta(days=1)
+                cursor.execute("DELETE FROM resumen_hora WHERE periodo >= %s AND periodo < %s", (dia, siguiente))
+                cursor.execute(RECALCULAR_HORA_SQL.format(where_clause="d.fecha >= %s AND d.fecha < %s"), (dia, siguiente))
+                cursor.execute("DELETE FROM resumen_dia WHERE periodo = %s", (dia,))
+                cursor.execute(
+                    RECALCULAR_DIA_SQL.format(where_clause="r.periodo >= %s AND r.periodo < %s"),
+                    (dia, siguiente)
+                )
+                conn.commit()
+                dia = siguiente
+            cursor.execute(
+                "SELECT COALESCE(SUM(mediciones), 0) FROM resumen_dia WHERE periodo >= %s AND periodo < %s",
+                (max(inicio_mes, desde), fin_mes)
+            )
+            mediciones = int(cursor.fetchone()[0])
+            total += mediciones
+            print(f"  {inicio_mes:%Y-%m}: {mediciones} mediciones ({time.monotonic() - reloj:.1f}s)")
+
+        print(f"{total} mediciones resumidas desde {desde}. Ya se puede usar RESUMENES=1.")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def ultimas(args):
+    """
+    Crea ultimas_mediciones (con los tipos de columna de `datos`) y la
+    reconstruye desde `datos`, un sensor por transacción. Se puede ejecutar
+    con la ingesta activa (ULTIMAS_MEDICIONES=1).
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = 'ultimas_mediciones'"
+        )
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(ULTIMAS_TABLA_SQL)
+            cursor.execute(ULTIMAS_LLAVE_SQL)
+            print("Tabla ultimas_mediciones creada.")
+
+        cursor.execute("SELECT id_sensor FROM sensores ORDER BY id_sensor")
+        sensores = [fila[0] for fila in cursor.fetchall()]
+        inicio = time.monotonic()
+        total = 0
+        for id_sensor in sensores:
+            cursor.execute("DELETE FROM ultimas_mediciones WHERE id_sensor = %s", (id_sensor,))
+            cursor.execute(RECALCULAR_ULTIMAS_SQL, (id_sensor, id_sensor))
+            total += max(cursor.rowcount, 0)
+            conn.commit()
+
+        print(f"{total} mediciones de {len(sensores)} sensores ({time.monotonic() - inicio:.1f}s). "
+              "Ya se puede usar ULTIMAS_MEDICIONES=1.")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def desnormalizar(args):
+    """
+    Agrega a `datos` las columnas id_dispositivo e id_proyecto, las rellena
+    desde la topología actual en tramos de id_dato (uno por transacción) y crea
+    los índices (id_proyecto, fecha) e (id_dispositivo, fecha).
+
+    Se puede ejecutar con la ingesta activa: las filas que se inserten antes de
+    activar DATOS_DESNORMALIZADOS=1 quedan en NULL y se rellenan volviendo a
+    ejecutarlo después de activarlo.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        for columna, tipo in COLUMNAS_DESNORMALIZADAS.items():
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.columns "
+                "WHERE table_schema = DATABASE() AND table_name = 'datos' AND column_name = %s",
+                (columna,)
+            )
+            if cursor.fetchone()[0] == 0:
+                print(f"Agregando columna datos.{columna}...")
+                inicio = time.monotonic()
+                cursor.execute(f"ALTER TABLE datos ADD COLUMN {columna} {tipo}")
+                print(f"Columna agregada ({time.monotonic() - inicio:.1f}s).")
+
+        cursor.execute("SELECT MIN(id_dato), MAX(id_dato) FROM datos")
+        primero, ultimo = cursor.fetchone()
+        total = 0
+        if primero is not None:
+            condicion = "" if args.todo else "AND d.id_dispositivo IS NULL"
+            inicio = time.monotonic()
+            for desde in range(int(primero), int(ultimo) + 1, args.lote):
+                cursor.execute(RELLENAR_SQL.format(condicion=condicion), (desde, desde + args.lote))
+                total += max(cursor.rowcount, 0)
+                conn.commit()
+                print(f"  id_dato {desde}-{min(desde + args.lote, int(ultimo) + 1) - 1}: {total} filas ({time.monotonic() - inicio:.1f}s)")
+        print(f"{total} mediciones rellenadas.")
+
+        for indice, columnas in INDICES_DESNORMALIZADOS.items():
+            if _indice_existe(cursor, "datos", indice):
+                continue
+            print(f"Creando índice {indice} {columnas}...")
+            inicio = time.monotonic()
+            cursor.execute(f"ALTER TABLE datos ADD INDEX {indice} {columnas}")
+            print(f"Índice creado ({time.monotonic() - inicio:.1f}s).")
+
+        print("Ya se puede usar DATOS_DESNORMALIZADOS=1.")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _medir_consultas(cursor, muestra, repeticiones):
+    """{consulta: segundos} de CONSULTAS, mostrando el plan de cada una."""
+    tiempos = {}
+    for nombre, (origen, _, _) in CONSULTAS.items():
+        sql, params = parametros_consulta(nombre, muestra)
+        print(f"  {nombre} ({origen})")
+        for paso in explicar(cursor, sql, params):
+            aviso = "  <- recorre la tabla completa" if paso.get("type") == "ALL" else ""
+            particiones_leidas = f"partitions={paso['partitions']} " if paso.get("partitions") else ""
+            print(f"      {paso.get('table')}: {particiones_leidas}type={paso.get('type')} key={paso.get('key')} "
+                  f"rows={paso.get('rows')} {paso.get('Extra') or ''}{aviso}")
+        tiempos[nombre] = medir(cursor, sql, params, repeticiones)
+        print(f"      {tiempos[nombre] * 1000:.1f} ms")
+    return tiempos
+
+
+def indices(args):
+    """
+    Revisa en information_schema los índices que usan las consultas frecuentes
+    de la API (listados por dispositivo/proyecto, conteos, alertas), muestra el
+    EXPLAIN y el tiempo de cada consulta con parámetros tomados de la última
+    medición y, con --aplicar, crea los que faltan y repite la medición.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        estado = revisar_indices(cursor)
+        print("Índices:")
+        for nombre, tabla, columnas, motivo, actual in estado:
+            detalle = {"falta": "FALTA", "sin columnas": "no aplica (faltan columnas)"}.get(actual, f"cubierto por {actual}")
+            print(f"  {tabla} ({', '.join(columnas)}) [{nombre}]: {detalle} - {motivo}")
+        faltan = [nombre for nombre, _, _, _, actual in estado if actual == "falta"]
+
+        muestra = parametros_muestra(cursor, args.codigo, args.dias)
+        if muestra is None:
+            print("No hay mediciones de dispositivos para medir las consultas.")
+            antes = None
+        else:
+            print(f"\nConsultas (dispositivo {muestra['codigo_interno']}, {muestra['desde']} a {muestra['hasta']}):")
+            antes = _medir_consultas(cursor, muestra, args.repeticiones)
+
+        if not faltan:
+            print("\nNo faltan índices.")
+            return 0
+        if not args.aplicar:
+            print(f"\nFaltan {len(faltan)} índices. Use --aplicar para crearlos.")
+            return 0
+
+        for nombre in faltan:
+            print(f"Creando índice {nombre}...")
+            inicio = time.monotonic()
+            crear_indice(cursor, nombre)
+            print(f"Índice creado ({time.monotonic() - inicio:.1f}s).")
+
+        if antes is not None:
+            print("\nConsultas con los índices nuevos:")
+            despues = _medir_consultas(cursor, muestra, args.repeticiones)
+            print("\nAntes / después:")
+            for nombre in CONSULTAS:
+                print(f"  {nombre}: {antes[nombre] * 1000:.1f} ms -> {despues[nombre] * 1000:.1f} ms")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _mes_futuro(futuras):
+    """Primer día del mes que está `futuras` meses después del actual."""
+    mes = date.today().replace(day=1)
+    for _ in range(futuras):
+        mes = mes_siguiente(mes)
+    return mes
+
+
+def particionar(args):
+    """
+    Particiona `datos` por mes de fecha (RANGE COLUMNS), desde el mes de la
+    primera medición hasta PARTICIONES_FUTURAS meses después del actual. La
+    llave primaria pasa a (id_dato, fecha). MySQL copia la tabla completa y
+    bloquea las escrituras mientras tanto: ejecutarlo en una ventana de
+    mantenimiento (con SPOOL_HABILITADO=1 la ingesta espera en el spool).
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        if particiones_actuales(cursor):
+            print("`datos` ya está particionada. Use python manage.py particiones para mantenerla.")
+            return 0
+        cursor.execute(LLAVES_FORANEAS_SQL)
+        foraneas = [fila[0] for fila in cursor.fetchall()]
+        if foraneas:
+            print(f"`datos` tiene llaves foráneas ({', '.join(foraneas)}); MySQL no permite particionarla. Elimínelas antes.")
+            return 1
+
+        desde, _ = _rango_datos(cursor, None)
+        sql = particionar_sql(desde or date.today(), _mes_futuro(args.futuras))
+        print(sql)
+        if not args.aplicar:
+            print("Use --aplicar para particionar la tabla.")
+            return 0
+
+        print("Particionando `datos`...")
+        inicio = time.monotonic()
+        cursor.execute(sql)
+        print(f"Tabla particionada ({time.monotonic() - inicio:.1f}s). "
+              "Programe python manage.py particiones para crear los meses siguientes.")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def particiones(args):
+    """
+    Mantención programada de las particiones de `datos`: crea las de los
+    próximos meses separándolas de pmax y, con retención (--retencion o
+    DATOS_RETENCION_MESES), elimina los meses completos más antiguos con
+    DROP PARTITION, o con --archivar los mueve a tablas datos_archivo_AAAAMM.
+    Los conteos diarios de esos meses se eliminan; resumen_hora y resumen_dia
+    se conservan como historia.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        nombres = [fila[0] for fila in particiones_actuales(cursor)]
+        if not nombres:
+            print("`datos` no está particionada (python manage.py particionar).")
+            return 0
+
+        nuevos = meses_faltantes(nombres, _mes_futuro(args.futuras))
+        if nuevos:
+            inicio = time.monotonic()
+            cursor.execute(agregar_particiones_sql(nuevos))
+            print(f"Particiones creadas: {', '.join(f'{mes:%Y-%m}' for mes in nuevos)} ({time.monotonic() - inicio:.1f}s)")
+        else:
+            print("Las particiones de los próximos meses ya existen.")
+
+        vencidas = particiones_vencidas(nombres, date.today(), args.retencion)
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = 'conteo_mediciones_dia'"
+        )
+        con_conteos = cursor.fetchone()[0] > 0
+        for nombre in vencidas:
+            inicio = time.monotonic()
+            if args.archivar:
+                for sql in archivar_sql(nombre):
+                    cursor.execute(sql)
+                destino = f"archivada en {tabla_archivo(nombre)}"
+            else:
+                cursor.execute(f"ALTER TABLE datos DROP PARTITION {nombre}")
+                destino = "eliminada"
+            if con_conteos:
+                cursor.execute("DELETE FROM conteo_mediciones_dia WHERE dia < %s", (mes_siguiente(mes_particion(nombre)),))
+                conn.commit()
+            print(f"Partición {nombre} {destino} ({time.monotonic() - inicio:.1f}s)")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _limite_retencion(retencion_meses):
+    """Primer día del mes más antiguo que se conserva con `retencion_meses` meses, contando el actual."""
+    mes = date.today().replace(day=1)
+    for _ in range(retencion_meses - 1):
+        mes = (mes - timedelta(days=1)).replace(day=1)
+    return mes
+
+
+def _borrar_archivados(conn, cursor, desde, hasta, rutas, lote):
+    """
+    Elimina de `datos` las mediciones del rango que están en los archivos
+    `rutas` (por id_dato), de a `lote` filas por transacción.
+    """
+    ids = ids_archivados(rutas)
+    for i in range(0, len(ids), lote):
+        parte = ids[i:i + lote]
+        cursor.execute(BORRAR_ARCHIVADOS_SQL.format(ids=",".join(["%s"] * len(parte))), [desde, hasta] + parte)
+        conn.commit()
+
+
+def _recontar_archivados(conn, cursor, desde, hasta):
+    """Conteos diarios del rango desde lo que quedó en `datos` (mediciones no archivadas)."""
+    cursor.execute("DELETE FROM conteo_mediciones_dia WHERE dia >= %s AND dia < %s", (desde, hasta))
+    cursor.execute(RECONTAR_SQL.format(where_clause="d.fecha >= %s AND d.fecha < %s"), (desde, hasta))
+    conn.commit()
+
+
+def _particion_archivada(conn, cursor, nombre, dias):
+    """
+    Elimina la partición `nombre` con DROP PARTITION si tiene exactamente las
+    mediciones de los archivos de `dias` [(dia, siguiente, rutas), ...]
+    (mismo número de filas y misma suma de id_dato). La comparación y el DROP
+    se hacen con `datos` bloqueada (LOCK TABLES): no pueden llegar mediciones
+    entre una y otro. Retorna False si la partición tiene otras mediciones.
+    """
+    archivadas = 0
+    suma = 0
+    for _, _, rutas in dias:
+        ids = ids_archivados(rutas)
+        archivadas += len(ids)
+        suma += sum(ids)
+    conn.commit()
+    cursor.execute("LOCK TABLES datos WRITE")
+    try:
+        cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(id_dato), 0) FROM datos PARTITION ({nombre})")
+        en_particion, suma_particion = cursor.fetchone()
+        if (int(en_particion), int(suma_particion)) != (archivadas, suma):
+            return False
+        cursor.execute(f"ALTER TABLE datos DROP PARTITION {nombre}")
+        return True
+    finally:
+        cursor.execute("UNLOCK TABLES")
+
+
+def archivar(args):
+    """
+    Pasa las mediciones anteriores a --hasta (o a los últimos
+    DATOS_RETENCION_MESES meses) a CSV gzip en CSVS_FOLDER, un día por vez:
+    escribe los archivos de cada dispositivo, los vuelve a leer para verificar
+    el número de filas y recién entonces elimina el día de `datos` (en lotes)
+    y sus conteos diarios. Si `datos` está particionada y se archiva un mes
+    completo, el mes se elimina con DROP PARTITION.
+
+    Solo se archivan las mediciones que existían al empezar (id_dato hasta el
+    máximo de ese momento): las que lleguen durante el proceso se quedan. Se
+    eliminan solo las mediciones escritas en los archivos (por id_dato).
+    """
+    carpeta = os.environ.get('CSVS_FOLDER')
+    if not carpeta:
+        print("Defina CSVS_FOLDER con la carpeta de los archivos en frío.")
+        return 1
+    try:
+        if args.hasta:
+            hasta = datetime.strptime(args.hasta, "%Y-%m-%d").date()
+        elif DATOS_RETENCION_MESES > 0:
+            hasta = _limite_retencion(DATOS_RETENCION_MESES)
+        else:
+            print("Indique --hasta o defina DATOS_RETENCION_MESES.")
+            return 1
+    except ValueError:
+        print(f"Fecha inválida: {args.hasta} (use YYYY-MM-DD)")
+        return 1
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        try:
+            desde, ultimo = _rango_datos(cursor, args.desde)
+        except ValueError:
+            print(f"Fecha inválida: {args.desde} (use YYYY-MM-DD)")
+            return 1
+        if desde is None or desde >= hasta:
+            print(f"No hay mediciones anteriores a {hasta}.")
+            return 0
+        ultimo = min(ultimo, hasta - timedelta(days=1))
+        cursor.execute("SELECT MAX(id_dato) FROM datos")
+        hasta_id = cursor.fetchone()[0]
+
+        if not args.aplicar:
+            for inicio_mes, fin_mes in _meses(desde, ultimo):
+                cursor.execute(
+                    "SELECT COUNT(*) FROM datos WHERE fecha >= %s AND fecha < %s",
+                    (max(inicio_mes, desde), min(fin_mes, hasta))
+                )
+                print(f"  {inicio_mes:%Y-%m}: {cursor.fetchone()[0]} mediciones")
+            print(f"Use --aplicar para archivarlas en {carpeta} y eliminarlas de `datos`.")
+            return 0
+
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = 'conteo_mediciones_dia'"
+        )
+        con_conteos = cursor.fetchone()[0] > 0
+        particionada = {fila[0] for fila in particiones_actuales(cursor)}
+
+        total = 0
+        for inicio_mes, fin_mes in _meses(desde, ultimo):
+            reloj = time.monotonic()
+            nombre = nombre_particion(inicio_mes)
+            # Mes completo dentro del rango: se elimina de una vez si es una partición
+            mes_completo = nombre in particionada and (args.desde is None or inicio_mes >= desde) and fin_mes <= hasta
+            archivadas_mes = 0
+            dias_mes = []
+            dia = max(inicio_mes, desde)
+            while dia < fin_mes and dia <= ultimo:
+                siguiente = dia + timedelta(days=1)
+                escritores, esperadas = exportar_dia(cursor, carpeta, dia, siguiente, hasta_id)
+                try:
+                    archivadas_mes += confirmar_archivos(escritores, esperadas)
+                except ValueError as e:
+                    print(f"  {dia}: no se pudo verificar el archivo ({e}); no se eliminó nada de ese día.")
+                    return 1
+                rutas = [e.ruta for e in escritores]
+                if mes_completo:
+                    dias_mes.append((dia, siguiente, rutas))
+                else:
+                    _borrar_archivados(conn, cursor, dia, siguiente, rutas, args.lote)
+                    if con_conteos:
+                        _recontar_archivados(conn, cursor, dia, siguiente)
+                dia = siguiente
+
+            if mes_completo:
+                # Nada más en la partición: ni mediciones anteriores al mes ni llegadas durante el proceso
+                if not _particion_archivada(conn, cursor, nombre, dias_mes):
+                    print(f"  {inicio_mes:%Y-%m}: la partición {nombre} tiene otras mediciones; se elimina por día.")
+                    for dia, siguiente, rutas in dias_mes:
+                        _borrar_archivados(conn, cursor, dia, siguiente, rutas, args.lote)
+                if con_conteos:
+                    _recontar_archivados(conn, cursor, inicio_mes, fin_mes)
+            total += archivadas_mes
+            print(f"  {inicio_mes:%Y-%m}: {archivadas_mes} filas archivadas ({time.monotonic() - reloj:.1f}s)")
+
+        print(f"{total} filas archivadas en {carpeta}.")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tareas de mantenimiento de la API de sensores")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    p_dedup = subparsers.add_parser("dedup", help="Elimina mediciones duplicadas y crea el índice único de deduplicación")
+    p_dedup.add_argument("--aplicar", action="store_true", help="Elimina los duplicados y crea el índice (sin esto solo informa)")
+    p_dedup.set_defaults(func=dedup)
+
+    p_conteos = subparsers.add_parser("conteos", help="Crea y reconstruye los conteos de mediciones por dispositivo y día")
+    p_conteos.add_argument("--desde", help="Reconstruir solo desde esta fecha (YYYY-MM-DD); por defecto todo")
+    p_conteos.set_defaults(func=conteos)
+
+    p_resumenes = subparsers.add_parser("resumenes", help="Crea y reconstruye los resúmenes de mediciones por hora y día")
+    p_resumenes.add_argument("--desde", help="Reconstruir solo desde esta fecha (YYYY-MM-DD); por defecto todo")
+    p_resumenes.set_defaults(func=resumenes)
+
+    p_ultimas = subparsers.add_parser("ultimas", help="Crea y reconstruye la tabla de últimas mediciones por sensor y variable")
+    p_ultimas.set_defaults(func=ultimas)
+
+    p_desnormalizar = subparsers.add_parser("desnormalizar", help="Agrega y rellena id_dispositivo e id_proyecto en `datos` con sus índices")
+    p_desnormalizar.add_argument("--todo", action="store_true", help="Recalcula todas las filas, no solo las que están en NULL")
+    p_desnormalizar.add_argument("--lote", type=int, default=50000, help="Rango de id_dato por transacción (por defecto 50000)")
+    p_desnormalizar.set_defaults(func=desnormalizar)
+
+    p_particionar = subparsers.add_parser("particionar", help="Particiona `datos` por mes de fecha")
+    p_particionar.add_argument("--aplicar", action="store_true", help="Particiona la tabla (sin esto solo muestra el ALTER TABLE)")
+    p_particionar.add_argument("--futuras", type=int, default=PARTICIONES_FUTURAS, help=f"Meses futuros a crear (por defecto PARTICIONES_FUTURAS={PARTICIONES_FUTURAS})")
+    p_particionar.set_defaults(func=particionar)
+
+    p_particiones = subparsers.add_parser("particiones", help="Crea las particiones de los próximos meses y aplica la retención")
+    p_particiones.add_argument("--futuras", type=int, default=PARTICIONES_FUTURAS, help=f"Meses futuros que deben existir (por defecto PARTICIONES_FUTURAS={PARTICIONES_FUTURAS})")
+    p_particiones.add_argument("--retencion", type=int, default=DATOS_RETENCION_MESES, help=f"Meses que se conservan, contando el actual; 0 no elimina nada (por defecto DATOS_RETENCION_MESES={DATOS_RETENCION_MESES})")
+    p_particiones.add_argument("--archivar", action="store_true", help="Mueve los meses vencidos a tablas datos_archivo_AAAAMM en vez de eliminarlos")
+    p_particiones.set_defaults(func=particiones)
+
+    p_archivar = subparsers.add_parser("archivar", help="Pasa las mediciones antiguas a CSV gzip en CSVS_FOLDER y las elimina de `datos`")
+    p_archivar.add_argument("--hasta", help="Archivar las mediciones anteriores a esta fecha (YYYY-MM-DD); por defecto según DATOS_RETENCION_MESES")
+    p_archivar.add_argument("--desde", help="Archivar solo desde esta fecha (YYYY-MM-DD); por defecto desde la primera medición")
+    p_archivar.add_argument("--aplicar", action="store_true", help="Escribe los archivos y elimina las mediciones (sin esto solo informa)")
+    p_archivar.add_argument("--lote", type=int, default=10000, help="Filas por DELETE (por defecto 10000)")
+    p_archivar.set_defaults(func=archivar)
+
+    p_indices = subparsers.add_parser("indices", aliases=["indexes"], help="Revisa y crea los índices de las consultas frecuentes sobre `datos`")
+    p_indices.add_argument("--aplicar", action="store_true", help="Crea los índices que faltan (sin esto solo informa)")
+    p_indices.add_argument("--codigo", help="codigo_interno del dispositivo para las consultas de prueba; por defecto el de la última medición")
+    p_indices.add_argument("--dias", type=int, default=1, help="Días del rango de fechas de las consultas de prueba (por defecto 1)")
+    p_indices.add_argument("--repeticiones", type=int, default=3, help="Ejecuciones por consulta; se informa la más rápida (por defecto 3)")
+    p_indices.set_defaults(func=indices)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+from dotenv import load_dotenv
+
+from datetime import datetime
+import os
+
+from conteos import CONTEO_DIARIO, recontar_conteos, sumar_conteos
+from db import error_transitorio
+from desnormalizacion import DATOS_DESNORMALIZADOS, dispositivo_de_sensor, desnormalizar_filas
+from resumenes import RESUMENES, recalcular_resumenes_filas, sumar_resumenes
+from ultimas import ULTIMAS_MEDICIONES, actualizar_ultimas, recalcular_ultimas
+
+
+load_dotenv()
+
+# Máximo de filas por sentencia INSERT multi-fila
+DATOS_BATCH_SIZE = int(os.getenv("DATOS_BATCH_SIZE", 500))
+
+# Con el índice único ux_datos_sensor_variable_fecha (python manage.py dedup) una
+# medición repetida (mismo sensor, variable y fecha) no inserta una fila nueva
+DEDUP_DATOS = os.getenv("DEDUP_DATOS", "0") in ("1", "true", "True")
+
+INSERT_DATOS_SQL = (
+    "INSERT INTO datos (id_sensor, valor, fecha, id_variable, id_sesion, fecha_insercion) "
+    "VALUES (%s, %s, %s, %s, %s, %s)"
+)
+if DATOS_DESNORMALIZADOS:
+    INSERT_DATOS_SQL = (
+        "INSERT INTO datos (id_sensor, valor, fecha, id_variable, id_sesion, fecha_insercion, "
+        "id_dispositivo, id_proyecto) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+    )
+if DEDUP_DATOS:
+    INSERT_DATOS_SQL += " ON DUPLICATE KEY UPDATE id_dato = id_dato"
+
+# Tablas y columnas que se derivan de `datos` al insertar: un cambio hecho por
+# fuera de insertar_datos (/agregarDatos, /modificarDatos, /eliminarDatos)
+# debe pasar por actualizar_derivados
+DERIVADOS_DATOS = CONTEO_DIARIO or RESUMENES or ULTIMAS_MEDICIONES or DATOS_DESNORMALIZADOS
+
+# Filas de `datos` en el orden que usan las tablas derivadas, más su id_dato al final
+FILAS_AFECTADAS_SQL = "SELECT id_sensor, valor, fecha, id_variable, id_dato FROM datos WHERE {where_clause}"
+
+DESNORMALIZAR_FILA_SQL = "UPDATE datos SET id_dispositivo = %s, id_proyecto = %s WHERE id_dato = %s"
+
+
+def preparar_filas(timestamps, sesiones_ids, sensor_ids, variable_ids, values):
+    """
+    Construye las filas a insertar en `datos` a partir de los parámetros
+    separados por comas de /insertarMedicion y /insertarMedicionV2.
+
+    - Un único timestamp (UNIXTIME) se aplica a todas las mediciones; si no
+      se entrega se usa la hora actual del servidor.
+    - Una única sesión se aplica a todas las mediciones; si no se entrega se usa NULL.
+    - Los valores vacíos se insertan como NULL.
+
+    Retorna una lista de tuplas en el orden de INSERT_DATOS_SQL.
+    Lanza ValueError si las longitudes no coinciden o un timestamp no es válido.
+    """
+    n = len(sensor_ids)
+
+    # Si timestamps tiene un solo valor se entrega un UNIXTIME
+    if len(timestamps) == 1 and timestamps[0]:
+        timestamps = [timestamps[0]] * n
+    # Si timestamps NO tiene valor
+    elif not timestamps[0]:
+        timestamps = [str(datetime.now().timestamp())] * n
+
+    # Si sesiones_ids tiene un solo valor
+    if len(sesiones_ids) == 1 and sesiones_ids[0]:
+        sesiones_ids = [sesiones_ids[0]] * n
+    # Si sesiones_ids NO tiene valor
+    elif not sesiones_ids[0]:
+        sesiones_ids = [None] * n
+
+    if not (len(timestamps) == n == len(variable_ids) == len(values) == len(sesiones_ids)):
+        raise ValueError('Las longitudes de los parametros no coinciden')
+
+    # Fecha de inserción (servidor), una sola vez por petición
+    fecha_insercion = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    # Los dispositivos suelen repetir el mismo timestamp en todas las variables
+    fechas = {}
+    filas = []
+    for i in range(n):
+        ts = timestamps[i]
+        fecha = fechas.get(ts)
+        if fecha is None:
+            fecha = datetime.fromtimestamp(float(ts)).strftime('%Y-%m-%d %H:%M:%S')
+            fechas[ts] = fecha
+
+        # Convertir valores vacíos a None para insertarlos como NULL en la base de datos
+        valor = values[i] if values[i] and values[i].strip() else None
+
+        filas.append((sensor_ids[i], valor, fecha, variable_ids[i], sesiones_ids[i], fecha_insercion))
+    return filas
+
+
+def insertar_datos(cursor, filas, batch_size=None):
+    """
+    Inserta las filas en `datos` con INSERT multi-fila (executemany), en lotes
+    de a lo más `batch_size` filas (DATOS_BATCH_SIZE por defecto).
+
+    No hace commit: la transacción la controla quien llama. Con CONTEO_DIARIO=1
+    actualiza en la misma transacción los conteos por dispositivo y día, con
+    RESUMENES=1 los resúmenes por hora y día y con ULTIMAS_MEDICIONES=1 la
+    última medición de cada sensor y variable. Con DATOS_DESNORMALIZADOS=1
+    cada fila lleva además el dispositivo y el proyecto de su sensor.
+    Retorna el número de filas insertadas (con DEDUP_DATOS=1 no cuenta las
+    mediciones que ya existían).
+    """
+    batch_size = batch_size or DATOS_BATCH_SIZE
+    total = 0
+    for inicio in range(0, len(filas), batch_size):
+        lote = filas[inicio:inicio + batch_size]
+        cursor.executemany(INSERT_DATOS_SQL, desnormalizar_filas(lote, cursor) if DATOS_DESNORMALIZADOS else lote)
+        insertadas = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else len(lote)
+        sumar_conteos(cursor, lote, insertadas)
+        sumar_resumenes(cursor, lote, insertadas)
+        actualizar_ultimas(cursor, lote, reemplazar_iguales=not DEDUP_DATOS)
+        total += insertadas
+    return total
+
+
+def insertar_aislando(cursor, filas):
+    """
+    Como insertar_datos, para un lote que la base ya rechazó por sus datos
+    (IntegrityError, DataError, ProgrammingError...): inserta por mitades,
+    cada una bajo un SAVEPOINT, hasta aislar las filas que fallan solas.
+
+    No hace commit. Retorna (insertadas, rechazadas) con rechazadas una
+    lista de (fila, error). Los errores transitorios (conexión, bloqueos) se
+    propagan: quien llama deshace la transacción y reintenta el lote.
+    """
+    partes = [list(filas)]
+    insertadas = 0
+    rechazadas = []
+    while partes:
+        parte = partes.pop()
+        cursor.execute("SAVEPOINT insertar_datos")
+        try:
+            insertadas += insertar_datos(cursor, parte)
+        except Exception as e:
+            if error_transitorio(e):
+                raise
+            cursor.execute("ROLLBACK TO SAVEPOINT insertar_datos")
+            if len(parte) == 1:
+                rechazadas.append((parte[0], e))
+            else:
+                # Primero la mitad inicial: se conserva el orden de inserción
+                mitad = len(parte) // 2
+                partes.append(parte[mitad:])
+                partes.append(parte[:mitad])
+    return insertadas, rechazadas
+
+
+def filas_afectadas(cursor, where_clause, params, bloquear=False):
+    """
+    Filas (id_sensor, valor, fecha, id_variable, id_dato) de `datos` que
+    cumplen `where_clause`; con `bloquear`, con FOR UPDATE (se leen antes de
+    modificarlas en la misma transacción).
+    """
+    sql = FILAS_AFECTADAS_SQL.format(where_clause=where_clause)
+    cursor.execute(sql + " FOR UPDATE" if bloquear else sql, params)
+    return [fila for fila in cursor.fetchall() if fila[0] is not None and fila[3] is not None]
+
+
+def actualizar_derivados(cursor, antes, despues):
+    """
+    Mantiene las tablas derivadas de `datos` después de un INSERT, UPDATE o
+    DELETE hecho fuera de insertar_datos. `antes` y `despues` son las filas
+    afectadas (filas_afectadas) leídas antes y después del cambio. Los
+    conteos, resúmenes y últimas mediciones de esas filas se recalculan desde
+    `datos`, y las filas de `despues` reciben las columnas desnormalizadas.
+    No hace commit.
+    """
+    filas = list(antes) + list(despues)
+    recontar_conteos(cursor, filas)
+    recalcular_resumenes_filas(cursor, filas)
+    recalcular_ultimas(cursor, filas)
+    if DATOS_DESNORMALIZADOS and despues:
+        cursor.executemany(
+            DESNORMALIZAR_FILA_SQL,
+            [dispositivo_de_sensor(fila[0], cursor) + (fila[4],) for fila in despues]
+        )
+
+
+def _entero(valor, campo, requerido=True):
+    if valor is None or valor == '':
+        if requerido:
+            raise ValueError(f"Falta '{campo}'")
+        return None
+    if isinstance(valor, bool):
+        raise ValueError(f"'{campo}' inválido: {valor!r}")
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{campo}' inválido: {valor!r}")
+
+
+def fila_desde_item(item, fecha_insercion):
+    """
+    Valida una medición en formato JSON y la convierte en una fila de `datos`.
+
+    Campos aceptados:
+      - idSensor (obligatorio), idVariable (obligatorio), idSesion (opcional)
+      - valor: número, texto numérico, null o "" (NULL)
+      - time: UNIXTIME, o fecha: "YYYY-MM-DD HH:MM:SS"; si no viene se usa la hora del servidor
+
+    Lanza ValueError con el motivo si el item no es válido.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Cada medición debe ser un objeto JSON")
+
+    id_sensor = _entero(item.get('idSensor'), 'idSensor')
+    id_variable = _entero(item.get('idVariable'), 'idVariable')
+    id_sesion = _entero(item.get('idSesion'), 'idSesion', requerido=False)
+
+    valor = item.get('valor')
+    if isinstance(valor, str):
+        valor = valor.strip() or None
+    if valor is not None:
+        if isinstance(valor, bool):
+            raise ValueError(f"'valor' inválido: {valor!r}")
+        try:
+            float(valor)
+        except (TypeError, ValueError):
+            raise ValueError(f"'valor' inválido: {valor!r}")
+
+    if item.get('time') not in (None, ''):
+        try:
+            fecha = datetime.fromtimestamp(float(item['time'])).strftime('%Y-%m-%d %H:%M:%S')
+        except (TypeError, ValueError, OverflowError, OSError):
+            raise ValueError(f"'time' inválido: {item['time']!r}")
+    elif item.get('fecha') not in (None, ''):
+        try:
+            fecha = datetime.strptime(str(item['fecha']), '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            raise ValueError(f"'fecha' inválida: {item['fecha']!r} (use 'YYYY-MM-DD HH:MM:SS')")
+    else:
+        fecha = fecha_insercion
+
+    return (id_sensor, valor, fecha, id_variable, id_sesion, fecha_insercion)
@@ -0,0 +1,72 @@
+"""
+Paginación por cursor (keyset) para los listados de `datos`.
+
+En lugar de `LIMIT n OFFSET k`, que obliga a MySQL a recorrer y descartar
+las k filas anteriores, cada página continúa desde la última (fecha, id_dato)
+entregada: `WHERE fecha < f OR (fecha = f AND id_dato < id)`. Con el índice
+por fecha la página 100 cuesta lo mismo que la primera.
+
+El cursor que recibe el cliente es opaco: la clave codificada en base64.
+"""
+import base64
+import json
+from datetime import datetime
+
+
+class CursorInvalidoError(ValueError):
+    """El parámetro `cursor` no es un cursor entregado por la API."""
+
+
+def codificar_cursor(fecha, id_dato):
+    """Cursor opaco para continuar después de la fila (fecha, id_dato)."""
+    if isinstance(fecha, datetime):
+        fecha = fecha.isoformat()
+    texto = json.dumps([fecha, int(id_dato)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor):
+    """
+    (fecha, id_dato) de un cursor de `codificar_cursor`, o None si viene vacío
+    (primera página). Lanza CursorInvalidoError si no se puede leer.
+    """
+    if not cursor:
+        return None
+    try:
+        texto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        fecha, id_dato = json.loads(texto)
+        return datetime.fromisoformat(fecha), int(id_dato)
+    except (ValueError, TypeError) as e:
+        raise CursorInvalidoError(f"Cursor inválido: {cursor}") from e
+
+
+def condicion_cursor(despues_de, columna_fecha="fecha", columna_id="id_dato", descendente=True):
+    """
+    Condición SQL y parámetros para las filas que siguen a `despues_de` en el
+    orden (fecha, id_dato). Es `(fecha, id_dato) < (%s, %s)` escrita de forma
+    que MySQL pueda usar el rango sobre el índice de fecha.
+    """
+    fecha, id_dato = despues_de
+    op = "<" if descendente else ">"
+    condicion = f"({columna_fecha} {op} %s OR ({columna_fecha} = %s AND {columna_id} {op} %s))"
+    return condicion, [fecha, fecha, id_dato]
+
+
+def orden_cursor(columna_fecha="fecha", columna_id="id_dato", descendente=True):
+    """ORDER BY que corresponde a condicion_cursor."""
+    direccion = "DESC" if descendente else "ASC"
+    return f"ORDER BY {columna_fecha} {direccion}, {columna_id} {direccion}"
+
+
+def recortar_ultima_fecha(filas, i_fecha):
+    """
+    Quita de una página llena las filas de la última fecha, que pueden estar
+    incompletas (el resto de sus mediciones queda en la página siguiente), para
+    no partir una fila pivotada entre dos páginas. Si toda la página es de la
+    misma fecha se deja como está.
+    """
+    ultima = filas[-1][i_fecha]
+    fin = len(filas)
+    while fin > 0 and filas[fin - 1][i_fecha] == ultima:
+        fin -= 1
+    return filas[:fin] if fin > 0 else filas
@@ -0,0 +1,147 @@
+"""
+Particiones mensuales de `datos` por fecha (python manage.py particionar / particiones).
+
+Con `datos` particionada por RANGE COLUMNS(fecha), MySQL solo lee las
+particiones de los meses que tocan los filtros d.fecha >= %s / d.fecha <= %s
+de los listados, conteos y alertas (partition pruning), y la retención
+elimina meses completos con DROP PARTITION en vez de borrar fila por fila.
+
+Cada mes es una partición pAAAAMM con las mediciones de fecha menor al primer
+día del mes siguiente, más pmax (MAXVALUE) para fechas posteriores a la
+última partición; la tarea programada crea los meses futuros antes de que
+lleguen mediciones. MySQL exige que la columna de partición esté en todas
+las llaves únicas, por eso la llave primaria pasa a ser (id_dato, fecha).
+"""
+from dotenv import load_dotenv
+
+import os
+from datetime import date, datetime
+
+
+load_dotenv()
+
+# Meses futuros que deben existir como partición (los crea python manage.py particiones)
+PARTICIONES_FUTURAS = int(os.getenv("PARTICIONES_FUTURAS", 3))
+# Meses de mediciones que se conservan en `datos` (0: no se elimina nada)
+DATOS_RETENCION_MESES = int(os.getenv("DATOS_RETENCION_MESES", 0))
+
+PARTICION_MAXIMA = "pmax"
+
+PARTICIONES_SQL = """
+    SELECT partition_name, partition_description, table_rows
+    FROM information_schema.partitions
+    WHERE table_schema = DATABASE() AND table_name = 'datos' AND partition_name IS NOT NULL
+    ORDER BY partition_ordinal_position
+"""
+
+# Llaves foráneas: MySQL no permite particionar tablas que las tengan
+LLAVES_FORANEAS_SQL = """
+    SELECT constraint_name FROM information_schema.referential_constraints
+    WHERE constraint_schema = DATABASE() AND (table_name = 'datos' OR referenced_table_name = 'datos')
+"""
+
+
+def mes_siguiente(mes):
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def nombre_particion(mes):
+    return f"p{mes:%Y%m}"
+
+
+def mes_particion(nombre):
+    """Primer día del mes de la partición pAAAAMM, o None si no es una partición mensual."""
+    try:
+        return datetime.strptime(nombre, "p%Y%m").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def meses(desde, hasta):
+    """Primeros días de mes desde el de `desde` hasta el de `hasta` (inclusive)."""
+    mes = date(desde.year, desde.month, 1)
+    while mes <= hasta:
+        yield mes
+        mes = mes_siguiente(mes)
+
+
+def _definicion(mes):
+    return f"PARTITION {nombre_particion(mes)} VALUES LESS THAN ('{mes_siguiente(mes):%Y-%m-%d}')"
+
+
+def _definicion_maxima():
+    return f"PARTITION {PARTICION_MAXIMA} VALUES LESS THAN (MAXVALUE)"
+
+
+def particiones_actuales(cursor):
+    """Lista de (nombre, límite, filas estimadas) de `datos`; vacía si no está particionada."""
+    cursor.execute(PARTICIONES_SQL)
+    return cursor.fetchall()
+
+
+def particionar_sql(desde, hasta):
+    """
+    ALTER TABLE que cambia la llave primaria a (id_dato, fecha) y particiona
+    `datos` con un mes por partición entre `desde` y `hasta`, más pmax.
+    Una sola sentencia: la tabla se copia una vez.
+    """
+    definiciones = [_definicion(mes) for mes in meses(desde, hasta)] + [_definicion_maxima()]
+    return (
+        "ALTER TABLE datos DROP PRIMARY KEY, ADD PRIMARY KEY (id_dato, fecha) "
+        "PARTITION BY RANGE COLUMNS(fecha) (\n    " + ",\n    ".join(definiciones) + "\n)"
+    )
+
+
+def agregar_particiones_sql(nuevos):
+    """
+    ALTER TABLE que separa de pmax los meses `nuevos` (posteriores a la última
+    partición mensual). Solo copia las filas que ya estén en pmax.
+    """
+    definiciones = [_definicion(mes) for mes in nuevos] + [_definicion_maxima()]
+    return (
+        f"ALTER TABLE datos REORGANIZE PARTITION {PARTICION_MAXIMA} INTO (\n    "
+        + ",\n    ".join(definiciones) + "\n)"
+    )
+
+
+def meses_faltantes(nombres, hasta):
+    """Meses posteriores a la última partición mensual de `nombres` hasta el mes de `hasta` (inclusive)."""
+    existentes = [mes for mes in (mes_particion(nombre) for nombre in nombres) if mes is not None]
+    if not existentes:
+        return []
+    return list(meses(mes_siguiente(max(existentes)), hasta))
+
+
+def particiones_vencidas(nombres, hoy, retencion_meses):
+    """
+    Particiones mensuales cuyo mes completo quedó fuera de los últimos
+    `retencion_meses` meses (contando el actual), de la más antigua a la más nueva.
+    """
+    if retencion_meses <= 0:
+        return []
+    limite = date(hoy.year, hoy.month, 1)
+    for _ in range(retencion_meses - 1):
+        limite = date(limite.year - (limite.month == 1), (limite.month - 2) % 12 + 1, 1)
+    return sorted(
+        (nombre for nombre in nombres if mes_particion(nombre) is not None and mes_particion(nombre) < limite),
+        key=mes_particion
+    )
+
+
+def tabla_archivo(nombre):
+    """Tabla a la que se mueve la partición `nombre` al archivarla (datos_archivo_AAAAMM)."""
+    return f"datos_archivo_{nombre[1:]}"
+
+
+def archivar_sql(nombre):
+    """
+    Sentencias que mueven la partición `nombre` a su propia tabla (sin copiar
+    filas: EXCHANGE PARTITION intercambia los archivos) y la eliminan de `datos`.
+    """
+    tabla = tabla_archivo(nombre)
+    return [
+        f"CREATE TABLE {tabla} LIKE datos",
+        f"ALTER TABLE {tabla} REMOVE PARTITIONING",
+        f"ALTER TABLE datos EXCHANGE PARTITION {nombre} WITH TABLE {tabla}",
+        f"ALTER TABLE datos DROP PARTITION {nombre}",
+    ]
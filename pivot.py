@@ -0,0 +1,512 @@
+"""
+Pivot de mediciones sin pandas.
+
+Reemplaza `pd.DataFrame(...).fillna(...).pivot_table(aggfunc=list)` de los
+listados estructurados: agrupa las filas del cursor en una sola pasada por
+las columnas de índice (fecha, sesión, dispositivo...) y arma una fila ancha
+con una columna por `unidad_medida`.
+
+La salida es idéntica a la de pandas, incluidas sus reglas de tipos:
+  - una columna de enteros con algún NULL se vuelve float ("13" -> "13.0");
+  - las filas con NULL en una columna de índice sin relleno se descartan,
+    igual que en una columna de fechas (fillna no reemplaza NaT);
+  - las filas quedan ordenadas de forma ascendente por el índice (números
+    antes que textos) y las columnas de medidas en orden alfabético;
+  - una medida que no existe en una fila queda como "nan".
+"""
+import decimal
+from datetime import datetime, date
+from operator import itemgetter
+
+import numpy as np
+
+
+_ENTERO, _FLOTANTE, _FECHA, _OBJETO = "int", "float", "datetime", "object"
+
+
+def _tipo(clases):
+    """dtype que pandas infiere para una columna con valores de estas clases."""
+    nulos = type(None) in clases
+    clases = clases - {type(None)}
+    if clases and all(issubclass(c, datetime) for c in clases):
+        return _FECHA
+    if not clases or any(c is bool or not issubclass(c, (int, float)) for c in clases):
+        return _OBJETO
+    if nulos or any(issubclass(c, float) for c in clases):
+        return _FLOTANTE
+    return _ENTERO
+
+
+def _texto(valor, tipo):
+    """str() del valor tal como lo entrega pandas para el dtype de su columna."""
+    if valor is None:
+        return "nan" if tipo == _FLOTANTE else "None"
+    if tipo == _FLOTANTE and isinstance(valor, (int, float)):
+        return str(float(valor))
+    return str(valor)
+
+
+def _clave_orden(valor):
+    # pandas ordena los valores mixtos dejando los números antes que los textos
+    return (1, valor) if isinstance(valor, str) else (0, valor)
+
+
+def normalizar(valor):
+    """Conversión de los listados: Decimal -> float, fechas -> ISO 8601."""
+    if isinstance(valor, decimal.Decimal):
+        return float(valor)
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    return valor
+
+
+class Pivote:
+    """
+    Resultado del pivot.
+
+    - `columnas`: columnas de salida (índice + medidas ordenadas).
+    - `grupos`: lista de (valores_indice, {medida: [valores]}) en orden.
+    - `tipos`: tipo inferido de cada columna del índice y de la columna de valores.
+    - `concatenados`: {valor de la columna de agrupación: "id1, id2, ..."} si se pidió.
+    """
+
+    def __init__(self, indice, medidas, grupos, tipos, valor, concatenados=None, valores_directos=False):
+        self.indice = indice
+        self.medidas = medidas
+        self.columnas = list(indice) + list(medidas)
+        self.grupos = grupos
+        self.tipos = tipos
+        self.valor = valor
+        self.concatenados = concatenados
+        # str() de los valores ya coincide con pandas (sin enteros ni NULL en una columna float)
+        self._valores_directos = valores_directos
+
+    def __len__(self):
+        return len(self.grupos)
+
+    def _textos_indice(self):
+        """Texto de cada valor distinto de cada columna del índice."""
+        if not self.grupos:
+            return [{} for _ in self.indice]
+        columnas = zip(*(claves for claves, _ in self.grupos))
+        return [
+            {v: _texto(v, self.tipos[c]) for v in set(valores)}
+            for c, valores in zip(self.indice, columnas)
+        ]
+
+    def _texto_valor(self, valor):
+        return str(valor) if self._valores_directos else _texto(valor, self.tipos[self.valor])
+
+    def filas_texto(self, concatenar_en=None, columna_concatenada="id_dato_concatenado"):
+        """
+        Filas con todos los valores como texto y las listas unidas por ", "
+        (equivale a `df_pivoted.map(lambda x: ', '.join(map(str, x)) ...)`).
+        Con `concatenar_en` agrega la columna de ids concatenados (merge por esa columna).
+        """
+        textos = self._textos_indice()
+        texto_valor = str if self._valores_directos else self._texto_valor
+        posicion = self.indice.index(concatenar_en) if concatenar_en else None
+        filas = []
+        for claves, medidas in self.grupos:
+            fila = dict(zip(self.indice, [t[v] for t, v in zip(textos, claves)]))
+            for medida in self.medidas:
+                valores = medidas.get(medida)
+                fila[medida] = ", ".join(map(texto_valor, valores)) if valores is not None else "nan"
+            if posicion is not None:
+                fila[columna_concatenada] = self.concatenados.get(claves[posicion], "nan")
+            filas.append(fila)
+        return filas
+
+    def filas_listas(self):
+        """
+        Filas con los valores como texto, las medidas como lista de textos y
+        las listas de un elemento aplanadas (formato de listarDatosEstructuradosV2).
+        """
+        textos = self._textos_indice()
+        texto_valor = str if self._valores_directos else self._texto_valor
+        filas = []
+        for claves, medidas in self.grupos:
+            fila = dict(zip(self.indice, [t[v] for t, v in zip(textos, claves)]))
+            for medida in self.medidas:
+                valores = medidas.get(medida)
+                if valores is None:
+                    fila[medida] = "nan"
+                elif len(valores) == 1:
+                    fila[medida] = texto_valor(valores[0])
+                else:
+                    fila[medida] = list(map(texto_valor, valores))
+            filas.append(fila)
+        return filas
+
+
+def _extractor(posiciones):
+    if len(posiciones) == 1:
+        posicion = posiciones[0]
+        return lambda fila: (fila[posicion],)
+    return itemgetter(*posiciones)
+
+
+def pivotar(filas, nombres, indice, columna="unidad_medida", valor="valor",
+            rellenos=None, relleno=None, convertir=None, concatenar=None):
+    """
+    Agrupa `filas` (tuplas del cursor con columnas `nombres`) en una sola pasada.
+
+    - `indice`: columnas que identifican una fila de salida.
+    - `columna` / `valor`: columna cuyos valores pasan a ser columnas y valor que se acumula.
+    - `rellenos`: {columna: valor} para los NULL (como `fillna(value={...})`).
+    - `relleno`: valor para los NULL de todas las columnas (como `fillna(valor)`).
+    - `convertir`: función aplicada a cada valor antes de agrupar (p. ej. `normalizar`).
+    - `concatenar`: (columna_grupo, columna_id) para concatenar los ids de cada
+      valor de la columna de grupo (una columna del índice), en el orden de llegada.
+    """
+    rellenos = rellenos or {}
+    posiciones = {nombre: i for i, nombre in enumerate(nombres)}
+    extraer_indice = _extractor([posiciones[c] for c in indice])
+    pos_columna = posiciones[columna]
+    pos_valor = posiciones[valor]
+    relleno_de = (lambda nombre: relleno) if relleno is not None else rellenos.get
+    rellenos_indice = [relleno_de(c) for c in indice]
+    relleno_columna = relleno_de(columna)
+    relleno_valor = relleno_de(valor)
+    if concatenar:
+        if concatenar[0] not in indice:
+            raise ValueError(f"La columna '{concatenar[0]}' no está en el índice")
+        pos_grupo = indice.index(concatenar[0])
+        pos_id = posiciones[concatenar[1]]
+
+    # Cada combinación del índice se repite una vez por medida: se convierte,
+    # rellena y tipa una sola vez por combinación cruda distinta
+    resueltas = {}  # tupla cruda -> (claves rellenadas, válida)
+    clases_indice = [set() for _ in indice]
+    clases_valor = set()
+    vistos = [set() for _ in indice]  # valores de cada columna del índice en todas las filas
+    grupos = {}
+    concatenados = {}
+    for fila in filas:
+        crudas = extraer_indice(fila)
+        resuelta = resueltas.get(crudas)
+        if resuelta is None:
+            claves = [convertir(v) for v in crudas] if convertir is not None else crudas
+            for clases, v in zip(clases_indice, claves):
+                clases.add(type(v))
+            claves = tuple(r if v is None else v for v, r in zip(claves, rellenos_indice))
+            for valores, v in zip(vistos, claves):
+                if v is not None:
+                    valores.add(v)
+            # pandas descarta los grupos con NaN en el índice
+            grupo = grupos.setdefault(claves, {}) if None not in claves else None
+            ids = None
+            if concatenar and claves[pos_grupo] is not None:
+                ids = concatenados.setdefault(claves[pos_grupo], [])
+            resuelta = resueltas[crudas] = (grupo, ids)
+        grupo, ids = resuelta
+
+        if ids is not None:
+            ids.append(fila[pos_id])
+
+        medida = fila[pos_columna]
+        v = fila[pos_valor]
+        if convertir is not None:
+            if medida.__class__ is not str:
+                medida = convertir(medida)
+            v = convertir(v)
+        clases_valor.add(type(v))
+        if medida is None:
+            medida = relleno_columna
+        if v is None and relleno_valor is not None:
+            v = relleno_valor
+        if medida is None or grupo is None:
+            continue  # ...y los que tienen NaN en la columna a pivotar
+        lista = grupo.get(medida)
+        if lista is None:
+            grupo[medida] = [v]
+        else:
+            lista.append(v)
+
+    grupos = {claves: grupo for claves, grupo in grupos.items() if grupo}
+
+    # En las columnas de fechas el relleno no aplica: esas filas quedan con NaT y se descartan
+    tipos = {c: _tipo(clases) for c, clases in zip(indice, clases_indice)}
+    tipos[valor] = _tipo(clases_valor)
+    for i, (c, r) in enumerate(zip(indice, rellenos_indice)):
+        if tipos[c] == _FECHA and r is not None:
+            vistos[i].discard(r)
+            grupos = {claves: g for claves, g in grupos.items() if claves[i] != r}
+
+    medidas = {medida for grupo in grupos.values() for medida in grupo}
+
+    # Orden de pandas: cada nivel del índice ordenado (números antes que textos)...
+    niveles = [set(valores) for valores in zip(*grupos)] if grupos else [set() for _ in indice]
+    rangos = [{v: n for n, v in enumerate(sorted(nivel, key=_clave_orden))} for nivel in niveles]
+    orden = sorted(grupos, key=lambda claves: tuple([r[v] for r, v in zip(rangos, claves)]))
+
+    # ...salvo los niveles con valores que solo aparecen en filas descartadas: pandas
+    # (remove_unused_levels al hacer unstack) los deja por orden de primera aparición
+    reordenar = False
+    for i, (nivel, valores) in enumerate(zip(niveles, vistos)):
+        if len(nivel) != len(valores):
+            usados = {}
+            for claves in orden:
+                usados.setdefault(claves[i], len(usados))
+            rangos[i] = usados
+            reordenar = True
+    if reordenar:
+        orden.sort(key=lambda claves: tuple([r[v] for r, v in zip(rangos, claves)]))
+
+    return Pivote(
+        list(indice),
+        sorted(medidas, key=_clave_orden),
+        [(claves, grupos[claves]) for claves in orden],
+        tipos,
+        valor,
+        {k: ", ".join(map(str, v)) for k, v in concatenados.items()} if concatenar else None,
+        valores_directos=tipos[valor] != _FLOTANTE or clases_valor <= {float},
+    )
+
+
+def ordenar_descendente(filas, columna, como_fecha=False):
+    """
+    Ordena filas (dicts) de mayor a menor por `columna`, igual que
+    `DataFrame.sort_values(ascending=False)` (mismo algoritmo de numpy, por lo
+    que los empates quedan en el mismo orden). Con `como_fecha` los valores se
+    interpretan como fechas ISO y los inválidos o vacíos quedan al final.
+    """
+    if not filas:
+        return filas
+    if como_fecha:
+        fechas = []
+        for fila in filas:
+            try:
+                fechas.append(np.datetime64(fila[columna], "ns"))
+            except ValueError:
+                fechas.append(np.datetime64("NaT", "ns"))
+        valores = np.array(fechas, dtype="datetime64[ns]")
+        nulos = np.isnat(valores)
+    else:
+        valores = np.empty(len(filas), dtype=object)
+        valores[:] = [fila[columna] for fila in filas]
+        nulos = np.zeros(len(filas), dtype=bool)
+
+    posiciones = np.arange(len(filas))
+    validas = valores[~nulos][::-1]
+    posiciones_validas = posiciones[~nulos][::-1]
+    indexador = posiciones_validas[validas.argsort(kind="quicksort")][::-1]
+    indexador = np.concatenate([indexador, np.nonzero(nulos)[0]])
+    return [filas[i] for i in indexador]
+
+
+# Pivot en el servidor (pivot=sql)
+#
+# MySQL devuelve las filas ya anchas: una columna GROUP_CONCAT(CASE ...) por
+# cada (tipo de sensor, variable) conocido en variables_en_sensores para los
+# dispositivos filtrados, agrupando por el mismo índice del pivot en Python.
+# Así LIMIT/OFFSET se aplican a filas reales de la salida.
+
+INDICE_SQL = [
+    ("fecha", "d.fecha"),
+    ("fecha_insercion", "d.fecha_insercion"),
+    ("id_sesion", "d.id_sesion"),
+    ("sesion_descripcion", "s.descripcion"),
+    ("fecha_inicio", "s.fecha_inicio"),
+    ("ubicacion", "s.ubicacion"),
+    ("id_proyecto", "disp.id_proyecto"),
+    ("codigo_interno", "disp.codigo_interno"),
+    ("dispositivo_descripcion", "disp.descripcion"),
+]
+
+RELLENOS_SQL = {"id_sesion": "Sin sesión"}
+
+# Largo máximo de cada GROUP_CONCAT en la sesión: con el valor por defecto de
+# MySQL (1024 bytes) las medidas e id_dato_concatenado se truncan sin error
+GROUP_CONCAT_MAX_LEN = 64 * 1024 * 1024
+
+# Filtros que se pueden aplicar a la topología (el resto filtra solo las mediciones)
+PREFIJOS_TOPOLOGIA = ("disp.", "sed.", "sens.", "st.")
+
+ORDEN_SQL = {
+    'fecha': 'd.fecha',
+    'fecha_insercion': 'd.fecha_insercion',
+    'id_sesion': 'd.id_sesion',
+    'codigo_interno': 'disp.codigo_interno',
+    'id_proyecto': 'disp.id_proyecto',
+}
+
+COLUMNAS_PIVOT_SQL = """
+    SELECT DISTINCT
+        st.id_sensor_tipo,
+        v.id_variable,
+        CONCAT(st.modelo, ' [', v.descripcion, ' (', v.unidad, ')]') AS unidad_medida
+    FROM
+        sensores_dev.dispositivos AS disp
+    JOIN
+        sensores_dev.sensores_en_dispositivo AS sed ON disp.id_dispositivo = sed.id_dispositivo
+    JOIN
+        sensores_dev.sensores AS sens ON sed.id_sensor = sens.id_sensor
+    JOIN
+        sensores_dev.sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
+    JOIN
+        sensores_dev.variables_en_sensores AS ves ON st.id_sensor_tipo = ves.idSensorTipo
+    JOIN
+        sensores_dev.variables AS v ON ves.idVariable = v.id_variable
+    {where_clause}
+"""
+
+FROM_PIVOT_SQL = """
+    FROM
+        {origen} AS d
+    LEFT JOIN
+        sensores_dev.variables AS v ON d.id_variable = v.id_variable
+    LEFT JOIN
+        sensores_dev.sesiones AS s ON d.id_sesion = s.id_sesion
+    LEFT JOIN
+        sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
+    LEFT JOIN
+        sensores_dev.sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
+    LEFT JOIN
+        sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
+    LEFT JOIN
+        sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
+    {where_clause}
+    GROUP BY {indice}
+"""
+
+
+def columnas_pivot_sql(cursor, filtros):
+    """
+    Columnas del pivot para los dispositivos que cumplen los filtros de topología:
+    lista ordenada de (unidad_medida, [(id_sensor_tipo, id_variable), ...]).
+    `filtros` es {columna: [valores]} con los filtros del request.
+    """
+    where_clauses = []
+    params = []
+    for key, values in filtros.items():
+        if key.startswith(PREFIJOS_TOPOLOGIA):
+            where_clauses.append("(" + " OR ".join([f"{key}=%s" for _ in values]) + ")")
+            params.extend(values)
+    where_clause = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+    cursor.execute(COLUMNAS_PIVOT_SQL.format(where_clause=where_clause), params)
+
+    # Varios pares pueden compartir la etiqueta: en el pivot en Python son una sola columna
+    columnas = {}
+    for tipo, variable, etiqueta in cursor.fetchall():
+        if etiqueta is not None:
+            columnas.setdefault(etiqueta, []).append((tipo, variable))
+    return sorted(columnas.items(), key=lambda columna: _clave_orden(columna[0]))
+
+
+def _texto_sql(valor, relleno=""):
+    if valor is None:
+        return relleno
+    if isinstance(valor, (bytes, bytearray)):
+        # GROUP_CONCAT puede llegar como BLOB según group_concat_max_len
+        return valor.decode("utf-8")
+    return str(normalizar(valor))
+
+
+def _texto_medida(texto):
+    # Como normalizar() en el pivot en Python: DECIMAL -> float ("40.00" -> "40.0")
+    try:
+        return str(float(texto))
+    except ValueError:
+        return texto
+
+
+def _texto_medidas_sql(valor):
+    """Celda de medidas (GROUP_CONCAT de d.valor) con los textos del pivot en Python."""
+    if valor is None:
+        return "nan"
+    return ", ".join(_texto_medida(texto) for texto in _texto_sql(valor).split(", "))
+
+
+def pivotar_sql(cursor, filtros, where_clause, params, order_by="fecha", limit=None, offset=0,
+                contar=False, concatenar_ids=False, keyset=False, despues_de=None, origen="sensores_dev.datos"):
+    """
+    Listado estructurado pivotado por MySQL.
+
+    Devuelve (columnas, filas, total, siguiente): las filas son dicts con los
+    mismos textos que el pivot en Python (medidas unidas por ", ", "nan" si no
+    hay medición) y `total` es el número de filas pivotadas sin LIMIT (solo con
+    `contar`; si no, None).
+    Con `concatenar_ids` agrega id_dato_concatenado con los id_dato de cada fila.
+    Las columnas sin ninguna medición en la página se omiten, como en el pivot en Python.
+
+    Con `keyset` las filas se ordenan por (fecha, mayor id_dato) en lugar de usar
+    OFFSET, continúan después de `despues_de` = (fecha, id_dato) si se entrega, y
+    `siguiente` es la clave de la última fila cuando la página viene llena.
+    `origen` es la tabla (o subconsulta) que se lee con las columnas de `datos`.
+    """
+    columnas = columnas_pivot_sql(cursor, filtros)
+    indice = ", ".join(expresion for _, expresion in INDICE_SQL)
+    desde = FROM_PIVOT_SQL.format(origen=origen, where_clause=where_clause, indice=indice)
+
+    celdas = []
+    params_celdas = []
+    for i, (_, pares) in enumerate(columnas):
+        condicion = " OR ".join(["(sens.id_sensor_tipo = %s AND d.id_variable = %s)"] * len(pares))
+        celdas.append(f"GROUP_CONCAT(CASE WHEN {condicion} THEN d.valor END ORDER BY d.id_dato SEPARATOR ', ') AS c{i}")
+        params_celdas.extend(p for par in pares for p in par)
+    if concatenar_ids:
+        celdas.append("GROUP_CONCAT(d.id_dato ORDER BY d.id_dato SEPARATOR ', ') AS id_dato_concatenado")
+    if keyset:
+        celdas.append("MAX(d.id_dato) AS id_dato_max")
+    seleccion = ",\n        ".join(
+        [f"{expresion} AS {nombre}" for nombre, expresion in INDICE_SQL] + celdas
+    )
+
+    params_sql = params_celdas + list(params)
+    cursor.execute(f"SET SESSION group_concat_max_len = {GROUP_CONCAT_MAX_LEN}")
+    if keyset:
+        desde_pagina = desde
+        if despues_de is not None:
+            # El WHERE acota el rango de fechas en el índice; el HAVING desempata
+            # las filas de la misma fecha por su mayor id_dato
+            fecha, id_dato = despues_de
+            condicion = "d.fecha <= %s"
+            where_pagina = f"{where_clause} AND {condicion}" if where_clause else f"WHERE {condicion}"
+            desde_pagina = FROM_PIVOT_SQL.format(origen=origen, where_clause=where_pagina, indice=indice)
+            desde_pagina += "    HAVING (d.fecha < %s OR MAX(d.id_dato) < %s)\n"
+            params_sql.extend([fecha, fecha, id_dato])
+        sql_query = f"SELECT\n        {seleccion}\n    {desde_pagina} ORDER BY d.fecha DESC, id_dato_max DESC"
+        if limit is not None and limit > 0:
+            sql_query += " LIMIT %s"
+            params_sql.append(limit)
+    else:
+        sql_query = f"SELECT\n        {seleccion}\n    {desde}"
+        columna_orden = ORDEN_SQL.get(order_by.lower(), 'd.fecha')
+        if order_by.lower() == 'fecha_insercion':
+            sql_query += f" ORDER BY {columna_orden} IS NULL, {columna_orden} DESC"
+        else:
+            sql_query += f" ORDER BY {columna_orden} DESC"
+        if limit is not None and limit > 0:
+            sql_query += " LIMIT %s OFFSET %s"
+            params_sql.extend([limit, offset])
+
+    cursor.execute(sql_query, params_sql)
+    resultado = cursor.fetchall()
+
+    total = None
+    if contar:
+        if (limit is not None and limit > 0) or despues_de is not None:
+            cursor.execute(f"SELECT COUNT(*) FROM (SELECT 1 {desde}) AS filas_pivot", list(params))
+            total = int(cursor.fetchone()[0])
+        else:
+            total = len(resultado)
+
+    siguiente = None
+    if keyset and resultado and limit is not None and 0 < limit <= len(resultado):
+        siguiente = (resultado[-1][0], int(resultado[-1][-1]))
+
+    n_indice = len(INDICE_SQL)
+    presentes = [i for i in range(len(columnas)) if any(fila[n_indice + i] is not None for fila in resultado)]
+    nombres = [nombre for nombre, _ in INDICE_SQL] + [columnas[i][0] for i in presentes]
+    if concatenar_ids:
+        nombres.append("id_dato_concatenado")
+
+    filas = []
+    for fila in resultado:
+        salida = [_texto_sql(v, RELLENOS_SQL.get(nombre, "")) for (nombre, _), v in zip(INDICE_SQL, fila)]
+        salida += [_texto_medidas_sql(fila[n_indice + i]) for i in presentes]
+        if concatenar_ids:
+            salida.append(_texto_sql(fila[n_indice + len(columnas)]))
+        filas.append(dict(zip(nombres, salida)))
+    return nombres, filas, total, siguiente
@@ -0,0 +1,160 @@
+"""
+Reducción visual de series de mediciones a un número fijo de puntos.
+
+A diferencia del promedio por cubeta, estos métodos devuelven mediciones
+reales y conservan la forma de la curva (los picos no se promedian):
+
+- "lttb": Largest-Triangle-Three-Buckets. De cada cubeta se elige el punto
+  que forma el triángulo de mayor área con el punto elegido en la cubeta
+  anterior y el promedio de la siguiente. El primer y el último punto de la
+  serie siempre se incluyen.
+- "minmax": el mínimo y el máximo de cada cubeta (dos puntos por cubeta),
+  lo que corresponde a dibujar una columna por pixel.
+
+Las cubetas son intervalos de tiempo iguales entre `inicio` y `fin`, así las
+filas se pueden procesar a medida que llegan del cursor (ordenadas por fecha)
+y en memoria queda solo el estado por cubeta o las mediciones de las cubetas
+aún abiertas, no la serie completa. Las cubetas sin mediciones no generan
+puntos, por lo que una serie tiene a lo más `puntos` puntos.
+"""
+import numpy as np
+
+
+METODOS = ("lttb", "minmax")
+
+_US = np.timedelta64(1, "us")
+
+
+def a_microsegundos(fechas):
+    """Arreglo int64 de microsegundos desde 1970-01-01 para datetimes (o textos ISO) sin zona horaria."""
+    return np.array(fechas, dtype="datetime64[us]").astype(np.int64)
+
+
+def a_fechas(microsegundos):
+    """Lista de datetime a partir de microsegundos desde 1970-01-01."""
+    return np.asarray(microsegundos, dtype=np.int64).astype("datetime64[us]").astype(object).tolist()
+
+
+class ReductorMinMax:
+    """Mínimo y máximo por cubeta: el estado es de tamaño fijo (puntos // 2 cubetas)."""
+
+    def __init__(self, inicio, fin, puntos):
+        self.cubetas = max(puntos // 2, 1)
+        self.inicio = inicio
+        self.ancho = max((fin - inicio) / self.cubetas, 1)
+        self.t_min = np.zeros(self.cubetas, dtype=np.int64)
+        self.v_min = np.full(self.cubetas, np.inf)
+        self.t_max = np.zeros(self.cubetas, dtype=np.int64)
+        self.v_max = np.full(self.cubetas, -np.inf)
+
+    def agregar(self, t, v):
+        if len(t) == 0:
+            return
+        cubeta = np.clip(((t - self.inicio) // self.ancho).astype(np.int64), 0, self.cubetas - 1)
+        # Ordenadas por (cubeta, valor, fecha): la primera fila de cada cubeta es su mínimo y la última su máximo
+        orden = np.lexsort((t, v, cubeta))
+        cubeta, t, v = cubeta[orden], t[orden], v[orden]
+        primeras = np.flatnonzero(np.r_[True, cubeta[1:] != cubeta[:-1]])
+        ultimas = np.r_[primeras[1:] - 1, len(cubeta) - 1]
+        c = cubeta[primeras]
+
+        menor = v[primeras] < self.v_min[c]
+        self.v_min[c[menor]] = v[primeras][menor]
+        self.t_min[c[menor]] = t[primeras][menor]
+        mayor = v[ultimas] > self.v_max[c]
+        self.v_max[c[mayor]] = v[ultimas][mayor]
+        self.t_max[c[mayor]] = t[ultimas][mayor]
+
+    def terminar(self):
+        con_datos = np.isfinite(self.v_min)
+        t = np.concatenate([self.t_min[con_datos], self.t_max[con_datos]])
+        v = np.concatenate([self.v_min[con_datos], self.v_max[con_datos]])
+        # Cuando el mínimo y el máximo son la misma medición se entrega una vez
+        pares = np.unique(np.stack([t, v.view(np.int64)], axis=1), axis=0)
+        return pares[:, 0], pares[:, 1].copy().view(np.float64)
+
+
+class ReductorLTTB:
+    """
+    LTTB por cubetas de tiempo. Una cubeta se decide cuando ya se conoce la
+    siguiente completa (llegó una fila posterior a ella), así solo se guardan
+    las mediciones de las últimas cubetas abiertas.
+    """
+
+    def __init__(self, inicio, fin, puntos):
+        # El primer y el último punto van aparte: quedan puntos - 2 cubetas
+        self.cubetas = max(puntos - 2, 1)
+        self.inicio = inicio
+        self.ancho = max((fin - inicio) / self.cubetas, 1)
+        self.t = np.zeros(0, dtype=np.int64)
+        self.v = np.zeros(0)
+        self.elegidos_t = []
+        self.elegidos_v = []
+
+    def _cubeta(self, t):
+        return np.clip(((t - self.inicio) // self.ancho).astype(np.int64), 0, self.cubetas - 1)
+
+    def _elegir(self, t, v, siguiente_t, siguiente_v):
+        """Punto de la cubeta (t, v) con el triángulo de mayor área entre el anterior y `siguiente`."""
+        a_t, a_v = self.elegidos_t[-1], self.elegidos_v[-1]
+        area = np.abs((a_t - siguiente_t) * (v - a_v) - (a_t - t) * (siguiente_v - a_v))
+        i = int(np.argmax(area))
+        self.elegidos_t.append(t[i])
+        self.elegidos_v.append(v[i])
+
+    def _decidir(self, hasta_el_final=False):
+        cubeta = self._cubeta(self.t)
+        limites = np.flatnonzero(np.r_[True, cubeta[1:] != cubeta[:-1], True])
+        # Sin `hasta_el_final` la última cubeta puede recibir más filas: se deciden las anteriores a la penúltima
+        decidibles = len(limites) - 1 if hasta_el_final else len(limites) - 3
+        for k in range(max(decidibles, 0)):
+            desde, hasta = limites[k], limites[k + 1]
+            if k + 2 < len(limites):
+                siguiente = slice(limites[k + 1], limites[k + 2])
+                siguiente_t = self.t[siguiente].mean()
+                siguiente_v = self.v[siguiente].mean()
+            else:
+                siguiente_t, siguiente_v = self._ultimo
+            self._elegir(self.t[desde:hasta], self.v[desde:hasta], siguiente_t, siguiente_v)
+        if decidibles > 0:
+            resto = limites[decidibles]
+            self.t, self.v = self.t[resto:], self.v[resto:]
+
+    def agregar(self, t, v):
+        if len(t) == 0:
+            return
+        if not self.elegidos_t:
+            self.elegidos_t.append(t[0])
+            self.elegidos_v.append(v[0])
+            t, v = t[1:], v[1:]
+        self.t = np.concatenate([self.t, t])
+        self.v = np.concatenate([self.v, v])
+        self._decidir()
+
+    def terminar(self):
+        if len(self.t) > 0:
+            self._ultimo = (self.t[-1], self.v[-1])
+            self.t, self.v = self.t[:-1], self.v[:-1]
+            if len(self.t) > 0:
+                self._decidir(hasta_el_final=True)
+            self.elegidos_t.append(self._ultimo[0])
+            self.elegidos_v.append(self._ultimo[1])
+        return np.array(self.elegidos_t, dtype=np.int64), np.array(self.elegidos_v, dtype=np.float64)
+
+
+def reductor(metodo, inicio, fin, puntos):
+    """Reductor para una serie con fechas (en microsegundos) entre `inicio` y `fin`."""
+    if metodo == "minmax":
+        return ReductorMinMax(inicio, fin, puntos)
+    return ReductorLTTB(inicio, fin, puntos)
+
+
+def reducir(t, v, puntos, metodo="lttb"):
+    """Reduce una serie completa (arreglos de fechas en microsegundos y valores) a lo más `puntos` puntos."""
+    t = np.asarray(t, dtype=np.int64)
+    v = np.asarray(v, dtype=np.float64)
+    if len(t) <= puntos:
+        return t, v
+    r = reductor(metodo, int(t[0]), int(t[-1]), puntos)
+    r.agregar(t, v)
+    return r.terminar()
@@ -0,0 +1,263 @@
+from dotenv import load_dotenv
+
+import math
+import os
+import re
+from datetime import datetime, timedelta
+
+
+load_dotenv()
+
+# Mantener y usar las tablas resumen_hora y resumen_dia (crearlas antes con python manage.py resumenes)
+RESUMENES = os.getenv("RESUMENES", "0") in ("1", "true", "True")
+
+# Valores que cuentan como medición numérica, el mismo criterio en Python
+# (_numero) y en SQL (condición VALOR_NUMERICO_SQL sobre d.valor): 'abc', 'nan'
+# o 'inf' no se agregan en ningún lado (d.valor + 0e0 los convertiría en 0)
+VALOR_NUMERICO_SQL = "d.valor REGEXP '^[[:space:]]*[-+]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][-+]?[0-9]+)?[[:space:]]*$'"
+# Para las lecturas de `datos` en /serieAgregada: el REGEXP solo se evalúa en
+# los valores que convierten a 0 (ceros y textos no numéricos), no en cada
+# fila. Un texto con prefijo numérico ('12abc') cuenta ahí como 12.
+VALOR_NUMERICO_RAPIDO_SQL = "(d.valor + 0e0 <> 0 OR " + VALOR_NUMERICO_SQL + ")"
+_VALOR_NUMERICO = re.compile(r"^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$", re.ASCII)
+
+# Un resumen por (sensor, variable, periodo) con las mediciones numéricas del periodo.
+# primero/ultimo son el valor de la menor/mayor (fecha, id_dato) del periodo.
+RESUMEN_TABLA_SQL = """
+    CREATE TABLE IF NOT EXISTS {tabla} (
+        id_sensor INT NOT NULL,
+        id_variable INT NOT NULL,
+        periodo {tipo} NOT NULL,
+        mediciones BIGINT NOT NULL DEFAULT 0,
+        suma DOUBLE NOT NULL DEFAULT 0,
+        minimo DOUBLE NULL,
+        maximo DOUBLE NULL,
+        fecha_primero DATETIME NULL,
+        primero DOUBLE NULL,
+        fecha_ultimo DATETIME NULL,
+        ultimo DOUBLE NULL,
+        PRIMARY KEY (id_sensor, id_variable, periodo),
+        KEY ix_{tabla}_periodo (periodo)
+    )
+"""
+
+# Tabla -> (tipo de la columna periodo, segundos por periodo)
+TABLAS_RESUMEN = {
+    "resumen_hora": ("DATETIME", 3600),
+    "resumen_dia": ("DATE", 86400),
+}
+
+# primero/ultimo se actualizan antes que sus fechas: MySQL asigna en orden y
+# las condiciones deben ver la fecha anterior
+SUMAR_RESUMEN_SQL = (
+    "INSERT INTO {tabla} (id_sensor, id_variable, periodo, mediciones, suma, minimo, maximo, "
+    "fecha_primero, primero, fecha_ultimo, ultimo) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE "
+    "mediciones = mediciones + VALUES(mediciones), "
+    "suma = suma + VALUES(suma), "
+    "minimo = LEAST(minimo, VALUES(minimo)), "
+    "maximo = GREATEST(maximo, VALUES(maximo)), "
+    "primero = IF(VALUES(fecha_primero) < fecha_primero, VALUES(primero), primero), "
+    "fecha_primero = LEAST(fecha_primero, VALUES(fecha_primero)), "
+    "ultimo = IF(VALUES(fecha_ultimo) >= fecha_ultimo, VALUES(ultimo), ultimo), "
+    "fecha_ultimo = GREATEST(fecha_ultimo, VALUES(fecha_ultimo))"
+)
+
+# Recálculo de resumen_hora desde `datos`. GROUP_CONCAT puede truncarse
+# (group_concat_max_len), pero solo se usa su primer elemento.
+RECALCULAR_HORA_SQL = """
+    INSERT INTO resumen_hora (id_sensor, id_variable, periodo, mediciones, suma, minimo, maximo,
+                              fecha_primero, primero, fecha_ultimo, ultimo)
+    SELECT
+        d.id_sensor,
+        d.id_variable,
+        TIMESTAMP(DATE(d.fecha), MAKETIME(HOUR(d.fecha), 0, 0)) AS hora,
+        COUNT(*),
+        SUM(d.valor + 0e0),
+        MIN(d.valor + 0e0),
+        MAX(d.valor + 0e0),
+        MIN(d.fecha),
+        SUBSTRING_INDEX(GROUP_CONCAT(d.valor ORDER BY d.fecha, d.id_dato SEPARATOR ';'), ';', 1) + 0e0,
+        MAX(d.fecha),
+        SUBSTRING_INDEX(GROUP_CONCAT(d.valor ORDER BY d.fecha DESC, d.id_dato DESC SEPARATOR ';'), ';', 1) + 0e0
+    FROM datos AS d
+    WHERE {where_clause} AND """ + VALOR_NUMERICO_SQL + """
+    GROUP BY d.id_sensor, d.id_variable, hora
+    ON DUPLICATE KEY UPDATE
+        mediciones = VALUES(mediciones), suma = VALUES(suma), minimo = VALUES(minimo), maximo = VALUES(maximo),
+        fecha_primero = VALUES(fecha_primero), primero = VALUES(primero),
+        fecha_ultimo = VALUES(fecha_ultimo), ultimo = VALUES(ultimo)
+"""
+
+# resumen_dia se arma desde resumen_hora (24 filas por día en vez de todas las mediciones)
+RECALCULAR_DIA_SQL = """
+    INSERT INTO resumen_dia (id_sensor, id_variable, periodo, mediciones, suma, minimo, maximo,
+                             fecha_primero, primero, fecha_ultimo, ultimo)
+    SELECT
+        r.id_sensor,
+        r.id_variable,
+        DATE(r.periodo) AS dia,
+        SUM(r.mediciones),
+        SUM(r.suma),
+        MIN(r.minimo),
+        MAX(r.maximo),
+        MIN(r.fecha_primero),
+        SUBSTRING_INDEX(GROUP_CONCAT(r.primero ORDER BY r.periodo SEPARATOR ';'), ';', 1) + 0e0,
+        MAX(r.fecha_ultimo),
+        SUBSTRING_INDEX(GROUP_CONCAT(r.ultimo ORDER BY r.periodo DESC SEPARATOR ';'), ';', 1) + 0e0
+    FROM resumen_hora AS r
+    WHERE {where_clause}
+    GROUP BY r.id_sensor, r.id_variable, dia
+    ON DUPLICATE KEY UPDATE
+        mediciones = VALUES(mediciones), suma = VALUES(suma), minimo = VALUES(minimo), maximo = VALUES(maximo),
+        fecha_primero = VALUES(fecha_primero), primero = VALUES(primero),
+        fecha_ultimo = VALUES(fecha_ultimo), ultimo = VALUES(ultimo)
+"""
+
+
+def _numero(valor):
+    if valor is None:
+        return None
+    if isinstance(valor, (bytes, bytearray)):
+        valor = valor.decode("utf-8")
+    if not isinstance(valor, (int, float)) and not _VALOR_NUMERICO.match(str(valor)):
+        return None
+    numero = float(valor)
+    return None if math.isnan(numero) or math.isinf(numero) else numero
+
+
+def _resumir(filas, largo_periodo):
+    """
+    Resumen por (id_sensor, id_variable, periodo) de las filas de `datos`
+    (id_sensor, valor, fecha, id_variable, ...) en el orden de inserción.
+    `largo_periodo` es el largo del prefijo de la fecha que identifica el periodo.
+    """
+    celdas = {}
+    for fila in filas:
+        valor = _numero(fila[1])
+        if valor is None:
+            continue
+        fecha = str(fila[2])
+        clave = (int(fila[0]), int(fila[3]), fecha[:largo_periodo])
+        celda = celdas.get(clave)
+        if celda is None:
+            celdas[clave] = [1, valor, valor, valor, fecha, valor, fecha, valor]
+            continue
+        celda[0] += 1
+        celda[1] += valor
+        if valor < celda[2]:
+            celda[2] = valor
+        if valor > celda[3]:
+            celda[3] = valor
+        if fecha < celda[4]:
+            celda[4], celda[5] = fecha, valor
+        # A igual fecha la insertada después tiene mayor id_dato
+        if fecha >= celda[6]:
+            celda[6], celda[7] = fecha, valor
+    return celdas
+
+
+def sumar_resumenes(cursor, filas, insertadas=None):
+    """
+    Suma las filas recién insertadas en `datos` a resumen_hora y resumen_dia,
+    en la misma transacción que el INSERT (si se deshace, el resumen también).
+
+    Si `insertadas` < len(filas) (DEDUP_DATOS descartó mediciones repetidas y no
+    se sabe cuáles) las horas afectadas se recalculan desde `datos`.
+    No hace nada si RESUMENES no está activo.
+    """
+    if not RESUMENES or not filas:
+        return
+    horas = _resumir(filas, 13)
+    if not horas:
+        return
+    if insertadas is not None and insertadas < len(filas):
+        recalcular_resumenes(cursor, sorted(horas))
+        return
+    # Siempre en el mismo orden para que dos inserciones concurrentes no se bloqueen mutuamente
+    cursor.executemany(
+        SUMAR_RESUMEN_SQL.format(tabla="resumen_hora"),
+        [(id_sensor, id_variable, hora + ":00:00", *celda) for (id_sensor, id_variable, hora), celda in sorted(horas.items())]
+    )
+    dias = _resumir(filas, 10)
+    cursor.executemany(
+        SUMAR_RESUMEN_SQL.format(tabla="resumen_dia"),
+        [(id_sensor, id_variable, dia, *celda) for (id_sensor, id_variable, dia), celda in sorted(dias.items())]
+    )
+
+
+def recalcular_resumenes(cursor, horas):
+    """
+    Recalcula desde `datos` las horas (id_sensor, id_variable, 'YYYY-MM-DD HH')
+    y sus días. Las que quedan sin mediciones numéricas se eliminan.
+    """
+    dias = set()
+    for id_sensor, id_variable, hora in horas:
+        desde = datetime.strptime(hora, "%Y-%m-%d %H")
+        cursor.execute(
+            "DELETE FROM resumen_hora WHERE id_sensor = %s AND id_variable = %s AND periodo = %s",
+            (id_sensor, id_variable, desde)
+        )
+        cursor.execute(
+            RECALCULAR_HORA_SQL.format(
+                where_clause="d.id_sensor = %s AND d.id_variable = %s AND d.fecha >= %s AND d.fecha < %s"
+            ),
+            (id_sensor, id_variable, desde, desde + timedelta(hours=1))
+        )
+        dias.add((id_sensor, id_variable, desde.date()))
+    for id_sensor, id_variable, dia in sorted(dias):
+        cursor.execute(
+            "DELETE FROM resumen_dia WHERE id_sensor = %s AND id_variable = %s AND periodo = %s",
+            (id_sensor, id_variable, dia)
+        )
+        cursor.execute(
+            RECALCULAR_DIA_SQL.format(
+                where_clause="r.id_sensor = %s AND r.id_variable = %s AND r.periodo >= %s AND r.periodo < %s"
+            ),
+            (id_sensor, id_variable, dia, dia + timedelta(days=1))
+        )
+
+
+def recalcular_resumenes_filas(cursor, filas):
+    """
+    Recalcula las horas y días de las filas de `datos` (id_sensor, valor,
+    fecha, id_variable, ...) después de modificarlas o eliminarlas fuera de
+    la ingesta. No hace nada si RESUMENES no está activo.
+    """
+    if not RESUMENES or not filas:
+        return
+    recalcular_resumenes(cursor, sorted(_resumir(filas, 13)))
+
+
+def tabla_resumen(segundos):
+    """
+    Tabla de resumen cuyos periodos caben enteros en cubetas de `segundos`
+    (la de periodo más largo), o None si no hay o RESUMENES no está activo.
+    """
+    if not RESUMENES:
+        return None
+    candidatas = [(largo, tabla) for tabla, (_, largo) in TABLAS_RESUMEN.items() if segundos % largo == 0]
+    return max(candidatas)[1] if candidatas else None
+
+
+def partir_periodos(inicio, fin, largo):
+    """
+    Divide [inicio, fin] en periodos completos de `largo` segundos, que se leen
+    del resumen, y tramos incompletos en los extremos, que se leen de `datos`.
+    Retorna ((desde, hasta) o None, tramos): los periodos completos son los
+    que empiezan en desde <= periodo < hasta.
+    """
+    epoca = datetime(1970, 1, 1)
+    paso = timedelta(seconds=largo)
+    desde = epoca + paso * -(-(inicio - epoca) // paso)
+    # Periodos que terminan dentro del rango (fin es inclusive, con resolución de segundos)
+    hasta = epoca + paso * ((fin + timedelta(seconds=1) - epoca) // paso)
+    if desde >= hasta:
+        return None, [(inicio, fin)]
+    tramos = []
+    if inicio < desde:
+        tramos.append((inicio, desde - timedelta(seconds=1)))
+    if hasta <= fin:
+        tramos.append((hasta, fin))
+    return (desde, hasta), tramos
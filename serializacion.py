@@ -0,0 +1,125 @@
+from dotenv import load_dotenv
+
+import decimal
+import os
+import time
+from datetime import datetime, date
+
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Opcional: sin orjson se usa el módulo json de la biblioteca estándar
+    orjson = None
+
+
+load_dotenv()
+
+# Filas que se leen del cursor por cada fetchmany en las respuestas en streaming
+STREAM_FILAS = int(os.getenv("STREAM_FILAS", 1000))
+
+_MARCA_FILAS = "__filas_stream__"
+
+
+def valor_json(valor):
+    """Valor de una columna de mysql.connector listo para JSON, como en los listados."""
+    if isinstance(valor, decimal.Decimal):
+        return float(valor)
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, (bytes, bytearray)):
+        return valor.decode("utf-8")
+    return valor
+
+
+class ProveedorJSON(DefaultJSONProvider):
+    """
+    Proveedor JSON de la app (jsonify, request.get_json y blueprints).
+
+    Serializa Decimal como número y datetime/date en ISO 8601, igual que los
+    listados, así las filas del cursor se pueden entregar sin convertirlas
+    celda por celda. Usa orjson si está instalado (USAR_ORJSON=0 lo desactiva).
+    """
+
+    usar_orjson = orjson is not None and os.getenv("USAR_ORJSON", "1") not in ("0", "false", "False")
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, (decimal.Decimal, datetime, date, bytes, bytearray)):
+            return valor_json(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if not self.usar_orjson:
+            return super().dumps(obj, **kwargs)
+        # orjson siempre es compacto y no escapa caracteres no ASCII
+        opciones = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if kwargs.get("sort_keys", self.sort_keys):
+            opciones |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            opciones |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=opciones).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if not self.usar_orjson or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def filas_cursor(cursor, tamano=None):
+    """
+    Itera las filas del cursor como dicts de columnas, leyéndolas de a
+    `tamano` (STREAM_FILAS por defecto) con fetchmany.
+    """
+    tamano = tamano or STREAM_FILAS
+    nombres = cursor.column_names
+    while True:
+        lote = cursor.fetchmany(tamano)
+        if not lote:
+            return
+        for fila in lote:
+            yield {nombre: valor_json(valor) for nombre, valor in zip(nombres, fila)}
+
+
+def stream_json(filas, data, al_terminar=None):
+    """
+    Genera la respuesta {"status": "success", "data": {..., "tableData": [...]}}
+    por fragmentos: `data` son las demás claves de data y `filas` un iterable de
+    dicts que se serializan a medida que se consumen. Usa el proveedor JSON de
+    la app, así el envoltorio es el mismo que el de jsonify.
+
+    `al_terminar` se llama siempre al final (también si el cliente corta la
+    conexión), para devolver la conexión al pool. Un error a mitad de la
+    respuesta ya no puede cambiar el código HTTP: se registra y se corta el JSON.
+    """
+    proveedor = current_app.json
+    # Los mismos separadores que jsonify (compactos salvo en modo debug)
+    if (proveedor.compact is None and current_app.debug) or proveedor.compact is False:
+        separadores = (", ", ": ")
+    else:
+        separadores = (",", ":")
+
+    def dumps(obj):
+        return proveedor.dumps(obj, separators=separadores)
+
+    envoltorio = dumps({"status": "success", "data": dict(data, tableData=_MARCA_FILAS)})
+    inicio, fin = envoltorio.split(dumps(_MARCA_FILAS), 1)
+    try:
+        # Un fragmento por cada STREAM_FILAS filas: cada yield es una escritura al socket
+        yield inicio + "["
+        separador = ""
+        partes = []
+        for fila in filas:
+            partes.append(dumps(fila))
+            if len(partes) >= STREAM_FILAS:
+                yield separador + ",".join(partes)
+                separador, partes = ",", []
+        if partes:
+            yield separador + ",".join(partes)
+        yield "]" + fin + "\n"
+    except Exception as e:
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: Error en respuesta JSON en streaming: {e}")
+    finally:
+        if al_terminar is not None:
+            al_terminar()
@@ -0,0 +1,422 @@
+from flask import Blueprint, request, jsonify
+import mysql.connector
+from datetime import datetime, timedelta
+import os
+
+import numpy as np
+
+from db import get_connection
+from reduccion import METODOS, a_fechas, a_microsegundos, reductor
+from resumenes import TABLAS_RESUMEN, VALOR_NUMERICO_RAPIDO_SQL, partir_periodos, tabla_resumen
+from serializacion import STREAM_FILAS
+from topologia import topologia
+
+
+serie_agregada_bp = Blueprint('serie_agregada', __name__)
+
+# Tamaño de cubeta aceptado -> segundos
+INTERVALOS = {
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '1h': 3600,
+    '6h': 21600,
+    '1d': 86400,
+}
+
+# Máximo de cubetas por serie: con más, se pide un intervalo mayor
+SERIE_MAX_CUBETAS = int(os.getenv("SERIE_MAX_CUBETAS", 20000))
+# Máximo de puntos por serie que se puede pedir con `puntos`
+SERIE_MAX_PUNTOS = int(os.getenv("SERIE_MAX_PUNTOS", 20000))
+
+_EPOCA = datetime(1970, 1, 1)
+
+# Las cubetas se cuentan desde 1970-01-01 sobre la fecha tal como está guardada
+# (TIMESTAMPDIFF, no UNIX_TIMESTAMP), así las de 1d coinciden con los días de `fecha`
+# sin depender de la zona horaria de la sesión. d.valor + 0e0 agrega como número
+# aunque la columna sea texto; los valores no numéricos se excluyen con
+# VALOR_NUMERICO_RAPIDO_SQL (ver resumenes.py). Se entrega la suma (no el promedio) para poder
+# combinar la cubeta con la misma cubeta leída de los resúmenes.
+SERIE_SQL = """
+    SELECT
+        disp.codigo_interno,
+        sens.id_sensor_tipo,
+        d.id_variable,
+        MAX(CONCAT(st.modelo, ' [', v.descripcion, ' (', v.unidad, ')]')) AS unidad_medida,
+        FLOOR(TIMESTAMPDIFF(SECOND, '1970-01-01', d.fecha) / %s) AS cubeta,
+        SUM(d.valor + 0e0) AS suma,
+        MIN(d.valor + 0e0) AS minimo,
+        MAX(d.valor + 0e0) AS maximo,
+        COUNT(d.valor) AS cantidad,
+        MAX(d.fecha) AS fecha_ultimo,
+        SUBSTRING_INDEX(GROUP_CONCAT(d.valor ORDER BY d.fecha DESC, d.id_dato DESC SEPARATOR ';'), ';', 1) AS ultimo
+    FROM
+        sensores_dev.datos AS d
+    JOIN
+        sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
+    JOIN
+        sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
+    JOIN
+        sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
+    LEFT JOIN
+        sensores_dev.sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
+    LEFT JOIN
+        sensores_dev.variables AS v ON d.id_variable = v.id_variable
+    {where_clause} AND """ + VALOR_NUMERICO_RAPIDO_SQL + """
+    GROUP BY disp.codigo_interno, sens.id_sensor_tipo, d.id_variable, cubeta
+"""
+
+# Las mismas columnas desde resumen_hora o resumen_dia (RESUMENES=1): cada periodo
+# del resumen cae entero en una cubeta porque el intervalo es múltiplo de su largo
+SERIE_RESUMEN_SQL = """
+    SELECT
+        disp.codigo_interno,
+        sens.id_sensor_tipo,
+        d.id_variable,
+        MAX(CONCAT(st.modelo, ' [', v.descripcion, ' (', v.unidad, ')]')) AS unidad_medida,
+        FLOOR(TIMESTAMPDIFF(SECOND, '1970-01-01', d.periodo) / %s) AS cubeta,
+        SUM(d.suma) AS suma,
+        MIN(d.minimo) AS minimo,
+        MAX(d.maximo) AS maximo,
+        SUM(d.mediciones) AS cantidad,
+        MAX(d.fecha_ultimo) AS fecha_ultimo,
+        SUBSTRING_INDEX(GROUP_CONCAT(d.ultimo ORDER BY d.fecha_ultimo DESC SEPARATOR ';'), ';', 1) AS ultimo
+    FROM
+        sensores_dev.{tabla} AS d
+    JOIN
+        sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
+    JOIN
+        sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
+    JOIN
+        sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
+    LEFT JOIN
+        sensores_dev.sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
+    LEFT JOIN
+        sensores_dev.variables AS v ON d.id_variable = v.id_variable
+    {where_clause}
+    GROUP BY disp.codigo_interno, sens.id_sensor_tipo, d.id_variable, cubeta
+"""
+
+# Mediciones sin agregar para la reducción visual, en orden de fecha: LTTB decide
+# cada cubeta cuando se cierra y necesita las filas ordenadas. Con el join MySQL
+# suele ordenar el rango completo (filesort) antes de entregar la primera fila;
+# la memoria de la API no depende del rango, pero el tiempo del primer lote sí.
+MEDICIONES_SQL = """
+    SELECT
+        disp.codigo_interno,
+        sens.id_sensor_tipo,
+        d.id_variable,
+        d.id_sensor,
+        d.fecha,
+        d.valor + 0e0
+    FROM
+        sensores_dev.datos AS d
+    JOIN
+        sensores_dev.sensores AS sens ON d.id_sensor = sens.id_sensor
+    JOIN
+        sensores_dev.sensores_en_dispositivo AS sed ON sens.id_sensor = sed.id_sensor
+    JOIN
+        sensores_dev.dispositivos AS disp ON sed.id_dispositivo = disp.id_dispositivo
+    {where_clause} AND """ + VALOR_NUMERICO_RAPIDO_SQL + """
+    ORDER BY d.fecha, d.id_dato
+"""
+
+
+def _fecha(texto, nombre):
+    try:
+        return datetime.fromisoformat(texto.strip())
+    except ValueError:
+        raise ValueError(f"'{nombre}' inválida: {texto!r} (use 'YYYY-MM-DD' o 'YYYY-MM-DD HH:MM:SS')")
+
+
+def _numero(valor):
+    if valor is None:
+        return None
+    if isinstance(valor, (bytes, bytearray)):
+        valor = valor.decode("utf-8")
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _filtros(fecha_inicio, fecha_fin, codigos=None, id_proyecto=None, variables=None, columna_fecha="d.fecha", hasta_exclusivo=False):
+    where_clauses = [f"({columna_fecha} >= %s)", f"({columna_fecha} {'<' if hasta_exclusivo else '<='} %s)"]
+    params = [fecha_inicio, fecha_fin]
+    if codigos:
+        where_clauses.append(f"(disp.codigo_interno IN ({','.join(['%s'] * len(codigos))}))")
+        params.extend(codigos)
+    if id_proyecto:
+        where_clauses.append(f"(disp.id_proyecto IN ({','.join(['%s'] * len(id_proyecto))}))")
+        params.extend(id_proyecto)
+    if variables:
+        where_clauses.append(f"(d.id_variable IN ({','.join(['%s'] * len(variables))}))")
+        params.extend(variables)
+    return f"WHERE {' AND '.join(where_clauses)}", params
+
+
+def _acumular(cubetas, filas):
+    """Combina filas de SERIE_SQL / SERIE_RESUMEN_SQL en `cubetas` por (dispositivo, tipo, variable, cubeta)."""
+    for codigo, id_sensor_tipo, id_variable, unidad_medida, cubeta, suma, minimo, maximo, cantidad, fecha_ultimo, ultimo in filas:
+        clave = (codigo, id_sensor_tipo, id_variable, int(cubeta))
+        suma, minimo, maximo, ultimo = _numero(suma), _numero(minimo), _numero(maximo), _numero(ultimo)
+        actual = cubetas.get(clave)
+        if actual is None:
+            cubetas[clave] = [unidad_medida, suma, minimo, maximo, int(cantidad), fecha_ultimo, ultimo]
+            continue
+        actual[0] = actual[0] or unidad_medida
+        actual[1] = suma if actual[1] is None else actual[1] + (suma or 0)
+        actual[2] = minimo if actual[2] is None else min(actual[2], minimo if minimo is not None else actual[2])
+        actual[3] = maximo if actual[3] is None else max(actual[3], maximo if maximo is not None else actual[3])
+        actual[4] += int(cantidad)
+        if fecha_ultimo is not None and (actual[5] is None or fecha_ultimo > actual[5]):
+            actual[5], actual[6] = fecha_ultimo, ultimo
+
+
+def consultar_serie(cursor, segundos, fecha_inicio, fecha_fin, codigos=None, id_proyecto=None, variables=None):
+    """
+    Agregados por cubeta de `segundos` para cada (dispositivo, tipo de sensor,
+    variable) en [fecha_inicio, fecha_fin]. Retorna la lista de series, cada
+    una con sus puntos ordenados por fecha.
+
+    Con RESUMENES=1 y un intervalo múltiplo de una hora los periodos completos
+    se leen de resumen_hora o resumen_dia y solo los extremos incompletos del
+    rango se agregan desde `datos`.
+    """
+    tramos = [(fecha_inicio, fecha_fin)]
+    cubetas = {}
+    tabla = tabla_resumen(segundos)
+    if tabla is not None:
+        periodos, tramos = partir_periodos(fecha_inicio, fecha_fin, TABLAS_RESUMEN[tabla][1])
+        if periodos is not None:
+            where_clause, params = _filtros(*periodos, codigos, id_proyecto, variables, columna_fecha="d.periodo", hasta_exclusivo=True)
+            cursor.execute(SERIE_RESUMEN_SQL.format(tabla=tabla, where_clause=where_clause), [segundos] + params)
+            _acumular(cubetas, cursor.fetchall())
+
+    for desde, hasta in tramos:
+        where_clause, params = _filtros(desde, hasta, codigos, id_proyecto, variables)
+        cursor.execute(SERIE_SQL.format(where_clause=where_clause), [segundos] + params)
+        _acumular(cubetas, cursor.fetchall())
+
+    series = []
+    actual = None
+    orden = sorted(cubetas.items(), key=lambda c: (str(c[0][0]), c[0][1] or 0, c[0][2] or 0, c[0][3]))
+    for (codigo, id_sensor_tipo, id_variable, cubeta), (unidad_medida, suma, minimo, maximo, cantidad, _, ultimo) in orden:
+        clave = (codigo, id_sensor_tipo, id_variable)
+        if actual is None or actual["clave"] != clave:
+            actual = {
+                "clave": clave,
+                "codigo_interno": codigo,
+                "id_sensor_tipo": id_sensor_tipo,
+                "id_variable": id_variable,
+                "unidad_medida": unidad_medida,
+                "puntos": [],
+            }
+            series.append(actual)
+        actual["puntos"].append({
+            "fecha": _EPOCA + timedelta(seconds=cubeta * segundos),
+            "avg": suma / cantidad if suma is not None and cantidad else None,
+            "min": minimo,
+            "max": maximo,
+            "count": cantidad,
+            "last": ultimo,
+        })
+    for serie in series:
+        del serie["clave"]
+    return series
+
+
+def reducir_serie(cursor, puntos, metodo, fecha_inicio, fecha_fin, codigos=None, id_proyecto=None, variables=None):
+    """
+    Cada (dispositivo, tipo de sensor, variable) en [fecha_inicio, fecha_fin]
+    reducida a lo más `puntos` mediciones con LTTB o mínimo/máximo por cubeta
+    (ver reduccion.py). Las filas se leen de a STREAM_FILAS y se reducen por
+    lotes, así la memoria no depende del largo del rango.
+    """
+    where_clause, params = _filtros(fecha_inicio, fecha_fin, codigos, id_proyecto, variables)
+    cursor.execute(MEDICIONES_SQL.format(where_clause=where_clause), params)
+
+    inicio, fin = a_microsegundos([fecha_inicio, fecha_fin])
+    series = {}
+    reductores = []
+    while True:
+        lote = cursor.fetchmany(STREAM_FILAS)
+        if not lote:
+            break
+        codigos_lote, tipos, id_variables, id_sensores, fechas, valores = zip(*lote)
+        claves = np.empty(len(lote), dtype=np.int64)
+        for i, clave in enumerate(zip(codigos_lote, tipos, id_variables)):
+            indice = series.get(clave)
+            if indice is None:
+                indice = series[clave] = len(reductores)
+                reductores.append((clave, id_sensores[i], reductor(metodo, inicio, fin, puntos)))
+            claves[i] = indice
+        t = a_microsegundos(fechas)
+        v = np.array(valores, dtype=np.float64)
+
+        # Las filas de cada serie, en el orden de fecha en que llegaron
+        orden = np.argsort(claves, kind="stable")
+        claves, t, v = claves[orden], t[orden], v[orden]
+        limites = np.flatnonzero(np.r_[True, claves[1:] != claves[:-1], True])
+        for desde, hasta in zip(limites[:-1], limites[1:]):
+            reductores[claves[desde]][2].agregar(t[desde:hasta], v[desde:hasta])
+
+    # Con el cursor ya leído: si la topología se recarga, usa esta misma conexión
+    resultado = []
+    for (codigo, id_sensor_tipo, id_variable), id_sensor, r in sorted(reductores, key=lambda s: (str(s[0][0]), s[0][1] or 0, s[0][2] or 0)):
+        t, v = r.terminar()
+        resultado.append({
+            "codigo_interno": codigo,
+            "id_sensor_tipo": id_sensor_tipo,
+            "id_variable": id_variable,
+            "unidad_medida": topologia.unidad_medida(id_sensor, id_variable, cursor),
+            "puntos": [{"fecha": fecha, "valor": valor} for fecha, valor in zip(a_fechas(t), v.tolist())],
+        })
+    return resultado
+
+
+@serie_agregada_bp.route('/serieAgregada', methods=['GET'])
+def serie_agregada():
+    """
+    Serie de mediciones agregada por intervalos de tiempo (promedio, mínimo, máximo, cantidad y último valor).
+    ---
+    tags:
+      - Datos
+    parameters:
+      - name: disp.codigo_interno
+        in: query
+        type: string
+        required: false
+        description: Código interno del dispositivo (o varios separados por coma). Se requiere este o disp.id_proyecto.
+      - name: disp.id_proyecto
+        in: query
+        type: string
+        required: false
+        description: Proyecto cuyos dispositivos se agregan (o varios separados por coma).
+      - name: fecha_inicio
+        in: query
+        type: string
+        required: true
+        description: Inicio del rango, "YYYY-MM-DD" o "YYYY-MM-DD HH:MM:SS".
+      - name: fecha_fin
+        in: query
+        type: string
+        required: false
+        description: Fin del rango (inclusive). Predeterminado a la hora actual.
+      - name: intervalo
+        in: query
+        type: string
+        required: false
+        description: Tamaño de cada cubeta, '1m', '5m', '15m', '1h', '6h' o '1d'. Predeterminado a '1h'.
+      - name: id_variable
+        in: query
+        type: string
+        required: false
+        description: Variables a incluir (separadas por coma). Todas si no se especifica.
+      - name: puntos
+        in: query
+        type: integer
+        required: false
+        description: >
+          Si se indica, en lugar de agregados por intervalo cada serie se reduce a lo más este número de
+          mediciones reales (puntos con fecha y valor) que conservan la forma de la curva, para graficar.
+          Se ignora 'intervalo'.
+      - name: reduccion
+        in: query
+        type: string
+        required: false
+        description: Método de reducción con 'puntos', 'lttb' (Largest-Triangle-Three-Buckets) o 'minmax' (mínimo y máximo por cubeta). Predeterminado a 'lttb'.
+    responses:
+      200:
+        description: Una serie por dispositivo, tipo de sensor y variable, con un punto por cubeta con datos (con `puntos`, mediciones con fecha y valor).
+        schema:
+          type: object
+          properties:
+            status:
+              type: string
+              example: success
+            data:
+              type: object
+              properties:
+                intervalo:
+                  type: string
+                  example: 5m
+                series:
+                  type: array
+                  items:
+                    type: object
+                    example: {"codigo_interno": "AGUA-01", "id_sensor_tipo": 3, "id_variable": 4, "unidad_medida": "DS18B20 [Grados celcius (°C)]", "puntos": [{"fecha": "2024-01-01T10:05:00", "avg": 20.9, "min": 20.8, "max": 21.0, "count": 5, "last": 21.0}]}
+      400:
+        description: Parámetros inválidos o demasiadas cubetas para el rango.
+      500:
+        description: Error en la base de datos.
+    """
+    args = request.args
+    codigos = [c for c in args.get('disp.codigo_interno', '').split(',') if c.strip()]
+    id_proyecto = [p for p in args.get('disp.id_proyecto', '').split(',') if p.strip()]
+    variables = [v for v in args.get('id_variable', '').split(',') if v.strip()]
+    intervalo = args.get('intervalo', '1h')
+    metodo = args.get('reduccion', 'lttb')
+
+    if not codigos and not id_proyecto:
+        return jsonify({'status': 'fail', 'error': "Debe indicar 'disp.codigo_interno' o 'disp.id_proyecto'"}), 400
+
+    puntos = None
+    if args.get('puntos'):
+        try:
+            puntos = int(args['puntos'])
+        except ValueError:
+            puntos = 0
+        if not 3 <= puntos <= SERIE_MAX_PUNTOS:
+            return jsonify({'status': 'fail', 'error': f"'puntos' debe ser un entero entre 3 y {SERIE_MAX_PUNTOS}"}), 400
+        if metodo not in METODOS:
+            return jsonify({'status': 'fail', 'error': f"Reducción '{metodo}' no soportada. Use {', '.join(METODOS)}."}), 400
+    elif intervalo not in INTERVALOS:
+        return jsonify({'status': 'fail', 'error': f"Intervalo '{intervalo}' no soportado. Use {', '.join(INTERVALOS)}."}), 400
+    if not args.get('fecha_inicio'):
+        return jsonify({'status': 'fail', 'error': "Debe indicar 'fecha_inicio'"}), 400
+
+    try:
+        fecha_inicio = _fecha(args['fecha_inicio'], 'fecha_inicio')
+        fecha_fin = _fecha(args['fecha_fin'], 'fecha_fin') if args.get('fecha_fin') else datetime.now()
+    except ValueError as e:
+        return jsonify({'status': 'fail', 'error': str(e)}), 400
+
+    if fecha_inicio > fecha_fin:
+        return jsonify({'status': 'fail', 'error': "'fecha_inicio' es posterior a 'fecha_fin'"}), 400
+
+    segundos = INTERVALOS.get(intervalo)
+    cubetas = (fecha_fin - fecha_inicio).total_seconds() / segundos if puntos is None else 0
+    if cubetas > SERIE_MAX_CUBETAS:
+        return jsonify({
+            'status': 'fail',
+            'error': f"El rango tiene {int(cubetas)} cubetas de {intervalo} (máximo {SERIE_MAX_CUBETAS}). Use un intervalo mayor."
+        }), 400
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        if puntos is not None:
+            series = reducir_serie(cursor, puntos, metodo, fecha_inicio, fecha_fin, codigos, id_proyecto, variables)
+            data = {'reduccion': metodo, 'puntos': puntos}
+        else:
+            series = consultar_serie(cursor, segundos, fecha_inicio, fecha_fin, codigos, id_proyecto, variables)
+            data = {'intervalo': intervalo}
+        data.update({
+            'fecha_inicio': fecha_inicio,
+            'fecha_fin': fecha_fin,
+            'series': series,
+        })
+        return jsonify({'status': 'success', 'data': data}), 200, {'Access-Control-Allow-Origin': '*'}
+
+    except mysql.connector.Error as e:
+        mensaje_error = f"Error al conectarse a la base de datos {e}"
+        print(mensaje_error)
+        return jsonify({'status': 'fail', 'error': mensaje_error}), 500
+
+    finally:
+        if conn is not None and conn.is_connected():
+            cursor.close()
+            conn.close()
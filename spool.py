@@ -0,0 +1,467 @@
+from dotenv import load_dotenv
+
+import atexit
+import glob
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+from db import error_transitorio, get_connection
+from mediciones import insertar_aislando, insertar_datos
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo proceso, sin bloqueo entre workers
+    fcntl = None
+
+
+load_dotenv()
+
+# Spool local: las mediciones aceptadas se escriben primero a disco y un hilo las reproduce en `datos`
+SPOOL_HABILITADO = os.getenv("SPOOL_HABILITADO", "0") in ("1", "true", "True")
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+SPOOL_SEGMENTO_BYTES = int(os.getenv("SPOOL_SEGMENTO_BYTES", 16 * 1024 * 1024))  # Rotar el segmento al llegar a este tamaño...
+SPOOL_SEGMENTO_MS = int(os.getenv("SPOOL_SEGMENTO_MS", 1000))                    # ...o al tener esta antigüedad
+SPOOL_FSYNC_MS = int(os.getenv("SPOOL_FSYNC_MS", 10))          # Ventana para agrupar escrituras en un solo fsync
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+SPOOL_LOTE_REPLAY = int(os.getenv("SPOOL_LOTE_REPLAY", 5000))  # Filas por transacción al reproducir
+
+# Cada registro: largo (uint32) + crc32 (uint32) + JSON con la lista de filas
+CABECERA = struct.Struct("<II")
+
+
+class SpoolLlenoError(Exception):
+    """El spool superó SPOOL_MAX_BYTES."""
+
+
+def _bloquear(f):
+    """Intenta tomar el bloqueo exclusivo de un archivo sin esperar."""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _creacion(ruta):
+    """Instante de creación (epoch en ms) codificado en el nombre del segmento."""
+    try:
+        return int(os.path.basename(ruta).split("-")[0]) / 1000.0
+    except ValueError:
+        return os.path.getmtime(ruta)
+
+
+def _leer_posicion(ruta):
+    try:
+        with open(ruta + ".pos") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def _guardar_posicion(ruta, posicion):
+    tmp = ruta + ".pos.tmp"
+    with open(tmp, "w") as f:
+        f.write(str(posicion))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, ruta + ".pos")
+
+
+def leer_registros(f, posicion):
+    """
+    Lee registros desde `posicion` hasta el final o hasta el primer registro
+    truncado o con checksum inválido.
+
+    Genera tuplas (filas, posicion_siguiente).
+    """
+    f.seek(posicion)
+    while True:
+        cabecera = f.read(CABECERA.size)
+        if len(cabecera) < CABECERA.size:
+            return
+        largo, crc = CABECERA.unpack(cabecera)
+        payload = f.read(largo)
+        if len(payload) < largo or zlib.crc32(payload) != crc:
+            return
+        posicion += CABECERA.size + largo
+        yield [tuple(fila) for fila in json.loads(payload)], posicion
+
+
+class Spool:
+    """
+    Registro append-only en disco (WAL) para las mediciones aceptadas.
+
+    Cada proceso escribe su propio segmento activo (`<creacion_ms>-<pid>-<n>.wal`);
+    las escrituras concurrentes se agrupan en un solo fsync y `escribir` retorna
+    cuando las filas ya están en disco. El segmento se sella (`.seg`) al superar
+    SPOOL_SEGMENTO_BYTES o SPOOL_SEGMENTO_MS. Un hilo de reproducción toma los
+    segmentos sellados de cualquier proceso (con flock), los inserta en `datos`
+    en lotes y guarda en `<segmento>.pos` hasta dónde quedó confirmado. La
+    entrega es al menos una vez: una caída entre el commit de un lote y el
+    guardado de la posición repite ese lote (sin duplicados solo con
+    DEDUP_DATOS=1).
+
+    Si falla un fsync, las escrituras que esperaban ese fsync reciben OSError
+    y el segmento se recorta al último tamaño sincronizado antes de sellarlo:
+    esas filas no se reproducen (quien escribió puede insertarlas por otra vía).
+
+    Si la base no está disponible el segmento se reintenta con espera
+    exponencial. Las filas que la base rechaza por sus datos se separan del
+    lote (insertar_aislando) y quedan en `<segmento>.rechazado`, con el mismo
+    formato de registros, para revisarlas y volver a cargarlas renombrándolo
+    a `.seg`; el resto del segmento sigue reproduciéndose.
+    """
+
+    def __init__(self, directorio=SPOOL_DIR):
+        self.directorio = directorio
+        self.pid = os.getpid()
+        os.makedirs(directorio, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._archivo = None
+        self._ruta = None
+        self._creado = 0.0
+        self._tamano = 0
+        self._tamano_sincronizado = 0  # Bytes del segmento activo con fsync
+        self._escrito = 0       # Registros escritos (secuencia)
+        self._sincronizado = 0  # Registros con fsync
+        self._fallidos_hasta = 0  # Registros cuyo fsync falló
+        self._n = 0
+        self._detener = False
+        self._espera_replay = threading.Event()
+        self._pendientes_cache = (0.0, 0)  # (instante, bytes) para no recorrer el directorio en cada escritura
+        self._metricas = {
+            "escritas": 0,
+            "reproducidas": 0,
+            "fsyncs": 0,
+            "segmentos_sellados": 0,
+            "segmentos_reproducidos": 0,
+            "corruptos": 0,
+            "rechazadas": 0,
+            "errores": 0,
+        }
+
+        self._sellar_huerfanos()
+        self._hilo_fsync = threading.Thread(target=self._loop_fsync, name="spool-fsync", daemon=True)
+        self._hilo_replay = threading.Thread(target=self._loop_replay, name="spool-replay", daemon=True)
+        self._hilo_fsync.start()
+        self._hilo_replay.start()
+
+    # Escritura
+
+    def _sellar_huerfanos(self):
+        """Sella los segmentos activos de procesos que ya no existen."""
+        for ruta in glob.glob(os.path.join(self.directorio, "*.wal")):
+            with open(ruta, "rb") as f:
+                if not _bloquear(f):
+                    continue  # Otro worker lo está escribiendo
+                if os.path.getsize(ruta) == 0:
+                    os.remove(ruta)
+                else:
+                    os.replace(ruta, ruta[:-4] + ".seg")
+
+    def _abrir_segmento(self):
+        self._n += 1
+        self._creado = time.time()
+        self._ruta = os.path.join(self.directorio, f"{int(self._creado * 1000):013d}-{self.pid}-{self._n:06d}.wal")
+        self._archivo = open(self._ruta, "ab")
+        _bloquear(self._archivo)
+        self._tamano = 0
+        self._tamano_sincronizado = 0
+
+    def _sellar(self):
+        """Cierra el segmento activo (ya sincronizado) y lo deja disponible para reproducir."""
+        if self._archivo is None:
+            return
+        self._archivo.close()
+        if self._tamano:
+            os.replace(self._ruta, self._ruta[:-4] + ".seg")
+            self._metricas["segmentos_sellados"] += 1
+            self._espera_replay.set()
+        else:
+            os.remove(self._ruta)
+        self._archivo = None
+
+    def _descartar_no_sincronizado(self):
+        """
+        Tras un fsync fallido, recorta el segmento activo a lo último sincronizado
+        y lo sella. Si no se puede recortar queda como `.corrupto` (para revisión,
+        sin reproducirse): sus primeros `_tamano_sincronizado` bytes sí estaban
+        confirmados.
+        """
+        if self._archivo is None:
+            return
+        try:
+            self._archivo.close()
+        except OSError:
+            pass
+        try:
+            os.truncate(self._ruta, self._tamano_sincronizado)
+            with open(self._ruta, "rb+") as f:
+                os.fsync(f.fileno())
+        except OSError as e:
+            print(
+                f"{time.strftime('%Y-%m-%d %H:%M:%S')}: No se pudo recortar {self._ruta} "
+                f"({e}); queda como .corrupto con {self._tamano_sincronizado} bytes confirmados"
+            )
+            self._metricas["corruptos"] += 1
+            self._archivo = None
+            try:
+                os.replace(self._ruta, self._ruta[:-4] + ".seg.corrupto")
+            except OSError:
+                pass
+            return
+        self._tamano = self._tamano_sincronizado
+        if self._tamano:
+            os.replace(self._ruta, self._ruta[:-4] + ".seg")
+            self._metricas["segmentos_sellados"] += 1
+            self._espera_replay.set()
+        else:
+            os.remove(self._ruta)
+        self._archivo = None
+
+    def escribir(self, filas):
+        """
+        Agrega las filas al spool y espera a que estén en disco (fsync).
+        Lanza SpoolLlenoError si el spool superó SPOOL_MAX_BYTES y OSError si falla el disco.
+        """
+        payload = json.dumps(filas, separators=(",", ":")).encode("utf-8")
+        with self._cond:
+            if self._detener:
+                raise SpoolLlenoError("El spool se está cerrando")
+            if self._bytes_pendientes_cache() > SPOOL_MAX_BYTES:
+                raise SpoolLlenoError(f"Spool lleno (más de {SPOOL_MAX_BYTES} bytes pendientes)")
+            if self._archivo is None:
+                self._abrir_segmento()
+            self._archivo.write(CABECERA.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._tamano += CABECERA.size + len(payload)
+            self._escrito += 1
+            self._metricas["escritas"] += len(filas)
+            secuencia = self._escrito
+            self._cond.notify_all()
+            while self._sincronizado < secuencia:
+                if self._detener and not self._hilo_fsync.is_alive():
+                    raise OSError("El hilo de fsync del spool terminó")
+                self._cond.wait(1)
+            if secuencia <= self._fallidos_hasta:
+                raise OSError("No se pudo sincronizar el spool en disco")
+
+    def _loop_fsync(self):
+        while True:
+            with self._cond:
+                while self._sincronizado == self._escrito and not self._detener:
+                    # Sellar segmentos antiguos aunque no lleguen más escrituras
+                    if self._archivo is not None and time.time() - self._creado >= SPOOL_SEGMENTO_MS / 1000.0:
+                        self._sellar()
+                    self._cond.wait(SPOOL_SEGMENTO_MS / 1000.0)
+                if self._sincronizado == self._escrito and self._detener:
+                    self._sellar()
+                    return
+
+            # Ventana de agrupación: otras peticiones alcanzan a escribir en este fsync
+            time.sleep(SPOOL_FSYNC_MS / 1000.0)
+
+            with self._cond:
+                try:
+                    self._archivo.flush()
+                    os.fsync(self._archivo.fileno())
+                    self._metricas["fsyncs"] += 1
+                    self._sincronizado = self._escrito
+                    self._tamano_sincronizado = self._tamano
+                    if self._tamano >= SPOOL_SEGMENTO_BYTES or time.time() - self._creado >= SPOOL_SEGMENTO_MS / 1000.0:
+                        self._sellar()
+                except OSError as e:
+                    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: Error sincronizando el spool: {e}")
+                    self._metricas["errores"] += 1
+                    # Las escrituras pendientes fallan, se quitan del segmento (no se
+                    # reproducen) y se abre un segmento nuevo en la próxima
+                    self._fallidos_hasta = self._sincronizado = self._escrito
+                    try:
+                        self._descartar_no_sincronizado()
+                    except OSError:
+                        self._archivo = None
+                self._cond.notify_all()
+
+    # Reproducción
+
+    def _segmentos(self):
+        return sorted(glob.glob(os.path.join(self.directorio, "*.seg")))
+
+    def _reproducir(self, ruta):
+        """Inserta en `datos` los registros pendientes de un segmento sellado."""
+        try:
+            f = open(ruta, "rb")
+        except FileNotFoundError:
+            return  # Otro worker lo terminó
+        with f:
+            if not _bloquear(f) or not os.path.exists(ruta):
+                return
+
+            posicion = _leer_posicion(ruta)
+            lote = []
+            for filas, siguiente in leer_registros(f, posicion):
+                lote.extend(filas)
+                if len(lote) >= SPOOL_LOTE_REPLAY:
+                    self._insertar(ruta, lote)
+                    _guardar_posicion(ruta, siguiente)
+                    lote = []
+                posicion = siguiente
+            if lote:
+                self._insertar(ruta, lote)
+                _guardar_posicion(ruta, posicion)
+
+            if posicion < os.path.getsize(ruta):
+                # Registro truncado o corrupto (p. ej. caída a medio escribir): se conserva para revisión
+                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: Segmento {ruta} con datos inválidos desde el byte {posicion}")
+                self._metricas["corruptos"] += 1
+                os.replace(ruta, ruta + ".corrupto")
+            else:
+                os.remove(ruta)
+            if os.path.exists(ruta + ".pos"):
+                os.remove(ruta + ".pos")
+            self._metricas["segmentos_reproducidos"] += 1
+
+    def _insertar(self, ruta, filas):
+        """
+        Inserta un lote del segmento `ruta`. Los errores transitorios se
+        propagan (se reintenta el segmento); si la base rechaza el lote por
+        sus datos, las filas inválidas van a `<ruta>.rechazado`.
+        """
+        try:
+            rechazadas = self._transaccion(filas)
+        except Exception as e:
+            if error_transitorio(e):
+                raise
+            # Reintentar el lote completo daría el mismo error
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: Lote de {len(filas)} filas de {ruta} rechazado, se separan las filas inválidas: {e}")
+            self._metricas["errores"] += 1
+            try:
+                rechazadas = self._transaccion(filas, aislar=True)
+            except Exception as e:
+                if error_transitorio(e):
+                    raise
+                rechazadas = [(fila, e) for fila in filas]
+        if rechazadas:
+            self._rechazar(ruta, rechazadas)
+        self._metricas["reproducidas"] += len(filas) - len(rechazadas)
+
+    def _transaccion(self, filas, aislar=False):
+        """Inserta las filas en una transacción. Retorna las rechazadas [(fila, error), ...]."""
+        conn = None
+        cursor = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor()
+            rechazadas = []
+            if aislar:
+                _, rechazadas = insertar_aislando(cursor, filas)
+            else:
+                insertar_datos(cursor, filas)
+            conn.commit()
+            return rechazadas
+        finally:
+            if conn is not None and conn.is_connected():
+                cursor.close()
+                conn.close()
+
+    def _rechazar(self, ruta, rechazadas):
+        """Agrega las filas rechazadas a `<ruta>.rechazado` (un registro) y las anota en el log."""
+        for fila, error in rechazadas:
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: Fila rechazada de {ruta}: {fila!r}: {error}")
+        payload = json.dumps([fila for fila, _ in rechazadas], separators=(",", ":")).encode("utf-8")
+        with open(ruta + ".rechazado", "ab") as f:
+            f.write(CABECERA.pack(len(payload), zlib.crc32(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self._metricas["rechazadas"] += len(rechazadas)
+
+    def _loop_replay(self):
+        espera = 0.5
+        while True:
+            segmentos = self._segmentos()
+            if not segmentos:
+                if self._detener:
+                    return
+                self._espera_replay.wait(SPOOL_SEGMENTO_MS / 1000.0)
+                self._espera_replay.clear()
+                continue
+            try:
+                for ruta in segmentos:
+                    self._reproducir(ruta)
+                espera = 0.5
+            except Exception as e:
+                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: Error reproduciendo el spool: {e}")
+                self._metricas["errores"] += 1
+                if self._detener:
+                    return  # Los segmentos quedan en disco para el próximo arranque
+                time.sleep(espera)
+                espera = min(espera * 2, 30)
+
+    def detener(self, timeout=30):
+        """Sella el segmento activo y da un plazo al hilo de reproducción para vaciar el spool."""
+        with self._cond:
+            self._detener = True
+            self._cond.notify_all()
+        self._hilo_fsync.join(timeout)
+        self._espera_replay.set()
+        self._hilo_replay.join(timeout)
+
+    # Estado
+
+    def _bytes_pendientes_cache(self):
+        instante, total = self._pendientes_cache
+        if time.monotonic() - instante > 1:
+            total = self.bytes_pendientes()
+            self._pendientes_cache = (time.monotonic(), total)
+        return total
+
+    def bytes_pendientes(self):
+        total = 0
+        for ruta in glob.glob(os.path.join(self.directorio, "*.wal")) + self._segmentos():
+            try:
+                total += os.path.getsize(ruta) - _leer_posicion(ruta)
+            except OSError:
+                pass
+        return total
+
+    def estado(self):
+        segmentos = self._segmentos()
+        activos = glob.glob(os.path.join(self.directorio, "*.wal"))
+        pendientes = segmentos + activos
+        mas_antiguo = min((_creacion(r) for r in pendientes), default=None)
+        with self._cond:
+            m = dict(self._metricas)
+        m.update({
+            "directorio": self.directorio,
+            "segmentos_pendientes": len(segmentos),
+            "segmentos_activos": len(activos),
+            "bytes_pendientes": self.bytes_pendientes(),
+            "capacidad_bytes": SPOOL_MAX_BYTES,
+            "retraso_segundos": round(time.time() - mas_antiguo, 3) if mas_antiguo else 0,
+            "corruptos_en_disco": len(glob.glob(os.path.join(self.directorio, "*.corrupto"))),
+            "rechazados_en_disco": len(glob.glob(os.path.join(self.directorio, "*.rechazado"))),
+            "pid": self.pid,
+        })
+        return m
+
+
+_spool = None
+_spool_lock = threading.Lock()
+
+
+def get_spool():
+    """Spool del proceso actual (un segmento activo por worker de gunicorn)."""
+    global _spool
+    pid = os.getpid()
+    if _spool is None or _spool.pid != pid:
+        with _spool_lock:
+            if _spool is None or _spool.pid != pid:
+                _spool = Spool()
+                atexit.register(_spool.detener)
+    return _spool
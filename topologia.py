@@ -0,0 +1,294 @@
+from dotenv import load_dotenv
+
+import os
+import threading
+import time
+import unicodedata
+
+from db import get_connection
+
+
+load_dotenv()
+
+# Segundos que se reutiliza el mapa de dispositivos/sensores antes de recargarlo
+TOPOLOGIA_TTL = float(os.getenv("TOPOLOGIA_TTL", 300))
+# Separación mínima entre recargas provocadas por un código o sensor desconocido
+TOPOLOGIA_RECARGA_MIN = float(os.getenv("TOPOLOGIA_RECARGA_MIN", 5))
+
+# Tablas cuyo cambio invalida el mapa
+TABLAS_TOPOLOGIA = {"dispositivos", "sensores", "sensores_en_dispositivo", "sensores_tipo", "variables"}
+
+TOPOLOGIA_SQL = """
+    SELECT
+        disp.id_dispositivo,
+        disp.codigo_interno,
+        disp.id_proyecto,
+        disp.descripcion,
+        sens.id_sensor,
+        sens.id_sensor_tipo,
+        st.modelo
+    FROM dispositivos AS disp
+    LEFT JOIN sensores_en_dispositivo AS sed ON disp.id_dispositivo = sed.id_dispositivo
+    LEFT JOIN sensores AS sens ON sed.id_sensor = sens.id_sensor
+    LEFT JOIN sensores_tipo AS st ON sens.id_sensor_tipo = st.id_sensor_tipo
+    ORDER BY disp.id_dispositivo ASC, sens.id_sensor ASC
+"""
+
+VARIABLES_SQL = "SELECT id_variable, descripcion, unidad FROM variables"
+
+
+def _clave_parametro(unidad_medida):
+    """
+    Clave de comparación de la etiqueta "modelo [descripcion (unidad)]" como
+    utf8mb4_0900_ai_ci (intercalación predeterminada de MySQL 8): sin distinguir
+    mayúsculas ni acentos, y con los espacios finales significativos (NO PAD).
+    Es una aproximación (descomposición NFKD sin marcas diacríticas), no el
+    algoritmo de intercalación de Unicode completo.
+    """
+    texto = unicodedata.normalize("NFKD", str(unidad_medida))
+    return "".join(c for c in texto if not unicodedata.combining(c)).casefold()
+
+
+class Topologia:
+    """
+    Mapa en memoria de la topología de dispositivos, cargado con una sola consulta:
+
+      - codigo_interno -> [(id_dispositivo, id_proyecto), ...]
+      - (id_dispositivo, id_sensor_tipo) -> id_sensor
+      - id_sensor -> [id_dispositivo, ...] (conteos diarios de mediciones)
+      - unidad_medida -> [(id_sensor_tipo, id_variable), ...]: la dimensión de
+        parámetros, la etiqueta "modelo [descripcion (unidad)]" de los listados
+        y de las alertas, para filtrar `datos` por id en lugar de por CONCAT
+
+    Junto con los datos descriptivos que necesita la respuesta de ingesta
+    (descripción del dispositivo, modelo del sensor y descripción/unidad de
+    cada variable), que se leen en la misma recarga.
+
+    Se recarga al vencer TOPOLOGIA_TTL, al invalidarse (cambios hechos por la API
+    en las tablas de TABLAS_TOPOLOGIA) o cuando se consulta algo desconocido,
+    a lo más una vez cada TOPOLOGIA_RECARGA_MIN segundos.
+    El mapa es por proceso: en los demás workers los cambios se ven al vencer
+    el TTL o en la primera consulta que no encuentre el dato.
+
+    Quien consulta con una conexión ya prestada (la ingesta, las alertas)
+    entrega su `cursor`, y la recarga se lee con él: pedir otra conexión al
+    pool mientras se tiene `_lock` puede quedar esperando a conexiones cuyos
+    dueños esperan ese mismo lock.
+    """
+
+    def __init__(self, ttl=TOPOLOGIA_TTL, recarga_min=TOPOLOGIA_RECARGA_MIN):
+        self.ttl = ttl
+        self.recarga_min = recarga_min
+        self._lock = threading.Lock()
+        self._dispositivos = {}
+        self._sensores = {}
+        self._dispositivos_sensor = {}  # id_sensor -> [id_dispositivo, ...]
+        self._info_dispositivos = {}  # id_dispositivo -> {codigo_interno, id_proyecto, descripcion}
+        self._modelos = {}            # id_sensor -> modelo del tipo de sensor
+        self._variables = {}          # id_variable -> (descripcion, unidad)
+        self._sensores_dispositivo = {}  # id_dispositivo -> [(id_sensor, id_sensor_tipo), ...]
+        self._parametros = {}         # unidad_medida -> [(id_sensor_tipo, id_variable), ...]
+        self._cargado = None  # time.monotonic() de la última carga
+        self._metricas = {"cargas": 0, "aciertos": 0, "fallos": 0}
+
+    def _cargar(self, cursor=None):
+        if cursor is not None:
+            cursor.execute(TOPOLOGIA_SQL)
+            filas = cursor.fetchall()
+            cursor.execute(VARIABLES_SQL)
+            variables = cursor.fetchall()
+        else:
+            conn = None
+            try:
+                conn = get_connection()
+                cursor = conn.cursor()
+                cursor.execute(TOPOLOGIA_SQL)
+                filas = cursor.fetchall()
+                cursor.execute(VARIABLES_SQL)
+                variables = cursor.fetchall()
+            finally:
+                if conn is not None and conn.is_connected():
+                    cursor.close()
+                    conn.close()
+
+        dispositivos = {}
+        sensores = {}
+        dispositivos_sensor = {}
+        info_dispositivos = {}
+        modelos = {}
+        sensores_dispositivo = {}
+        modelos_tipo = {}
+        for id_dispositivo, codigo_interno, id_proyecto, descripcion, id_sensor, id_sensor_tipo, modelo in filas:
+            dispositivo = (str(id_dispositivo), str(id_proyecto) if id_proyecto is not None else None)
+            lista = dispositivos.setdefault(codigo_interno, [])
+            if dispositivo not in lista:
+                lista.append(dispositivo)
+            info_dispositivos[str(id_dispositivo)] = {
+                "codigo_interno": codigo_interno,
+                "id_proyecto": id_proyecto,
+                "descripcion": descripcion,
+            }
+            if id_sensor is not None:
+                # Igual que la consulta original: el primer sensor del tipo en el dispositivo
+                sensores.setdefault((str(id_dispositivo), str(id_sensor_tipo)), str(id_sensor))
+                ids = dispositivos_sensor.setdefault(str(id_sensor), [])
+                if str(id_dispositivo) not in ids:
+                    ids.append(str(id_dispositivo))
+                modelos[str(id_sensor)] = modelo
+                sensores_dispositivo.setdefault(str(id_dispositivo), []).append((str(id_sensor), str(id_sensor_tipo)))
+                if modelo is not None:
+                    modelos_tipo[str(id_sensor_tipo)] = modelo
+
+        # Igual que CONCAT: sin modelo, descripción o unidad no hay etiqueta
+        parametros = {}
+        for id_sensor_tipo, modelo in modelos_tipo.items():
+            for id_variable, descripcion, unidad in variables:
+                if descripcion is None or unidad is None:
+                    continue
+                etiqueta = _clave_parametro(f"{modelo} [{descripcion} ({unidad})]")
+                parametros.setdefault(etiqueta, []).append((id_sensor_tipo, str(id_variable)))
+
+        self._dispositivos = dispositivos
+        self._sensores = sensores
+        self._dispositivos_sensor = dispositivos_sensor
+        self._info_dispositivos = info_dispositivos
+        self._modelos = modelos
+        self._variables = {str(id_variable): (descripcion, unidad) for id_variable, descripcion, unidad in variables}
+        self._sensores_dispositivo = sensores_dispositivo
+        self._parametros = parametros
+        self._cargado = time.monotonic()
+        self._metricas["cargas"] += 1
+
+    def _vigente(self, cursor=None):
+        with self._lock:
+            if self._cargado is None or time.monotonic() - self._cargado > self.ttl:
+                try:
+                    self._cargar(cursor)
+                except Exception as e:
+                    if self._cargado is None:
+                        raise
+                    # Sin base de datos se sigue usando el mapa anterior y se reintenta más tarde
+                    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: No se pudo recargar la topología: {e}")
+                    self._cargado = time.monotonic() - self.ttl + self.recarga_min
+
+    def _recargar_por_fallo(self, cursor=None):
+        """Recarga si un dato no se encontró y la última carga no es muy reciente."""
+        with self._lock:
+            if self._cargado is None or time.monotonic() - self._cargado > self.recarga_min:
+                try:
+                    self._cargar(cursor)
+                except Exception as e:
+                    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: No se pudo recargar la topología: {e}")
+                    if self._cargado is not None:
+                        # Igual que en _vigente: se reintenta en TOPOLOGIA_RECARGA_MIN, no en un TTL completo
+                        self._cargado = time.monotonic() - self.ttl + self.recarga_min
+                    return False
+                return True
+        return False
+
+    def _buscar(self, mapa, clave, cursor=None):
+        self._vigente(cursor)
+        valor = getattr(self, mapa).get(clave)
+        if valor is None and self._recargar_por_fallo(cursor):
+            valor = getattr(self, mapa).get(clave)
+        self._metricas["aciertos" if valor is not None else "fallos"] += 1
+        return valor
+
+    def dispositivos(self, codigo_interno, cursor=None):
+        """Lista de (id_dispositivo, id_proyecto) como strings para el código interno."""
+        return self._buscar("_dispositivos", codigo_interno, cursor) or []
+
+    def sensor(self, id_dispositivo, id_sensor_tipo, cursor=None):
+        """id_sensor (string) del tipo indicado en el dispositivo, o None."""
+        return self._buscar("_sensores", (str(id_dispositivo).strip(), str(id_sensor_tipo).strip()), cursor)
+
+    def dispositivos_de_sensor(self, id_sensor, cursor=None):
+        """Lista de id_dispositivo (strings) a los que está asociado el sensor."""
+        return self._buscar("_dispositivos_sensor", str(id_sensor).strip(), cursor) or []
+
+    def info_dispositivo(self, id_dispositivo, cursor=None):
+        """Datos descriptivos del dispositivo (sin recargar si no existe), o None."""
+        self._vigente(cursor)
+        return self._info_dispositivos.get(str(id_dispositivo).strip())
+
+    def dispositivos_proyecto(self, id_proyecto, cursor=None):
+        """Lista de id_dispositivo (strings) del proyecto."""
+        self._vigente(cursor)
+        id_proyecto = str(id_proyecto).strip()
+        return [
+            id_dispositivo for id_dispositivo, info in self._info_dispositivos.items()
+            if info["id_proyecto"] is not None and str(info["id_proyecto"]) == id_proyecto
+        ]
+
+    def dispositivos_relacionados(self, ids_dispositivo, cursor=None):
+        """
+        Los dispositivos indicados más los que comparten algún sensor con ellos
+        (id_dispositivo como strings, ordenados).
+        """
+        self._vigente(cursor)
+        resultado = {str(i).strip() for i in ids_dispositivo}
+        for id_dispositivo in list(resultado):
+            for id_sensor, _ in self._sensores_dispositivo.get(id_dispositivo, []):
+                resultado.update(self._dispositivos_sensor.get(id_sensor, []))
+        return sorted(resultado)
+
+    def unidad_medida(self, id_sensor, id_variable, cursor=None):
+        """
+        Etiqueta de la columna en los listados estructurados:
+        "modelo [descripcion (unidad)]", o None si falta algún dato (igual que CONCAT con NULL).
+        """
+        self._vigente(cursor)
+        modelo = self._modelos.get(str(id_sensor).strip())
+        descripcion, unidad = self._variables.get(str(id_variable).strip(), (None, None))
+        if modelo is None or descripcion is None or unidad is None:
+            return None
+        return f"{modelo} [{descripcion} ({unidad})]"
+
+    def sensores_parametro(self, id_dispositivo, unidad_medida, cursor=None):
+        """
+        {id_variable: [id_sensor, ...]} (strings) de las mediciones del parámetro
+        `unidad_medida` ("modelo [descripcion (unidad)]") en el dispositivo: las
+        filas de `datos` con esos id_sensor e id_variable son las que cumplen
+        CONCAT(st.modelo, ...) = unidad_medida (comparadas con _clave_parametro).
+        Vacío si no hay ninguna, después de recargar el mapa por si el parámetro
+        o el sensor del dispositivo son nuevos.
+        """
+        resultado = self._sensores_parametro(id_dispositivo, unidad_medida, cursor)
+        if not resultado and self._recargar_por_fallo(cursor):
+            resultado = self._sensores_parametro(id_dispositivo, unidad_medida, cursor)
+        return resultado
+
+    def _sensores_parametro(self, id_dispositivo, unidad_medida, cursor=None):
+        pares = self._buscar("_parametros", _clave_parametro(unidad_medida), cursor) or []
+        sensores = self._sensores_dispositivo.get(str(id_dispositivo).strip(), [])
+        resultado = {}
+        for id_sensor_tipo, id_variable in pares:
+            for id_sensor, tipo in sensores:
+                if tipo == id_sensor_tipo:
+                    resultado.setdefault(id_variable, []).append(id_sensor)
+        return resultado
+
+    def invalidar(self):
+        """Fuerza la recarga en la próxima consulta (si falla, se sigue usando el mapa anterior)."""
+        with self._lock:
+            if self._cargado is not None:
+                self._cargado = time.monotonic() - self.ttl - 1
+
+    def metricas(self):
+        m = dict(self._metricas)
+        m.update({
+            "dispositivos": len(self._dispositivos),
+            "sensores": len(self._sensores),
+            "edad_segundos": round(time.monotonic() - self._cargado, 1) if self._cargado is not None else None,
+            "ttl": self.ttl,
+        })
+        return m
+
+
+topologia = Topologia()
+
+
+def invalidar_topologia(tabla):
+    """Invalida el mapa si la tabla modificada forma parte de la topología."""
+    if tabla in TABLAS_TOPOLOGIA:
+        topologia.invalidar()
@@ -0,0 +1,118 @@
+"""
+Formato binario compacto de ingesta (/insertarMedicionBinaria).
+
+Todos los enteros son little-endian:
+
+    offset  tipo            campo
+    0       2 bytes         magia b"CM"
+    2       uint8           versión (1)
+    3       uint8           L = largo del código interno
+    4       L bytes         código interno del dispositivo (UTF-8)
+    4+L     uint32          timestamp base (UNIXTIME, segundos)
+    8+L     uint16          V = número de variables
+    10+L    V x (uint16, uint16)
+                            (id_sensor_tipo, id_variable) de cada columna
+    ...     uint16          M = número de muestras
+    ...     M x uint16      segundos de cada muestra desde el timestamp base
+    ...     M x V float32   valores, muestra por muestra (NaN o infinito = sin valor)
+
+Ejemplo: 3 variables x 10 muestras ocupan 4 + L + 4 + 2 + 12 + 2 + 20 + 120
+bytes, contra ~400 bytes de la misma información en la query string.
+"""
+import struct
+
+import numpy as np
+
+
+MAGIA = b"CM"
+VERSION = 1
+
+_ENCABEZADO = struct.Struct("<2sBB")
+_U32 = struct.Struct("<I")
+_U16 = struct.Struct("<H")
+
+
+class TramaInvalidaError(ValueError):
+    """La trama binaria no respeta el formato."""
+
+
+class Trama:
+    """Trama decodificada: columnas (tipo, variable), instantes y matriz de valores."""
+
+    def __init__(self, codigo_interno, timestamp_base, columnas, deltas, valores):
+        self.codigo_interno = codigo_interno
+        self.timestamp_base = timestamp_base
+        self.columnas = columnas    # lista de (id_sensor_tipo, id_variable)
+        self.deltas = deltas        # np.ndarray uint16 (M,)
+        self.valores = valores      # np.ndarray float32 (M, V)
+
+    @property
+    def n_mediciones(self):
+        return self.valores.size
+
+
+def decodificar_trama(datos):
+    """Decodifica una trama; lanza TramaInvalidaError si está mal formada o truncada."""
+    datos = memoryview(datos)
+    try:
+        magia, version, largo = _ENCABEZADO.unpack_from(datos, 0)
+        if magia != MAGIA:
+            raise TramaInvalidaError("Magia inválida (se esperaba 'CM')")
+        if version != VERSION:
+            raise TramaInvalidaError(f"Versión de trama no soportada: {version}")
+        pos = _ENCABEZADO.size
+
+        codigo_interno = bytes(datos[pos:pos + largo]).decode("utf-8")
+        if len(codigo_interno.encode("utf-8")) != largo or not codigo_interno:
+            raise TramaInvalidaError("Código interno truncado o vacío")
+        pos += largo
+
+        (timestamp_base,) = _U32.unpack_from(datos, pos)
+        pos += _U32.size
+        (n_variables,) = _U16.unpack_from(datos, pos)
+        pos += _U16.size
+        columnas = np.frombuffer(datos, dtype="<u2", count=2 * n_variables, offset=pos).reshape(n_variables, 2)
+        pos += 4 * n_variables
+
+        (n_muestras,) = _U16.unpack_from(datos, pos)
+        pos += _U16.size
+        deltas = np.frombuffer(datos, dtype="<u2", count=n_muestras, offset=pos)
+        pos += 2 * n_muestras
+        valores = np.frombuffer(datos, dtype="<f4", count=n_muestras * n_variables, offset=pos)
+        pos += 4 * n_muestras * n_variables
+    except (struct.error, ValueError) as e:
+        if isinstance(e, TramaInvalidaError):
+            raise
+        raise TramaInvalidaError(f"Trama truncada: {e}")
+
+    if pos != len(datos):
+        raise TramaInvalidaError(f"La trama tiene {len(datos) - pos} bytes sobrantes")
+    if n_variables == 0 or n_muestras == 0:
+        raise TramaInvalidaError("La trama no trae mediciones")
+
+    return Trama(
+        codigo_interno,
+        timestamp_base,
+        [(int(tipo), int(variable)) for tipo, variable in columnas],
+        deltas,
+        valores.reshape(n_muestras, n_variables),
+    )
+
+
+def codificar_trama(codigo_interno, timestamp_base, columnas, deltas, valores):
+    """
+    Arma una trama (referencia para el firmware y para pruebas).
+    `valores` es una matriz muestras x variables; None o NaN = sin valor.
+    """
+    codigo = codigo_interno.encode("utf-8")
+    valores = np.asarray(valores, dtype="<f4").reshape(len(deltas), len(columnas))
+    return b"".join([
+        _ENCABEZADO.pack(MAGIA, VERSION, len(codigo)),
+        codigo,
+        _U32.pack(int(timestamp_base)),
+        _U16.pack(len(columnas)),
+        np.asarray(columnas, dtype="<u2").tobytes(),
+        _U16.pack(len(deltas)),
+        np.asarray(deltas, dtype="<u2").tobytes(),
+        valores.tobytes(),
+    ])
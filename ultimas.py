@@ -0,0 +1,97 @@
+from dotenv import load_dotenv
+
+import os
+
+
+load_dotenv()
+
+# Mantener y usar la tabla ultimas_mediciones (crearla antes con python manage.py ultimas)
+ULTIMAS_MEDICIONES = os.getenv("ULTIMAS_MEDICIONES", "0") in ("1", "true", "True")
+
+# Última medición de cada (sensor, variable), con las mismas columnas de `datos`
+# (la tabla se crea copiando sus tipos). No guarda id_dato: el INSERT
+# multi-fila no entrega el id de cada medición.
+ULTIMAS_TABLA_SQL = """
+    CREATE TABLE ultimas_mediciones AS
+    SELECT id_sensor, id_variable, fecha, valor, id_sesion, fecha_insercion
+    FROM datos
+    WHERE FALSE
+"""
+
+ULTIMAS_LLAVE_SQL = "ALTER TABLE ultimas_mediciones ADD PRIMARY KEY (id_sensor, id_variable)"
+
+# Las columnas se actualizan antes que `fecha`: MySQL asigna en orden y la
+# condición debe comparar con la fecha anterior
+_ACTUALIZAR_ULTIMAS_SQL = (
+    "INSERT INTO ultimas_mediciones (id_sensor, id_variable, fecha, valor, id_sesion, fecha_insercion) "
+    "VALUES (%s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE "
+    "valor = IF(VALUES(fecha) {op} fecha, VALUES(valor), valor), "
+    "id_sesion = IF(VALUES(fecha) {op} fecha, VALUES(id_sesion), id_sesion), "
+    "fecha_insercion = IF(VALUES(fecha) {op} fecha, VALUES(fecha_insercion), fecha_insercion), "
+    "fecha = GREATEST(fecha, VALUES(fecha))"
+)
+
+# Reconstrucción de un sensor desde `datos`: por variable, la fila de mayor
+# (fecha, id_dato)
+RECALCULAR_ULTIMAS_SQL = """
+    INSERT INTO ultimas_mediciones (id_sensor, id_variable, fecha, valor, id_sesion, fecha_insercion)
+    SELECT d.id_sensor, d.id_variable, d.fecha, d.valor, d.id_sesion, d.fecha_insercion
+    FROM datos AS d
+    JOIN (
+        SELECT MAX(d2.id_dato) AS id_dato
+        FROM datos AS d2
+        JOIN (
+            SELECT id_variable, MAX(fecha) AS fecha
+            FROM datos
+            WHERE id_sensor = %s
+            GROUP BY id_variable
+        ) AS m ON d2.id_variable = m.id_variable AND d2.fecha = m.fecha
+        WHERE d2.id_sensor = %s
+        GROUP BY d2.id_variable
+    ) AS u ON d.id_dato = u.id_dato
+"""
+
+# Origen para los listados en lugar de `sensores_dev.datos` (id_dato va en NULL)
+ORIGEN_ULTIMAS = "(SELECT NULL AS id_dato, u.* FROM sensores_dev.ultimas_mediciones AS u)"
+
+
+def actualizar_ultimas(cursor, filas, reemplazar_iguales=True):
+    """
+    Actualiza ultimas_mediciones con las filas recién insertadas en `datos`
+    (id_sensor, valor, fecha, id_variable, id_sesion, fecha_insercion), en la
+    misma transacción que el INSERT.
+
+    A igual fecha la medición nueva reemplaza a la guardada (tiene mayor
+    id_dato), salvo con `reemplazar_iguales` en False: con DEDUP_DATOS una
+    medición con la misma fecha es un duplicado que no se insertó.
+    No hace nada si ULTIMAS_MEDICIONES no está activo.
+    """
+    if not ULTIMAS_MEDICIONES or not filas:
+        return
+    ultimas = {}
+    for fila in filas:
+        clave = (int(fila[0]), int(fila[3]))
+        fecha = str(fila[2])
+        actual = ultimas.get(clave)
+        if actual is None or fecha > actual[0] or (fecha == actual[0] and reemplazar_iguales):
+            ultimas[clave] = (fecha, fila)
+    op = ">=" if reemplazar_iguales else ">"
+    # Siempre en el mismo orden para que dos inserciones concurrentes no se bloqueen mutuamente
+    cursor.executemany(
+        _ACTUALIZAR_ULTIMAS_SQL.format(op=op),
+        [(id_sensor, id_variable, fila[2], fila[1], fila[4], fila[5]) for (id_sensor, id_variable), (_, fila) in sorted(ultimas.items())]
+    )
+
+
+def recalcular_ultimas(cursor, filas):
+    """
+    Reconstruye desde `datos` las últimas mediciones de los sensores de las
+    filas (id_sensor, ...) después de modificarlas o eliminarlas fuera de la
+    ingesta. No hace nada si ULTIMAS_MEDICIONES no está activo.
+    """
+    if not ULTIMAS_MEDICIONES or not filas:
+        return
+    for id_sensor in sorted({int(fila[0]) for fila in filas if fila[0] is not None}):
+        cursor.execute("DELETE FROM ultimas_mediciones WHERE id_sensor = %s", (id_sensor,))
+        cursor.execute(RECALCULAR_ULTIMAS_SQL, (id_sensor, id_sensor))